@@ -76,6 +76,9 @@ export interface Metadata extends Provider_Entity_Reference {
     // Additional fields
     created_at: Date;
     deleted_at?: Date;
+    // Epoch milliseconds of the last spec or status write, filterable with $gt
+    // to fetch only the entities changed since a previous query
+    updated_at?: number;
     extension: {
         [key: string]: any;
     }
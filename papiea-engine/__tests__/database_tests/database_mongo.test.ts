@@ -26,6 +26,7 @@ import { IntentWatcher_DB } from "../../src/databases/intent_watcher_db_interfac
 import { Watchlist_DB } from "../../src/databases/watchlist_db_interface";
 import { Watchlist } from "../../src/intentful_engine/watchlist";
 import { Graveyard_DB } from "../../src/databases/graveyard_db_interface"
+import { timeout } from "../../src/utils/utils"
 
 declare var process: {
     env: {
@@ -277,6 +278,39 @@ describe("MongoDb tests", () => {
         expect(res[0].status.a).toEqual("A1");
     });
 
+    test("Spec and status writes advance updated_at", async () => {
+        expect.assertions(5);
+        const entityDb: Entity_DB = await connection.get_entity_db(logger);
+        const entity_metadata: Metadata = {
+            uuid: uuid4(),
+            kind: "test",
+            spec_version: 0,
+            status_hash: 'test-hash',
+            created_at: new Date(),
+            deleted_at: undefined,
+            provider_version: "1",
+            provider_prefix: "test",
+            extension: {}
+        };
+        const before = Date.now();
+        const created = await entityDb.update_spec(entity_metadata, { a: "A" });
+        expect(created.metadata.updated_at).toBeGreaterThanOrEqual(before);
+        await timeout(5);
+        const updated = await entityDb.update_spec(created.metadata, { a: "A1" });
+        expect(updated.metadata.updated_at).toBeGreaterThan(created.metadata.updated_at!);
+        await timeout(5);
+        const replaced = await entityDb.replace_status(updated.metadata, { a: "A1" });
+        expect(replaced.metadata.updated_at).toBeGreaterThan(updated.metadata.updated_at!);
+        await timeout(5);
+        const patched = await entityDb.update_status(replaced.metadata, { b: "B" });
+        expect(patched.metadata.updated_at).toBeGreaterThan(replaced.metadata.updated_at!);
+        // Pollers read the entities changed since their cursor
+        const changed = await entityDb.list_entities(
+            { metadata: { kind: "test", updated_at: { $gte: patched.metadata.updated_at } } }, exact_match
+        );
+        expect(changed.map(entity => entity.metadata.uuid)).toContain(entity_metadata.uuid);
+    });
+
     test("Register Provider", async () => {
         const providerDb: Provider_DB = await connection.get_provider_db(logger);
         const test_kind = {} as Kind;
@@ -665,6 +699,21 @@ describe("MongoDb tests", () => {
         expect(received[0].spec.test).toEqual("test")
     });
 
+    test("Dispose entity to graveyard advances updated_at", async () => {
+        expect.assertions(2);
+        const sample_entity = JSON.parse(JSON.stringify(entity))
+        sample_entity.metadata.uuid = uuid4()
+        const graveyardDb: Graveyard_DB = await connection.get_graveyard_db(logger);
+        const entityDb: Entity_DB = await connection.get_entity_db(logger)
+        const saved = await entityDb.update_spec(sample_entity.metadata, sample_entity.spec)
+        const written_at = saved.metadata.updated_at!
+        await timeout(5)
+        await graveyardDb.dispose(saved)
+        const received = await graveyardDb.get_entity(sample_entity.metadata)
+        expect(received.metadata.deleted_at).toBeDefined()
+        expect(received.metadata.updated_at).toBeGreaterThan(written_at)
+    });
+
     test("Dispose entity to graveyard", async () => {
         expect.assertions(3);
         const sample_entity = JSON.parse(JSON.stringify(entity))
@@ -243,4 +243,51 @@ describe("Intent Watcher tests", () => {
         expect(result.data.results.length).toBeGreaterThanOrEqual(1)
         createdWatcher = intent_watcher
     })
+    test("Intent watchers queried by uuid and by uuid list via POST API", async () => {
+        expect.hasAssertions()
+        provider = new ProviderBuilder()
+            .withVersion("0.1.0")
+            .withKinds([locationDifferKind])
+            .build()
+        await providerApiAdmin.post('/', provider);
+        const { data: { metadata } } = await entityApi.post(`/${ provider.prefix }/${ provider.version }/${ locationDifferKind.name }`, {
+            spec: {
+                x: 10,
+                y: 11
+            }
+        });
+        to_delete_metadata = metadata
+        const { data: { intent_watcher: first_watcher } } = await entityApi.put(`/${ provider.prefix }/${ provider.version }/${ locationDifferKind.name }/${ metadata.uuid }`, {
+            spec: {
+                x: 20,
+                y: 11
+            },
+            metadata: {
+                spec_version: 1
+            }
+        })
+        const { data: { intent_watcher: second_watcher } } = await entityApi.put(`/${ provider.prefix }/${ provider.version }/${ locationDifferKind.name }/${ metadata.uuid }`, {
+            spec: {
+                x: 30,
+                y: 11
+            },
+            metadata: {
+                spec_version: 2
+            }
+        })
+        createdWatcher = second_watcher
+        try {
+            const single = await entityApi.post(`/intent_watcher/filter`, { uuid: first_watcher.uuid })
+            expect(single.data.results.map((watcher: IntentWatcher) => watcher.uuid)).toEqual([first_watcher.uuid])
+            const both = await entityApi.post(`/intent_watcher/filter`, {
+                uuid: { "$in": [first_watcher.uuid, second_watcher.uuid] }
+            })
+            expect(both.data.results.map((watcher: IntentWatcher) => watcher.uuid).sort())
+                .toEqual([first_watcher.uuid, second_watcher.uuid].sort())
+            const none = await entityApi.post(`/intent_watcher/filter`, { uuid: { "$in": [] } })
+            expect(none.data.results).toEqual([])
+        } finally {
+            await intentWatcherDb.delete_watcher(first_watcher.uuid)
+        }
+    })
 })
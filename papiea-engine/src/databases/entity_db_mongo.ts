@@ -25,6 +25,10 @@ export class Entity_DB_Mongo implements Entity_DB {
                     "metadata.kind": 1, "metadata.provider_prefix": 1 },
                 { name: "provider_specific_entity_uuid", unique: true },
             );
+            await this.collection.createIndex(
+                { "metadata.kind": 1, "metadata.updated_at": 1 },
+                { name: "entity_updated_at" },
+            );
         } catch (err) {
             throw new PapieaException({ message: "Failed to setup the spec database.", cause: err })
         }
@@ -50,7 +54,8 @@ export class Entity_DB_Mongo implements Entity_DB {
                     "metadata.spec_version": 1
                 },
                 $set: {
-                    "spec": spec
+                    "spec": spec,
+                    "metadata.updated_at": Date.now()
                 },
                 $setOnInsert: additional_fields
             }, {
@@ -90,7 +95,8 @@ export class Entity_DB_Mongo implements Entity_DB {
             }, {
                     $set: {
                         "status": status,
-                        "metadata.status_hash": current_status_hash
+                        "metadata.status_hash": current_status_hash,
+                        "metadata.updated_at": Date.now()
                     },
                     $setOnInsert: {
                         "metadata.created_at": new Date()
@@ -122,7 +128,7 @@ export class Entity_DB_Mongo implements Entity_DB {
         let result: UpdateWriteOpResult
         const partial_status_query = dotnotation({"status": status});
 
-        let aggregrate_fields = []
+        let aggregrate_fields: any[] = [{ $set: {"metadata.updated_at": Date.now()} }]
         const {set_status_fields, unset_status_fields} = separate_null_fields(partial_status_query)
         const current_status_hash = getObjectHash({
             "status": status
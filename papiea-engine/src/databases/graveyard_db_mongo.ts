@@ -70,6 +70,7 @@ export class Graveyard_DB_Mongo implements Graveyard_DB {
     async save_to_graveyard(entity: Entity): Promise<void> {
         entity.metadata.spec_version++
         entity.metadata.deleted_at = new Date()
+        entity.metadata.updated_at = Date.now()
         const result = await this.collection.insertOne(entity)
         if (result.result.n !== 1) {
             throw new PapieaException({ message: `MongoDBError: Amount of saved graveyard entries should equal to 1, found ${result.result.n} entries for kind: ${entity.metadata.provider_prefix}/${entity.metadata.provider_version}/${entity.metadata.kind}.`, entity_info: { provider_prefix: entity.metadata.provider_prefix, provider_version: entity.metadata.provider_version, kind_name: entity.metadata.kind, additional_info: { "entity_uuid": entity.metadata.uuid }}})
@@ -82,7 +82,7 @@ export function createEntityAPIRouter(entity_api: Entity_API, trace: Function):
 
     router.post("/intent_watcher/filter", check_request({
         allowed_query_params: ['offset', 'limit', 'sort'],
-        allowed_body_params: ['entity_ref', 'created_at', 'status']
+        allowed_body_params: ['uuid', 'entity_ref', 'created_at', 'status']
     }), trace("filter_intent_watcher"), asyncHandler(async (req, res) => {
         const filter: any = {};
         const offset = queryToNum(req.query.offset, 'offset');
@@ -90,6 +90,9 @@ export function createEntityAPIRouter(entity_api: Entity_API, trace: Function):
         const rawSortQuery = queryToString(req.query.sort, 'sort');
         const sortParams = processSortQuery(rawSortQuery);
         const [skip, size] = processPaginationParams(offset, limit);
+        if (req.body.uuid) {
+            filter.uuid = req.body.uuid
+        }
         if (req.body.entity_ref) {
             filter.entity_ref = req.body.entity_ref
         }
@@ -0,0 +1,66 @@
+# Run from papiea-sdk/python:
+#   PYTHONPATH=. python __benchmarks__/callback_throughput.py --rates 500,1000,2000,4000 --json report.json
+# Measures the intentful callback throughput of a provider with a no-op handler,
+# which is the ceiling of what the SDK dispatch path can absorb
+import argparse
+import asyncio
+import json
+import logging
+
+from papiea.callback_harness import CallbackHarness, format_callback_report
+from papiea.python_sdk import ProviderSdk
+
+PROVIDER_PORT = 9011
+KIND_NAME = "Location"
+
+LOCATION_KIND = {
+    KIND_NAME: {
+        "type": "object",
+        "x-papiea-entity": "differ",
+        "properties": {
+            "x": {"type": "number"},
+            "y": {"type": "number"},
+        },
+    }
+}
+
+logger = logging.getLogger("callback_throughput")
+
+
+async def run(args):
+    sdk = ProviderSdk.create_provider("http://localhost:3000", "", "localhost", PROVIDER_PORT, logger=logger)
+    location = sdk.new_kind(LOCATION_KIND)
+    sdk.version("0.1.0")
+    sdk.prefix("callback_throughput")
+
+    async def move_x(ctx, entity, input):
+        return {"delay_secs": 10}
+
+    location.on("x", move_x)
+    harness = CallbackHarness(sdk, KIND_NAME, "x", entities=args.entities, max_in_flight=args.max_in_flight,
+                              latency_slo_ms=args.slo, logger=logger)
+    try:
+        return await harness.run([float(rate) for rate in args.rates.split(",")], args.step_duration)
+    finally:
+        await sdk.__aexit__(None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intentful callback throughput of the Python SDK")
+    parser.add_argument("--rates", default="250,500,1000,2000,4000,8000", help="offered callback rates per step")
+    parser.add_argument("--step-duration", type=float, default=5)
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--slo", type=float, help="p99 latency in ms above which a step counts as saturated")
+    parser.add_argument("--json", help="write the report as json to this file")
+    args = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(run(args))
+    print(format_callback_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# Run from papiea-sdk/python:
+#   PYTHONPATH=. python __benchmarks__/sdk_benchmarks.py --output results.json --baseline __benchmarks__/baseline.json
+# Exits with status 1 if any benchmark regressed beyond the tolerance or has no baseline.
+# Timings are compared relative to the stdlib json_loads_page_30 benchmark of the same run,
+# so the baseline holds across machines. Pass --absolute to compare a baseline recorded on
+# the same machine as is. Refresh the baseline with --output __benchmarks__/baseline.json
+# The baseline holds the absolute timings of the run that recorded it, json_loads_page_30
+# included: the default comparison divides the timings of each side by its own reference,
+# so the same file serves both modes
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+import opentracing
+from aiohttp import ClientSession
+
+from papiea.api import ApiInstance
+from papiea.benchmark import (
+    DEFAULT_TOLERANCE,
+    REFERENCE_BENCHMARK,
+    compare_with_baseline,
+    dump_results,
+    format_results,
+    load_baseline,
+    missing_from_baseline,
+    run_async_benchmark,
+    run_sync_benchmark,
+)
+from papiea.client import EntityCRUD
+from papiea.core import ProcedureDescription
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.transport import InMemoryTransport
+from papiea.utils import json_loads_attrs
+
+ENGINE_PORT = 3334
+PROVIDER_PORT = 9010
+PROVIDER_PREFIX = "sdk_benchmark"
+PROVIDER_VERSION = "0.1.0"
+KIND_NAME = "Location"
+# The reference is the fastest of several runs, a single one is as noisy as what it is compared with
+REFERENCE_RUNS = 5
+
+LOCATION_KIND = {
+    KIND_NAME: {
+        "type": "object",
+        "x-papiea-entity": "spec-only",
+        "properties": {
+            "x": {"type": "number"},
+            "y": {"type": "number"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+        },
+    }
+}
+
+logger = logging.getLogger("sdk_benchmarks")
+
+
+def filter_response(size: int) -> str:
+    results = []
+    for i in range(size):
+        spec = {"x": i, "y": i * 2, "tags": [f"tag_{i}", "benchmark"]}
+        results.append({
+            "metadata": {
+                "uuid": f"00000000-0000-0000-0000-{i:012}",
+                "kind": KIND_NAME,
+                "provider_prefix": PROVIDER_PREFIX,
+                "provider_version": PROVIDER_VERSION,
+                "spec_version": 1,
+                "created_at": "2020-01-01T00:00:00.000Z",
+                "deleted_at": None,
+                "extension": {},
+            },
+            "spec": spec,
+            "status": spec,
+        })
+    return json.dumps({"results": results, "entity_count": size})
+
+
+def decoding_benchmarks(iterations: int):
+    page = filter_response(30)
+    decoded = json_loads_attrs(page)
+    return [
+        run_sync_benchmark("json_loads_attrs_page_30", lambda: json_loads_attrs(page), iterations),
+        min(
+            [run_sync_benchmark(REFERENCE_BENCHMARK, lambda: json.loads(page), iterations)
+             for _ in range(REFERENCE_RUNS)],
+            key=lambda result: result.p50_ms
+        ),
+        run_sync_benchmark(
+            "attribute_dict_access_page_30",
+            lambda: [entity.metadata.uuid for entity in decoded.results if entity.spec.x >= 0],
+            iterations
+        ),
+    ]
+
+
+async def setup_provider(engine: MockEngine) -> ProviderSdk:
+    sdk = ProviderSdk.create_provider(engine.url, engine.admin_key, "localhost", PROVIDER_PORT, logger=logger)
+    location = sdk.new_kind(LOCATION_KIND)
+    sdk.version(PROVIDER_VERSION)
+    sdk.prefix(PROVIDER_PREFIX)
+
+    async def noop_handler(ctx, entity, input):
+        return {"delay_secs": 10}
+
+    async def noop_procedure(ctx, entity, input):
+        return input
+
+    location.on("x", noop_handler)
+    location.entity_procedure("noop", ProcedureDescription(), noop_procedure)
+    await sdk.register()
+    return sdk
+
+
+async def client_benchmarks(engine: MockEngine, requests: int, concurrency: int, entity_count: int):
+    results = []
+    async with EntityCRUD(engine.url, PROVIDER_PREFIX, PROVIDER_VERSION, KIND_NAME, engine.admin_key) as client:
+        entity = await client.create({"spec": {"x": 1, "y": 2, "tags": []}})
+        for i in range(entity_count - 1):
+            await client.create({"spec": {"x": i, "y": i, "tags": ["benchmark"]}})
+
+        api = ApiInstance(client.api_instance.base_url, headers=client.api_instance.headers, logger=logger)
+        results.append(await run_async_benchmark(
+            "api_instance_get", lambda: api.get(entity.metadata.uuid), requests, concurrency
+        ))
+        results.append(await run_async_benchmark(
+            "api_instance_filter_page_30", lambda: api.post("filter", {"spec": {"tags": "benchmark"}}), requests, concurrency
+        ))
+        await api.close()
+        in_memory = ApiInstance(client.api_instance.base_url, headers=client.api_instance.headers, logger=logger,
+                                transport=InMemoryTransport(engine.app))
+        results.append(await run_async_benchmark(
+            "api_instance_get_in_memory", lambda: in_memory.get(entity.metadata.uuid), requests, concurrency
+        ))
+        await in_memory.close()
+
+        async def iterate_all():
+            iter_func = await client.filter_iter({})
+            async for _ in iter_func(100):
+                pass
+
+        results.append(await run_async_benchmark(f"filter_iter_{entity_count}_entities", iterate_all, 5))
+
+        results.append(await run_async_benchmark(
+            "entity_crud_get_traced", lambda: client.get(entity.metadata), requests, concurrency
+        ))
+        # EntityCRUD closes its tracer on exit and the noop tracer has no close
+        untraced = EntityCRUD(
+            engine.url, PROVIDER_PREFIX, PROVIDER_VERSION, KIND_NAME, engine.admin_key, logger=logger,
+            tracer=opentracing.Tracer()
+        )
+        results.append(await run_async_benchmark(
+            "entity_crud_get_untraced", lambda: untraced.get(entity.metadata), requests, concurrency
+        ))
+        await untraced.api_instance.close()
+        return results, entity
+
+
+async def dispatch_benchmarks(entity, requests: int, concurrency: int):
+    callback_url = f"http://localhost:{PROVIDER_PORT}/{KIND_NAME}"
+    intentful_body = json.dumps({
+        "metadata": entity.metadata,
+        "spec": entity.spec,
+        "status": entity.status,
+        "input": [{"keys": {}, "key": "x", "spec-val": [1], "status-val": [0]}],
+    })
+    procedure_body = json.dumps({
+        "metadata": entity.metadata,
+        "spec": entity.spec,
+        "status": entity.status,
+        "input": {"value": 1},
+    })
+    headers = {"Content-Type": "application/json"}
+    async with ClientSession() as session:
+        async def post(url, body):
+            async with session.post(url, data=body, headers=headers) as resp:
+                await resp.read()
+                if resp.status >= 400:
+                    raise Exception(f"Callback failed with status: {resp.status}")
+
+        async def healthcheck():
+            async with session.get(f"http://localhost:{PROVIDER_PORT}/healthcheck") as resp:
+                await resp.read()
+
+        return [
+            await run_async_benchmark("provider_healthcheck", healthcheck, requests, concurrency),
+            await run_async_benchmark(
+                "intentful_handler_dispatch", lambda: post(f"{callback_url}/x", intentful_body), requests, concurrency
+            ),
+            await run_async_benchmark(
+                "entity_procedure_dispatch", lambda: post(f"{callback_url}/noop", procedure_body), requests, concurrency
+            ),
+        ]
+
+
+async def run(args):
+    results = decoding_benchmarks(args.iterations)
+    async with MockEngine(port=ENGINE_PORT, logger=logger) as engine:
+        sdk = await setup_provider(engine)
+        try:
+            client_results, entity = await client_benchmarks(engine, args.requests, args.concurrency, args.entities)
+            results.extend(client_results)
+            results.extend(await dispatch_benchmarks(entity, args.requests, args.concurrency))
+        finally:
+            await sdk.server.close()
+            await sdk.__aexit__(None, None, None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Python SDK benchmarks against the in-process mock engine")
+    parser.add_argument("--iterations", type=int, default=2000, help="iterations of the decoding benchmarks")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per http benchmark")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--entities", type=int, default=1000, help="entities scanned by filter_iter")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--baseline", help="baseline json to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative deviation from the baseline")
+    parser.add_argument("--absolute", action="store_true",
+                        help=f"compare absolute timings instead of timings relative to {REFERENCE_BENCHMARK}")
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+    print(format_results(results))
+    if args.output:
+        dump_results(results, args.output)
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        reference = None if args.absolute else REFERENCE_BENCHMARK
+        regressions = compare_with_baseline(results, baseline, args.tolerance, reference)
+        for regression in regressions:
+            print(f"REGRESSION {regression.name} {regression.metric}: "
+                  f"baseline {regression.baseline}, current {regression.current}")
+        missing = missing_from_baseline(results, baseline)
+        for name in missing:
+            print(f"MISSING BASELINE {name}")
+        if len(regressions) > 0 or len(missing) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
+import asyncio
 import json
 import logging
 import ssl
 from types import TracebackType
-from typing import Any, Optional, Type
+from typing import Any, AsyncGenerator, Optional, Tuple, Type
 
-from aiohttp import ClientSession, ClientTimeout
 from multidict import CIMultiDict
 
 from papiea.python_sdk_exceptions import (
@@ -16,9 +16,16 @@ from papiea.python_sdk_exceptions import (
     UnauthorizedException,
     ValidationException,
     BadRequestException,
+    CircuitOpenException,
+    ConcurrencyLimitException,
+    DeadlineExceededException,
     PapieaServerException,
     check_response
 )
+from papiea.deadline import DEADLINE_HEADER, remaining
+from papiea.json_stream import STREAM_CHUNK_SIZE, iter_json_array
+from papiea.request_timing import RequestTimer
+from papiea.transport import SessionTransport, Transport, warm_up
 from papiea.utils import json_loads_attrs
 
 class ApiInstance:
@@ -29,14 +36,32 @@ class ApiInstance:
             headers: dict = {},
             sslContext: ssl.SSLContext = ssl.create_default_context(),
             *,
-            logger: logging.Logger
+            logger: logging.Logger,
+            transport: Optional[Transport] = None,
+            warm_connections: int = 0,
+            request_timer: Optional[RequestTimer] = None,
+            connect_timeout: Optional[float] = None
     ):
         self.base_url = base_url
         self.headers = headers
+        # Seconds, timeout bounds whole requests and connect_timeout opening connections.
+        # Calls with a deadline are bounded by whichever ends first
         self.timeout = timeout
-        self.session = ClientSession(timeout=ClientTimeout(total=timeout))
+        self.connect_timeout = connect_timeout
+        # A transport passed in may be shared between instances, so it is left to the caller to close it
+        self._owns_transport = transport is None
+        # The timer only sees the requests of the transport created here, a transport passed in
+        # is timed by creating its SessionTransport with the timer's trace config
+        self.request_timer = request_timer
+        if transport is None:
+            trace_configs = [request_timer.trace_config()] if request_timer is not None else None
+            transport = SessionTransport(timeout, connect_timeout, trace_configs=trace_configs)
+        self.transport = transport
         self.sslContext = sslContext
         self.logger = logger
+        # Keep-alive connections opened by warm_up and again after every renewed session
+        self.warm_connections = warm_connections
+        self._warm_up_task: Optional[asyncio.Task] = None
 
     async def __aenter__(self) -> "ApiInstance":
         return self
@@ -55,49 +80,56 @@ class ApiInstance:
             return None
         return json_loads_attrs(res)
 
-    async def call(self, method: str, prefix: str, data: Any, headers: dict = {}):
+    def _request_headers(self, method: str, prefix: str, headers: dict) -> Tuple[CIMultiDict, Optional[float]]:
         new_headers = CIMultiDict()
         new_headers.update(self.headers)
         new_headers.update(headers)
-        data_binary = json.dumps(data).encode("utf-8")
-        # TODO: this is too much code duplication but I cannot think of
-        # a way outside macros that could abstract async with block
-        # and sadly there are no macro in python
-        if method == "get":
-            async with self.session.get(
-                    self.base_url + "/" + prefix, headers=new_headers, ssl=self.sslContext
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "post":
-            async with self.session.post(
-                    self.base_url + "/" + prefix, data=data_binary, headers=new_headers, ssl=self.sslContext
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "put":
-            async with self.session.put(
-                    self.base_url + "/" + prefix, data=data_binary, headers=new_headers, ssl=self.sslContext
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "patch":
-            async with self.session.patch(
-                    self.base_url + "/" + prefix, data=data_binary, headers=new_headers, ssl=self.sslContext
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "delete":
-            async with self.session.delete(
-                    self.base_url + "/" + prefix, headers=new_headers, ssl=self.sslContext
+        timeout_secs = remaining()
+        if timeout_secs is not None:
+            if timeout_secs <= 0:
+                raise DeadlineExceededException(f"Deadline exceeded before {method} {self.base_url}/{prefix} was sent")
+            new_headers[DEADLINE_HEADER] = str(int(timeout_secs * 1000))
+        return new_headers, timeout_secs
+
+    async def call(self, method: str, prefix: str, data: Any, headers: dict = {}):
+        new_headers, timeout_secs = self._request_headers(method, prefix, headers)
+        data_binary = json.dumps(data).encode("utf-8") if method not in ["get", "delete"] else None
+
+        async def send():
+            async with self.transport.request(
+                    method, self.base_url + "/" + prefix, data_binary, new_headers, self.sslContext
             ) as resp:
                 await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
+                return await resp.text()
+
+        if timeout_secs is None:
+            res = await send()
+        else:
+            try:
+                res = await asyncio.wait_for(send(), timeout_secs)
+            except asyncio.TimeoutError:
+                # aiohttp timeouts are TimeoutErrors too, only the passed deadline is reported as such
+                if remaining() > 0:
+                    raise
+                raise DeadlineExceededException(
+                    f"Deadline exceeded while waiting for {method} {self.base_url}/{prefix}"
+                )
+        return self.check_result(res)
+
+    async def stream(
+            self, method: str, prefix: str, data: Any, headers: dict = {}, key: str = "results"
+    ) -> AsyncGenerator[Any, None]:
+        # Yields the items of the array under key while the response is still being received.
+        # Not retried on a renewed session since part of the items may have been consumed already.
+        # The deadline is checked and propagated but not enforced while the items are consumed
+        new_headers, _ = self._request_headers(method, prefix, headers)
+        data_binary = json.dumps(data).encode("utf-8") if method not in ["get", "delete"] else None
+        async with self.transport.request(
+                method, self.base_url + "/" + prefix, data_binary, new_headers, self.sslContext
+        ) as resp:
+            await check_response(resp, self.logger)
+            async for item in iter_json_array(resp.content.iter_chunked(STREAM_CHUNK_SIZE), key):
+                yield item
 
     async def make_request(self, method: str, prefix: str, data: Any, headers: dict):
         try:
@@ -105,7 +137,8 @@ class ApiInstance:
         except (ConflictingEntityException, EntityNotFoundException,
                 PermissionDeniedException, ProcedureInvocationException,
                 UnauthorizedException, ValidationException, BadRequestException,
-                PapieaServerException, ApiException):
+                PapieaServerException, ApiException, CircuitOpenException, ConcurrencyLimitException,
+                DeadlineExceededException):
             raise
         except:
             self.logger.debug("RENEWING SESSION")
@@ -128,8 +161,22 @@ class ApiInstance:
         return await self.make_request("delete", prefix, {}, headers)
 
     async def close(self):
-        await self.session.close()
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        if self._owns_transport:
+            await self.transport.close()
+
+    async def warm_up(self, connections: Optional[int] = None) -> int:
+        connections = self.warm_connections if connections is None else connections
+        if connections <= 0:
+            return 0
+        opened = await warm_up(self.transport, self.base_url, connections, self.sslContext)
+        self.logger.debug(f"Opened {opened} of {connections} connections to {self.base_url}")
+        return opened
 
     async def renew_session(self):
-        await self.close()
-        self.session = ClientSession(timeout=ClientTimeout(total=self.timeout))
+        await self.transport.renew()
+        # The requests after the retry would otherwise all pay for new connections. Warming up
+        # runs alongside the retry, waiting for it could delay the retry by a connect timeout
+        if self.warm_connections > 0 and (self._warm_up_task is None or self._warm_up_task.done()):
+            self._warm_up_task = asyncio.ensure_future(self.warm_up())
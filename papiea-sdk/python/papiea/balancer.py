@@ -0,0 +1,241 @@
+import asyncio
+import random
+import ssl
+import time
+from typing import List, Optional, Set, Tuple, Union
+
+from aiohttp import ClientConnectionError
+from multidict import CIMultiDict
+
+from .circuit_breaker import CircuitBreakers, CircuitBreakingTransport, endpoint_of, find_breakers, route_class
+from .core import AttributeDict
+from .transport import DEFAULT_CONNECT_TIMEOUT_SECS, SessionTransport, Transport
+
+# One engine url or several engine replicas to balance the requests between
+EngineUrl = Union[str, List[str]]
+
+LEAST_OUTSTANDING = "least_outstanding"
+POWER_OF_TWO = "power_of_two"
+BALANCING_POLICIES = [LEAST_OUTSTANDING, POWER_OF_TWO]
+
+EJECT_AFTER_FAILURES = 3
+PROBE_INTERVAL_SECS = 5
+
+# Errors meaning the endpoint could not be reached, http error statuses are not counted
+CONNECTION_ERRORS = (ClientConnectionError, asyncio.TimeoutError, OSError)
+
+EndpointStats = AttributeDict
+# class EndpointStats(TypedDict):
+#     url: str
+#     healthy: bool
+#     outstanding: int
+#     requests: int
+#     failures: int
+#     ejections: int
+
+
+class Endpoint(object):
+    def __init__(self, url: str, transport: Transport):
+        self.url = url
+        self.transport = transport
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.next_probe_at = 0.0
+        self.probing = False
+
+    def stats(self) -> EndpointStats:
+        return EndpointStats(
+            url=self.url,
+            healthy=self.healthy,
+            outstanding=self.outstanding,
+            requests=self.requests,
+            failures=self.failures,
+            ejections=self.ejections,
+        )
+
+
+def load(endpoint: Endpoint) -> Tuple[int, int]:
+    # An endpoint that just failed loses against any other one not yet ejected,
+    # so the retry of the failed request goes elsewhere
+    return endpoint.consecutive_failures, endpoint.outstanding
+
+
+class BalancedRequest(object):
+    # Counts the request as outstanding on its endpoint for as long as the response is open
+    def __init__(self, balancer: "BalancingTransport", endpoint: Endpoint, request):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.request = request
+
+    async def __aenter__(self):
+        self.endpoint.outstanding += 1
+        self.endpoint.requests += 1
+        try:
+            return await self.request.__aenter__()
+        except CONNECTION_ERRORS:
+            self.endpoint.outstanding -= 1
+            self.balancer.record_failure(self.endpoint)
+            raise
+        except BaseException:
+            self.endpoint.outstanding -= 1
+            raise
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.endpoint.outstanding -= 1
+        try:
+            return await self.request.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            if exc_type is not None and issubclass(exc_type, CONNECTION_ERRORS):
+                self.balancer.record_failure(self.endpoint)
+            else:
+                self.balancer.record_success(self.endpoint)
+
+
+class BalancingTransport(Transport):
+    """Spreads the requests over several engine replicas.
+
+    Request urls are built against base_url, the first of the urls, and are
+    rewritten to the endpoint picked by the policy: the least outstanding
+    requests, or the less loaded of two random endpoints (power of two choices).
+    An endpoint failing with connection errors eject_after times in a row is
+    taken out of rotation and probed every probe_interval seconds until it
+    answers again. Each endpoint has its own connection pool unless a shared
+    transport is passed in. With circuit breakers, either passed in or found in
+    the shared transport, endpoints whose circuit for the route class of a
+    request is open are skipped while other endpoints can take it
+    """
+
+    def __init__(
+            self,
+            urls: List[str],
+            policy: str = POWER_OF_TWO,
+            transport: Optional[Transport] = None,
+            connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_SECS,
+            eject_after: int = EJECT_AFTER_FAILURES,
+            probe_interval: float = PROBE_INTERVAL_SECS,
+            breakers: Optional[CircuitBreakers] = None
+    ):
+        if len(urls) == 0:
+            raise Exception("At least one engine url is required")
+        if policy not in BALANCING_POLICIES:
+            raise Exception(f"Unknown balancing policy: {policy}, expected one of: {', '.join(BALANCING_POLICIES)}")
+        self.base_url = urls[0].rstrip("/")
+        self.policy = policy
+        self.eject_after = eject_after
+        self.probe_interval = probe_interval
+        self._owns_transports = transport is None
+        self.endpoints = [
+            Endpoint(
+                url.rstrip("/"),
+                transport if transport is not None else SessionTransport(connect_timeout=connect_timeout)
+            )
+            for url in urls
+        ]
+        self._probes: Set[asyncio.Task] = set()
+        # Breakers of a shared transport already see the endpoint urls
+        self.breakers = find_breakers(transport)
+        if breakers is not None:
+            self.attach_breakers(breakers)
+
+    def attach_breakers(self, breakers: CircuitBreakers) -> None:
+        self.breakers = breakers
+        for endpoint in self.endpoints:
+            endpoint.transport = CircuitBreakingTransport(endpoint.transport, breakers)
+
+    def _circuit_allows(self, endpoint: Endpoint, route: Optional[str]) -> bool:
+        if self.breakers is None or route is None:
+            return True
+        return self.breakers.get(endpoint_of(endpoint.url), route).allows_request()
+
+    def _pick(self, avoid: Optional[Endpoint] = None, route: Optional[str] = None) -> Endpoint:
+        now = time.monotonic()
+        healthy = []
+        for endpoint in self.endpoints:
+            if not endpoint.healthy:
+                # Only ejected endpoints are probed, a healthy one skipped as avoid is left alone
+                if not endpoint.probing and now >= endpoint.next_probe_at:
+                    self._start_probe(endpoint)
+            elif endpoint is not avoid and self._circuit_allows(endpoint, route):
+                healthy.append(endpoint)
+        if not healthy and avoid is not None and avoid.healthy:
+            healthy = [avoid]
+        # With every endpoint ejected requests still go out rather than failing without a try
+        candidates = healthy or self.endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.policy == LEAST_OUTSTANDING:
+            least = min(load(endpoint) for endpoint in candidates)
+            return random.choice([endpoint for endpoint in candidates if load(endpoint) == least])
+        first, second = random.sample(candidates, 2)
+        return first if load(first) <= load(second) else second
+
+    def record_failure(self, endpoint: Endpoint) -> None:
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after:
+            endpoint.healthy = False
+            endpoint.ejections += 1
+            endpoint.next_probe_at = time.monotonic() + self.probe_interval
+
+    def record_success(self, endpoint: Endpoint) -> None:
+        endpoint.consecutive_failures = 0
+        endpoint.healthy = True
+
+    def _start_probe(self, endpoint: Endpoint) -> None:
+        endpoint.probing = True
+        task = asyncio.ensure_future(self._probe(endpoint))
+        self._probes.add(task)
+        task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        # Any http answer short of a server error means the engine is reachable again
+        try:
+            async with endpoint.transport.request("get", endpoint.url + "/", None, CIMultiDict(), None) as resp:
+                await resp.read()
+                alive = resp.status < 500
+        except Exception:
+            alive = False
+        finally:
+            endpoint.probing = False
+        if alive:
+            self.record_success(endpoint)
+        else:
+            endpoint.next_probe_at = time.monotonic() + self.probe_interval
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext], avoid: Optional[Endpoint] = None):
+        # avoid keeps e.g. a hedged request off the endpoint of the original one while others are healthy
+        endpoint = self._pick(avoid, route_class(method, url))
+        if url.startswith(self.base_url):
+            url = endpoint.url + url[len(self.base_url):]
+        return BalancedRequest(self, endpoint, endpoint.transport.request(method, url, data, headers, ssl_context))
+
+    def stats(self) -> List[EndpointStats]:
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    async def renew(self) -> None:
+        # The retry after a failed request is sent to another endpoint once the failing
+        # one is ejected, renewing the sessions would only abort the healthy in-flight requests
+        pass
+
+    async def close(self) -> None:
+        for task in list(self._probes):
+            task.cancel()
+        if self._owns_transports:
+            for endpoint in self.endpoints:
+                await endpoint.transport.close()
+
+
+def engine_transport(
+        papiea_url: EngineUrl, transport: Optional[Transport]
+) -> Tuple[str, Optional[Transport], Optional[BalancingTransport]]:
+    # A list of engine urls gets a balancer owned by the client, which builds its
+    # request urls against the first of them
+    if isinstance(papiea_url, str):
+        return papiea_url, transport, None
+    balancer = BalancingTransport(papiea_url, transport=transport)
+    return balancer.base_url, balancer, balancer
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .core import AttributeDict
+
+BenchmarkResult = AttributeDict
+# class BenchmarkResult(TypedDict):
+#     name: str
+#     count: int
+#     errors: int
+#     duration_secs: float
+#     ops_per_sec: float
+#     mean_ms: float
+#     p50_ms: float
+#     p95_ms: float
+#     p99_ms: float
+#     max_ms: float
+
+Regression = AttributeDict
+# class Regression(TypedDict):
+#     name: str
+#     metric: str
+#     # Relative to the reference benchmark unless compared without one
+#     baseline: float
+#     current: float
+
+DEFAULT_TOLERANCE = 0.2
+
+# Metrics where a higher value is better, the rest are latencies
+THROUGHPUT_METRICS = ["ops_per_sec"]
+COMPARED_METRICS = ["ops_per_sec", "p50_ms", "p99_ms"]
+# Pure stdlib work measuring the speed of the machine, the other benchmarks are compared relative to it
+REFERENCE_BENCHMARK = "json_loads_page_30"
+
+
+class LatencyRecorder(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.samples: List[float] = []
+        self.errors = 0
+        self.error_types: Dict[str, int] = {}
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def record_error(self, e: BaseException) -> None:
+        self.errors += 1
+        error_type = type(e).__name__
+        self.error_types[error_type] = self.error_types.get(error_type, 0) + 1
+
+    def finish(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def percentile(self, p: float) -> float:
+        if len(self.samples) == 0:
+            return 0
+        ordered = sorted(self.samples)
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return ordered[index]
+
+    def histogram(self, buckets_ms: List[float]) -> Dict[str, int]:
+        counts = {}
+        for bucket in buckets_ms:
+            counts[f"<={bucket}ms"] = 0
+        counts[f">{buckets_ms[-1]}ms"] = 0
+        for sample in self.samples:
+            sample_ms = sample * 1000
+            for bucket in buckets_ms:
+                if sample_ms <= bucket:
+                    counts[f"<={bucket}ms"] += 1
+                    break
+            else:
+                counts[f">{buckets_ms[-1]}ms"] += 1
+        return counts
+
+    def result(self) -> BenchmarkResult:
+        finished_at = self.finished_at if self.finished_at is not None else time.perf_counter()
+        duration = finished_at - self.started_at
+        count = len(self.samples)
+        return BenchmarkResult(
+            name=self.name,
+            count=count,
+            errors=self.errors,
+            duration_secs=round(duration, 3),
+            ops_per_sec=round(count / duration, 2) if duration > 0 else 0,
+            mean_ms=round(sum(self.samples) / count * 1000, 4) if count > 0 else 0,
+            p50_ms=round(self.percentile(50) * 1000, 4),
+            p95_ms=round(self.percentile(95) * 1000, 4),
+            p99_ms=round(self.percentile(99) * 1000, 4),
+            max_ms=round(max(self.samples) * 1000, 4) if count > 0 else 0,
+        )
+
+
+def run_sync_benchmark(name: str, fn: Callable[[], Any], iterations: int) -> BenchmarkResult:
+    recorder = LatencyRecorder(name)
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        fn()
+        recorder.record(time.perf_counter() - started_at)
+    recorder.finish()
+    return recorder.result()
+
+
+async def run_async_benchmark(
+        name: str,
+        fn: Callable[[], Awaitable[Any]],
+        iterations: int,
+        concurrency: int = 1
+) -> BenchmarkResult:
+    recorder = LatencyRecorder(name)
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started_at = time.perf_counter()
+            try:
+                await fn()
+            except Exception as e:
+                recorder.record_error(e)
+                continue
+            recorder.record(time.perf_counter() - started_at)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    recorder.finish()
+    return recorder.result()
+
+
+async def run_open_loop(
+        fn: Callable[[float], Awaitable[Any]],
+        rate: float,
+        duration: float,
+        max_in_flight: int
+) -> None:
+    # Calls fn(scheduled_at) at a fixed rate regardless of completion, so that
+    # callers can measure latency from the scheduled start including queueing
+    semaphore = asyncio.Semaphore(max_in_flight)
+    interval = 1 / rate
+    started_at = time.perf_counter()
+    deadline = started_at + duration
+    tasks = set()
+    issued = 0
+
+    async def issue(scheduled_at: float):
+        async with semaphore:
+            await fn(scheduled_at)
+
+    while True:
+        scheduled_at = started_at + issued * interval
+        if scheduled_at >= deadline:
+            break
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(issue(scheduled_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        issued += 1
+    if len(tasks) > 0:
+        await asyncio.wait(tasks)
+
+
+def compare_with_baseline(
+        results: List[BenchmarkResult],
+        baseline: Dict[str, Any],
+        tolerance: float = DEFAULT_TOLERANCE,
+        reference: Optional[str] = REFERENCE_BENCHMARK
+) -> List[Regression]:
+    """Returns the metrics of results that are worse than the baseline by more than tolerance.
+
+    Timings of a baseline recorded on another machine are not comparable as is, so
+    with a reference benchmark every metric is taken relative to the same metric of
+    the reference in the same run, on both sides. reference None compares absolute
+    values, for baselines recorded on the machine running the comparison. Any
+    error beyond the errors of the baseline is a regression
+    """
+    by_name = {result.name: result for result in results}
+    if reference is not None and (reference not in by_name or reference not in baseline):
+        raise Exception(f"Reference benchmark {reference} is missing from the results or the baseline")
+    regressions = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None or result.name == reference:
+            continue
+        if result.errors > base.get("errors", 0):
+            regressions.append(Regression(
+                name=result.name, metric="errors", baseline=base.get("errors", 0), current=result.errors
+            ))
+        for metric in COMPARED_METRICS:
+            if not base.get(metric):
+                continue
+            current = result[metric]
+            base_value = base[metric]
+            if reference is not None:
+                if not baseline[reference].get(metric) or not by_name[reference][metric]:
+                    continue
+                current = current / by_name[reference][metric]
+                base_value = base_value / baseline[reference][metric]
+            if metric in THROUGHPUT_METRICS:
+                regressed = current < base_value * (1 - tolerance)
+            else:
+                regressed = current > base_value * (1 + tolerance)
+            if regressed:
+                regressions.append(Regression(
+                    name=result.name, metric=metric, baseline=round(base_value, 4), current=round(current, 4)
+                ))
+    return regressions
+
+
+def missing_from_baseline(results: List[BenchmarkResult], baseline: Dict[str, Any]) -> List[str]:
+    # Benchmarks without a baseline would otherwise never be compared
+    return [result.name for result in results if result.name not in baseline]
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump_results(results: List[BenchmarkResult], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump({result.name: result for result in results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    lines = [f"{'benchmark':<40} {'ops/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10} {'errors':>7}"]
+    for result in results:
+        lines.append(
+            f"{result.name:<40} {result.ops_per_sec:>12} {result.p50_ms:>10} {result.p95_ms:>10} "
+            f"{result.p99_ms:>10} {result.max_ms:>10} {result.errors:>7}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import base64
+import json
+import random
+import sys
+import time
+from typing import Dict, IO, List, Optional
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from .benchmark import LatencyRecorder
+from .core import AttributeDict
+from .transport import SessionTransport, Transport
+
+# Records waiting for the writer task, more are dropped rather than holding up the handlers
+MAX_QUEUED_RECORDS = 10000
+REDACTED_HEADERS = ["authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key"]
+# Hop-by-hop and length headers are recomputed when a request is replayed
+SKIPPED_HEADERS = ["host", "content-length", "transfer-encoding", "connection"]
+
+CapturedCallback = AttributeDict
+# class CapturedCallback(TypedDict):
+#     ts: float
+#     method: str
+#     path: str
+#     query: str
+#     headers: Dict[str, str]
+#     body: str
+#     body_b64: Optional[str]
+#     status: int
+#     duration_ms: float
+
+ReplayReport = AttributeDict
+# class ReplayReport(TypedDict):
+#     requests: int
+#     errors: int
+#     status_mismatches: int
+#     speed: float
+#     duration_secs: float
+#     p50_ms: float
+#     p95_ms: float
+#     p99_ms: float
+#     max_ms: float
+
+
+class CallbackCapture(object):
+    # Appends a sample of the incoming provider callbacks to an NDJSON log,
+    # one compact json object per line, with secret headers stripped. Records are
+    # queued and written by a background task in the default executor, so handlers
+    # never wait for the disk; records beyond max_queued are dropped and counted
+    def __init__(
+            self, path: str, sample_rate: float = 1.0, redact_headers: List[str] = REDACTED_HEADERS,
+            max_queued: int = MAX_QUEUED_RECORDS
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.redact_headers = {header.lower() for header in redact_headers}
+        self.dropped = 0
+        self.write_errors = 0
+        self.max_queued = max_queued
+        self._file: Optional[IO[str]] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Future] = None
+
+    def open(self) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a")
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            await self._queue.join()
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, record: CapturedCallback) -> None:
+        if self._writer is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._writer = asyncio.ensure_future(self._write_queued())
+        try:
+            self._queue.put_nowait(json.dumps(record, separators=(",", ":")) + "\n")
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _append(self, lines: List[str]) -> None:
+        self.open()
+        self._file.writelines(lines)
+        self._file.flush()
+
+    async def _write_queued(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            lines = [await self._queue.get()]
+            while not self._queue.empty():
+                lines.append(self._queue.get_nowait())
+            try:
+                await loop.run_in_executor(None, self._append, lines)
+            except Exception:
+                self.write_errors += len(lines)
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return await handler(request)
+        ts = time.time()
+        started_at = time.perf_counter()
+        body = await request.read()
+        # Errors raised by the handler are recorded with the status they are answered with
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            record = CapturedCallback(
+                ts=ts,
+                method=request.method,
+                path=request.path,
+                query=request.query_string,
+                headers={
+                    name: value for name, value in request.headers.items()
+                    if name.lower() not in self.redact_headers and name.lower() not in SKIPPED_HEADERS
+                },
+                status=status,
+                duration_ms=round((time.perf_counter() - started_at) * 1000, 3),
+            )
+            try:
+                record.body = body.decode("utf-8")
+            except UnicodeDecodeError:
+                record.body_b64 = base64.b64encode(body).decode("ascii")
+            self.write(record)
+        return response
+
+
+def load_capture(path: str) -> List[CapturedCallback]:
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line, object_hook=AttributeDict))
+    records.sort(key=lambda record: record.ts)
+    return records
+
+
+def captured_body(record: CapturedCallback) -> bytes:
+    if record.get("body_b64") is not None:
+        return base64.b64decode(record.body_b64)
+    return record.get("body", "").encode("utf-8")
+
+
+async def replay_callbacks(
+        records: List[CapturedCallback],
+        base_url: str,
+        speed: float = 1.0,
+        headers: Optional[Dict[str, str]] = None,
+        transport: Optional[Transport] = None
+) -> ReplayReport:
+    """Re-issues captured callbacks against the provider at base_url.
+
+    Inter-arrival times of the capture are divided by speed, so 1 preserves the
+    original timing, 2 replays twice as fast and 0 sends everything at once.
+    headers are added to every request, e.g. to restore the stripped Authorization.
+    Requests go over http unless a transport is given, e.g. an InMemoryTransport of
+    the provider server app dispatches them in process
+    """
+    recorder = LatencyRecorder("replay")
+    mismatches = 0
+    own_transport = transport is None
+    if own_transport:
+        transport = SessionTransport()
+
+    async def send(record: CapturedCallback, scheduled_at: float):
+        nonlocal mismatches
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request_headers = CIMultiDict(record.headers, **(headers or {}))
+        url = base_url + record.path + (f"?{record.query}" if record.query else "")
+        try:
+            async with transport.request(record.method, url, captured_body(record), request_headers, None) as resp:
+                await resp.read()
+                if resp.status != record.status:
+                    mismatches += 1
+        except Exception as e:
+            recorder.record_error(e)
+            return
+        recorder.record(time.perf_counter() - scheduled_at)
+
+    try:
+        if len(records) > 0:
+            started_at = time.perf_counter()
+            first_ts = records[0].ts
+            await asyncio.gather(*[
+                send(record, started_at + ((record.ts - first_ts) / speed if speed > 0 else 0))
+                for record in records
+            ])
+    finally:
+        if own_transport:
+            await transport.close()
+    recorder.finish()
+    result = recorder.result()
+    return ReplayReport(
+        requests=len(records),
+        errors=result.errors,
+        status_mismatches=mismatches,
+        speed=speed,
+        duration_secs=result.duration_secs,
+        p50_ms=result.p50_ms,
+        p95_ms=result.p95_ms,
+        p99_ms=result.p99_ms,
+        max_ms=result.max_ms,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="papiea-replay", description="Replay captured provider callbacks")
+    parser.add_argument("capture", help="NDJSON capture written by ProviderServerManager.capture")
+    parser.add_argument("--url", required=True, help="provider base url, e.g. http://localhost:9000")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="inter-arrival time scale, 2 replays twice as fast, 0 as fast as possible")
+    parser.add_argument("--header", action="append", default=[], help="extra header as name:value, repeatable")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    headers = {}
+    for header in args.header:
+        name, _, value = header.partition(":")
+        headers[name.strip()] = value.strip()
+    try:
+        records = load_capture(args.capture)
+        report = asyncio.get_event_loop().run_until_complete(
+            replay_callbacks(records, args.url.rstrip("/"), args.speed, headers)
+        )
+    except Exception as e:
+        print(f"papiea-replay: {e}", file=sys.stderr)
+        sys.exit(2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"replayed {report.requests} callbacks at speed {report.speed} in {report.duration_secs}s, "
+              f"errors: {report.errors}, status mismatches: {report.status_mismatches}")
+        print(f"p50: {report.p50_ms}ms p95: {report.p95_ms}ms p99: {report.p99_ms}ms max: {report.max_ms}ms")
@@ -0,0 +1,202 @@
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import ClientSession, TCPConnector
+
+from .benchmark import LatencyRecorder, run_open_loop
+from .core import AttributeDict, Entity
+from .python_sdk import ProviderSdk
+
+PHASES = ["parse", "context", "handler", "serialize"]
+DEFAULT_RATES = [100, 200, 400, 800, 1600, 3200]
+# A step is saturated when the provider absorbs less than this share of the offered load
+SATURATION_THROUGHPUT_RATIO = 0.95
+
+CallbackStep = AttributeDict
+# class CallbackStep(TypedDict):
+#     rate: float
+#     throughput: float
+#     errors: int
+#     p50_ms: float
+#     p95_ms: float
+#     p99_ms: float
+#     max_ms: float
+#     phases_ms: Dict[str, float]
+#     saturated: bool
+
+CallbackReport = AttributeDict
+# class CallbackReport(TypedDict):
+#     kind: str
+#     signature: str
+#     entities: int
+#     saturation_rate: Optional[float]
+#     max_throughput: float
+#     steps: List[CallbackStep]
+
+
+def default_entity(i: int, kind: str, signature: str) -> Entity:
+    return Entity(
+        metadata={
+            "uuid": str(uuid.uuid4()),
+            "kind": kind,
+            "spec_version": 1,
+            "created_at": "2020-01-01T00:00:00.000Z",
+            "deleted_at": None,
+        },
+        spec={signature: i},
+        status={signature: i - 1},
+    )
+
+
+def diff_input(entity: Entity, signature: str) -> List[dict]:
+    return [{
+        "keys": {},
+        "key": signature,
+        "spec-val": [entity["spec"].get(signature)] if isinstance(entity["spec"], dict) else [],
+        "status-val": [entity["status"].get(signature)] if isinstance(entity["status"], dict) else [],
+    }]
+
+
+class CallbackHarness(object):
+    """Measures how many intentful callbacks per second a provider absorbs.
+
+    The provider server is started in-process and fed synthesized diff callbacks
+    for `entities` distinct entities in open loop at each of the rates. Every
+    step reports the achieved throughput, latency percentiles and the mean time
+    spent in parse, context build, handler and serialize phases of the callback.
+    Handlers that call back into the engine (e.g. update_status) need the sdk to
+    point at a reachable engine, such as the MockEngine
+    """
+
+    def __init__(
+            self,
+            sdk: ProviderSdk,
+            kind: str,
+            signature: str,
+            entities: int = 1000,
+            entity_factory: Optional[Callable[[int], Entity]] = None,
+            max_in_flight: int = 256,
+            latency_slo_ms: Optional[float] = None,
+            headers: Optional[Dict[str, str]] = None,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        self.sdk = sdk
+        self.kind = kind
+        self.signature = signature
+        self.entities = entities
+        self.entity_factory = entity_factory or (lambda i: default_entity(i, kind, signature))
+        self.max_in_flight = max_in_flight
+        self.latency_slo_ms = latency_slo_ms
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.logger = logger
+        self._phases: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+
+    @property
+    def callback_url(self) -> str:
+        return self.sdk.server.procedure_callback_url(self.signature, self.kind)
+
+    def _payloads(self) -> List[bytes]:
+        payloads = []
+        for i in range(self.entities):
+            entity = self.entity_factory(i)
+            body = dict(entity, input=diff_input(entity, self.signature))
+            payloads.append(json.dumps(body).encode("utf-8"))
+        return payloads
+
+    def _observe(self, route: str, phases: Dict[str, float]) -> None:
+        for phase, seconds in phases.items():
+            self._phases[phase].append(seconds)
+
+    async def run_step(self, session: ClientSession, payloads: List[bytes], rate: float, duration: float) -> CallbackStep:
+        recorder = LatencyRecorder(f"callbacks_{rate}")
+        self._phases = {phase: [] for phase in PHASES}
+        issued = 0
+        url = self.callback_url
+
+        async def callback(scheduled_at: float):
+            nonlocal issued
+            payload = payloads[issued % len(payloads)]
+            issued += 1
+            try:
+                async with session.post(url, data=payload, headers=self.headers) as resp:
+                    await resp.read()
+                    if resp.status >= 400:
+                        raise Exception(f"Callback failed with status: {resp.status}")
+            except Exception as e:
+                recorder.record_error(e)
+                return
+            recorder.record(time.perf_counter() - scheduled_at)
+
+        await run_open_loop(callback, rate, duration, self.max_in_flight)
+        recorder.finish()
+        result = recorder.result()
+        saturated = result.ops_per_sec < rate * SATURATION_THROUGHPUT_RATIO or result.errors > 0
+        if self.latency_slo_ms is not None and result.p99_ms > self.latency_slo_ms:
+            saturated = True
+        return CallbackStep(
+            rate=rate,
+            throughput=result.ops_per_sec,
+            errors=result.errors,
+            p50_ms=result.p50_ms,
+            p95_ms=result.p95_ms,
+            p99_ms=result.p99_ms,
+            max_ms=result.max_ms,
+            phases_ms={
+                phase: round(sum(samples) / len(samples) * 1000, 4) if len(samples) > 0 else 0
+                for phase, samples in self._phases.items()
+            },
+            saturated=saturated,
+        )
+
+    async def run(
+            self, rates: List[float] = DEFAULT_RATES, step_duration: float = 5, stop_on_saturation: bool = True
+    ) -> CallbackReport:
+        server = self.sdk.server
+        started_server = not server.running
+        if started_server:
+            await server.start_server()
+        previous_observer = server.callback_phase_observer
+        server.callback_phase_observer = self._observe
+        steps = []
+        try:
+            payloads = self._payloads()
+            async with ClientSession(connector=TCPConnector(limit=self.max_in_flight)) as session:
+                for rate in rates:
+                    step = await self.run_step(session, payloads, rate, step_duration)
+                    self.logger.info(f"Callback rate: {rate}/s, throughput: {step.throughput}/s, p99: {step.p99_ms}ms")
+                    steps.append(step)
+                    if step.saturated and stop_on_saturation:
+                        break
+        finally:
+            server.callback_phase_observer = previous_observer
+            if started_server:
+                await server.close()
+        saturation = next((step.rate for step in steps if step.saturated), None)
+        return CallbackReport(
+            kind=self.kind,
+            signature=self.signature,
+            entities=self.entities,
+            saturation_rate=saturation,
+            max_throughput=max([step.throughput for step in steps], default=0),
+            steps=steps,
+        )
+
+
+def format_callback_report(report: CallbackReport) -> str:
+    saturation = f"{report.saturation_rate}/s" if report.saturation_rate is not None else "not reached"
+    lines = [
+        f"kind {report.kind}, signature {report.signature}, {report.entities} entities",
+        f"saturation: {saturation}, max throughput: {report.max_throughput}/s",
+        "",
+        f"{'rate':>8} {'thrpt':>10} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        + " ".join(f"{phase + ' ms':>12}" for phase in PHASES),
+    ]
+    for step in report.steps:
+        lines.append(
+            f"{step.rate:>8} {step.throughput:>10} {step.errors:>7} {step.p50_ms:>9} {step.p95_ms:>9} {step.p99_ms:>9} "
+            + " ".join(f"{step.phases_ms[phase]:>12}" for phase in PHASES)
+        )
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import ssl
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from multidict import CIMultiDict
+
+from .core import AttributeDict
+from .python_sdk_exceptions import CircuitOpenException
+from .transport import UNIX_SCHEME, Transport, split_unix_url
+
+READS = "reads"
+WRITES = "writes"
+STATUS_UPDATES = "status_updates"
+PROCEDURES = "procedures"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = 5
+OPEN_SECS = 10
+HALF_OPEN_PROBES = 1
+
+CircuitStats = AttributeDict
+# class CircuitStats(TypedDict):
+#     endpoint: str
+#     route_class: str
+#     state: str
+#     requests: int
+#     failures: int
+#     rejected: int
+#     opened: int
+
+
+def route_class(method: str, url: str) -> str:
+    path = urlsplit(url).path
+    if "/procedure/" in path:
+        return PROCEDURES
+    if path.endswith("/update_status"):
+        return STATUS_UPDATES
+    if method.lower() == "get" or path.endswith("/filter"):
+        return READS
+    return WRITES
+
+
+def endpoint_of(url: str) -> str:
+    if url.startswith(UNIX_SCHEME):
+        return UNIX_SCHEME + split_unix_url(url)[0]
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class CircuitBreaker(object):
+    """Fails requests fast while an endpoint keeps failing them.
+
+    failure_threshold failures in a row, either errors or calls slower than
+    slow_call_secs, open the circuit. After open_secs it turns half open and lets
+    half_open_probes requests through, closing again once they all succeed and
+    reopening on the first failure
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            route_class: str,
+            failure_threshold: int = FAILURE_THRESHOLD,
+            slow_call_secs: Optional[float] = None,
+            open_secs: float = OPEN_SECS,
+            half_open_probes: int = HALF_OPEN_PROBES,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        self.endpoint = endpoint
+        self.route_class = route_class
+        self.failure_threshold = failure_threshold
+        self.slow_call_secs = slow_call_secs
+        self.open_secs = open_secs
+        self.half_open_probes = half_open_probes
+        self.logger = logger
+        self.state = CLOSED
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            self.logger.warning(f"Circuit for {self.route_class} requests to {self.endpoint} is now {state}")
+            self.state = state
+
+    def before_request(self) -> None:
+        if self.state == OPEN:
+            retry_after = self._opened_at + self.open_secs - time.monotonic()
+            if retry_after > 0:
+                self.rejected += 1
+                raise CircuitOpenException(self.endpoint, self.route_class, retry_after)
+            self._transition(HALF_OPEN)
+            self._probes = 0
+            self._probe_successes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenException(self.endpoint, self.route_class, 0)
+            self._probes += 1
+        self.requests += 1
+
+    def allows_request(self) -> bool:
+        # Whether before_request would let a request through, without counting it
+        if self.state == OPEN:
+            return time.monotonic() >= self._opened_at + self.open_secs
+        if self.state == HALF_OPEN:
+            return self._probes < self.half_open_probes
+        return True
+
+    def record(self, success: bool, duration: float) -> None:
+        if success and self.slow_call_secs is not None and duration > self.slow_call_secs:
+            success = False
+        if not success:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self.state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._open()
+            return
+        self._consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._transition(CLOSED)
+
+    def cancel(self) -> None:
+        # A cancelled probe neither closes nor reopens the circuit, it frees the slot for another one
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _open(self) -> None:
+        if self.state != OPEN:
+            self.opened += 1
+        self._opened_at = time.monotonic()
+        self._transition(OPEN)
+
+    def stats(self) -> CircuitStats:
+        return CircuitStats(
+            endpoint=self.endpoint,
+            route_class=self.route_class,
+            state=self.state,
+            requests=self.requests,
+            failures=self.failures,
+            rejected=self.rejected,
+            opened=self.opened,
+        )
+
+
+class CircuitBreakers(object):
+    # Circuit breakers created on demand for each endpoint and route class, all with the same settings
+    def __init__(
+            self,
+            failure_threshold: int = FAILURE_THRESHOLD,
+            slow_call_secs: Optional[float] = None,
+            open_secs: float = OPEN_SECS,
+            half_open_probes: int = HALF_OPEN_PROBES,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        self.failure_threshold = failure_threshold
+        self.slow_call_secs = slow_call_secs
+        self.open_secs = open_secs
+        self.half_open_probes = half_open_probes
+        self.logger = logger
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, endpoint: str, route_class: str) -> CircuitBreaker:
+        breaker = self._breakers.get((endpoint, route_class))
+        if breaker is None:
+            breaker = CircuitBreaker(
+                endpoint, route_class, self.failure_threshold, self.slow_call_secs, self.open_secs,
+                self.half_open_probes, self.logger
+            )
+            self._breakers[(endpoint, route_class)] = breaker
+        return breaker
+
+    def stats(self) -> List[CircuitStats]:
+        return [breaker.stats() for breaker in self._breakers.values()]
+
+    def open_circuits(self) -> List[CircuitStats]:
+        return [breaker.stats() for breaker in self._breakers.values() if breaker.state != CLOSED]
+
+
+def find_breakers(transport: Optional[Transport]) -> Optional[CircuitBreakers]:
+    # Walks down a chain of wrapping transports, e.g. hedging over a balancer over breakers
+    while transport is not None:
+        breakers = getattr(transport, "breakers", None)
+        if isinstance(breakers, CircuitBreakers):
+            return breakers
+        transport = getattr(transport, "transport", None)
+    return None
+
+
+class BreakerRequest(object):
+    # The request is only created once the circuit lets it through
+    def __init__(self, breaker: CircuitBreaker, make_request: Callable[[], Any]):
+        self.breaker = breaker
+        self.make_request = make_request
+        self.request = None
+
+    async def __aenter__(self):
+        self.breaker.before_request()
+        self.request = self.make_request()
+        started_at = time.perf_counter()
+        try:
+            resp = await self.request.__aenter__()
+        except asyncio.CancelledError:
+            self.breaker.cancel()
+            raise
+        except Exception:
+            self.breaker.record(False, time.perf_counter() - started_at)
+            raise
+        # Client errors are the caller's fault, only overload and server errors count
+        self.breaker.record(resp.status < 500 and resp.status != 429, time.perf_counter() - started_at)
+        return resp
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self.request.__aexit__(exc_type, exc_val, exc_tb)
+
+
+class CircuitBreakingTransport(Transport):
+    """Guards another transport with a circuit breaker per endpoint and route class.
+
+    Route classes are reads, writes, status updates and procedures, so e.g. slow
+    procedures do not stop status updates. Requests of an open circuit raise
+    CircuitOpenException without being sent. Either above or below a
+    BalancingTransport the circuits are kept per engine replica
+    """
+
+    def __init__(self, transport: Transport, breakers: Optional[CircuitBreakers] = None):
+        self.transport = transport
+        self.breakers = breakers if breakers is not None else CircuitBreakers()
+        # A balancer below would only ever show its base url, it applies the breakers
+        # per endpoint itself and skips the endpoints whose circuit is open
+        attach_breakers = getattr(transport, "attach_breakers", None)
+        self._delegated = attach_breakers is not None
+        if self._delegated:
+            attach_breakers(self.breakers)
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        if self._delegated:
+            return self.transport.request(method, url, data, headers, ssl_context)
+        breaker = self.breakers.get(endpoint_of(url), route_class(method, url))
+        return BreakerRequest(breaker, lambda: self.transport.request(method, url, data, headers, ssl_context))
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        await self.transport.close()
@@ -1,46 +1,148 @@
+import asyncio
+import json
 import time
 import logging
 import ssl
 from types import TracebackType
-from typing import Any, Optional, List, Type, Callable, AsyncGenerator
+from typing import Any, Optional, List, Type, Callable, AsyncGenerator, Dict, Tuple
+from urllib.parse import urlencode
 
-from opentracing import Tracer
+from opentracing import Span, Tracer
 
 from .api import ApiInstance
-from .core import AttributeDict, Entity, EntityReference, EntitySpec, IntentfulStatus, IntentWatcher, Metadata, Secret, \
-    Spec
+from .balancer import EngineUrl, engine_transport
+from .core import AttributeDict, Entity, EntityEvent, EntityReference, EntitySpec, IntentfulStatus, IntentWatcher, \
+    Kind, Metadata, Secret, Spec
+from .priority import BULK, priority, with_priority
+from .request_timing import request_span_scope
 from .tracing_utils import init_default_tracer, inject_tracing_headers
+from .transport import Transport
+from .utils import extract_references, reference_paths
+from .watch import ACTIVE_WATCHER_STATUSES, INTENT_POLL_INTERVAL_SECS, WATCH_INTERVAL_SECS, ChangeSource, \
+    IntentWatcherPoller, IntentWatcherTransition, KindWatcher, PollingChangeSource, changed_watchers, created_watchers
 
 FilterResults = AttributeDict
 
 BATCH_SIZE = 20
+REFERENCE_GRAPH_CONCURRENCY = 10
+SCAN_SORT = "metadata.uuid:asc"
+SCAN_CONCURRENCY = 4
+TRANSITIONS_SORT = "last_status_changed:desc"
+CREATED_WATCHERS_SORT = "created_at:desc"
+
+
+def pagination_query(offset: Optional[int] = None, limit: Optional[int] = None, sort: Optional[str] = None) -> str:
+    params = {}
+    if offset:
+        params["offset"] = offset
+    if limit:
+        params["limit"] = limit
+    if sort:
+        params["sort"] = sort
+    if len(params) == 0:
+        return ""
+    return "?" + urlencode(params)
+
+
+async def fetch_reference_graph(
+        root: Entity,
+        kinds: List[Kind],
+        get_kind: Callable[[str], "EntityCRUD"],
+        max_depth: int,
+        concurrency: int,
+        batch_size: Optional[int]
+) -> Dict[str, Entity]:
+    # Walks the references of the root entity breadth-first, each level is fetched
+    # with a single uuid filter per kind. Already requested uuids are never fetched
+    # again, thus cycles in the reference graph are cut off. The clients of get_kind
+    # are closed once the graph is fetched
+    kind_paths = {kind.name: reference_paths(kind.kind_structure) for kind in kinds}
+    graph = {root.metadata.uuid: root}
+    requested = {root.metadata.uuid}
+    clients = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def references_of(entity: Entity) -> List[EntityReference]:
+        paths = kind_paths.get(entity.metadata.kind, [])
+        return extract_references(entity.get("spec"), paths) + extract_references(entity.get("status"), paths)
+
+    async def fetch(kind: str, uuids: List[str]) -> List[Entity]:
+        async with semaphore:
+            client = clients.get(kind)
+            if client is None:
+                client = clients[kind] = get_kind(kind)
+            res = await client.filter({"metadata": {"uuid": {"$in": uuids}}, "limit": len(uuids)})
+            return res.results
+
+    try:
+        frontier = [root]
+        depth = 0
+        while len(frontier) > 0 and depth < max_depth:
+            pending = {}
+            for entity in frontier:
+                for ref in references_of(entity):
+                    if ref["uuid"] not in requested:
+                        requested.add(ref["uuid"])
+                        pending.setdefault(ref["kind"], []).append(ref["uuid"])
+            batches = []
+            for kind, uuids in pending.items():
+                step = batch_size or len(uuids)
+                for i in range(0, len(uuids), step):
+                    batches.append(fetch(kind, uuids[i:i + step]))
+            frontier = []
+            for results in await asyncio.gather(*batches):
+                for entity in results:
+                    graph[entity.metadata.uuid] = entity
+                    frontier.append(entity)
+            depth += 1
+    finally:
+        for client in clients.values():
+            await client.api_instance.close()
+    return graph
 
 
 class EntityCRUD(object):
     def __init__(
             self,
-            papiea_url: str,
+            papiea_url: EngineUrl,
             prefix: str,
             version: str,
             kind: str,
             s2skey: Optional[str] = None,
             sslContext: ssl.SSLContext = ssl.create_default_context(),
             logger: logging.Logger = logging.getLogger(__name__),
-            tracer: Tracer = init_default_tracer()
+            tracer: Tracer = init_default_tracer(),
+            transport: Optional[Transport] = None,
+            warm_connections: int = 0,
+            parent_span: Optional[Span] = None
     ):
+        papiea_url, transport, self._balancer = engine_transport(papiea_url, transport)
         headers = {
             "Content-Type": "application/json",
         }
         if s2skey is not None:
             headers["Authorization"] = f"Bearer {s2skey}"
         self.api_instance = ApiInstance(
-            f"{papiea_url}/services/{prefix}/{version}/{kind}", headers=headers, logger=logger, sslContext=sslContext
+            f"{papiea_url}/services/{prefix}/{version}/{kind}", headers=headers, logger=logger, sslContext=sslContext,
+            transport=transport, warm_connections=warm_connections
         )
+        self.transport = transport
+        self.papiea_url = papiea_url
+        self.prefix = prefix
+        self.version = version
         self.kind = kind
+        self.s2skey = s2skey
+        self.sslContext = sslContext
+        self.logger = logger
         self.tracer = tracer
+        # Spans of the client calls are children of parent_span, e.g. the fetches of a reference graph
+        self.parent_span = parent_span
         self.__constructor_present = None
+        self._watchers: Dict[str, KindWatcher] = {}
+        self._intent_watcher_client: Optional[IntentWatcherClient] = None
 
     async def __aenter__(self) -> "EntityCRUD":
+        await self.api_instance.warm_up()
         return self
 
     async def __aexit__(
@@ -49,46 +151,111 @@ class EntityCRUD(object):
             exc_val: Optional[BaseException],
             exc_tb: Optional[TracebackType],
     ) -> None:
+        for watcher in list(self._watchers.values()):
+            await watcher.stop()
+        if self._intent_watcher_client is not None:
+            await self._intent_watcher_client.close()
         await self.api_instance.close()
+        if self._balancer is not None:
+            await self._balancer.close()
         self.tracer.close()
 
     async def get(self, entity_reference: EntityReference) -> Entity:
-        with self.tracer.start_span(operation_name=f"get_entity_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"get_entity_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             return await self.api_instance.get(entity_reference.uuid)
 
     async def get_all(self) -> List[Entity]:
-        with self.tracer.start_span(operation_name=f"list_entities_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"list_entities_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             res = await self.api_instance.get("")
             return res.results
 
+    async def get_all_stream(self) -> AsyncGenerator[Entity, None]:
+        # Like get_all, entities are decoded one at a time as the response arrives
+        with self.tracer.start_span(
+                operation_name=f"list_entities_stream_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
+            inject_tracing_headers(self.tracer, span, self.api_instance)
+            async for entity in self.api_instance.stream("get", "", {}):
+                yield entity
+
     async def create(self, payload: Any) -> EntitySpec:
-        with self.tracer.start_span(operation_name=f"create_entity_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"create_entity_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             return await self.api_instance.post("", payload)
 
     async def update(self, metadata: Metadata, spec: Spec) -> EntitySpec:
-        with self.tracer.start_span(operation_name=f"update_entity_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"update_entity_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             payload = {"metadata": metadata, "spec": spec}
             return await self.api_instance.put(metadata.uuid, payload)
 
+    async def create_and_wait(
+            self, payload: Any, timeout_secs: Optional[float] = None
+    ) -> Tuple[Optional[IntentWatcher], Entity]:
+        result = await self.create(payload)
+        return await self._wait_for_intent(result, timeout_secs)
+
+    async def update_and_wait(
+            self, metadata: Metadata, spec: Spec, timeout_secs: Optional[float] = None
+    ) -> Tuple[Optional[IntentWatcher], Entity]:
+        result = await self.update(metadata, spec)
+        return await self._wait_for_intent(result, timeout_secs)
+
+    async def _wait_for_intent(
+            self, result: EntitySpec, timeout_secs: Optional[float]
+    ) -> Tuple[Optional[IntentWatcher], Entity]:
+        watcher = None
+        if result.get("intent_watcher") is not None:
+            if self._intent_watcher_client is None:
+                self._intent_watcher_client = IntentWatcherClient(
+                    self.papiea_url, self.s2skey, self.sslContext, self.logger, self.tracer, self.transport
+                )
+            watcher = await self._intent_watcher_client.wait_for_completion(result.intent_watcher, timeout_secs)
+        return watcher, await self.get(result.metadata)
+
     async def delete(self, entity_reference: EntityReference) -> None:
-        with self.tracer.start_span(operation_name=f"delete_entity_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"delete_entity_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             return await self.api_instance.delete(entity_reference.uuid)
 
-    async def filter(self, filter_obj: Any) -> FilterResults:
-        with self.tracer.start_span(operation_name=f"filter_entities_client") as span:
+    async def filter(self, filter_obj: Any, deleted: bool = False) -> FilterResults:
+        with self.tracer.start_span(
+                operation_name=f"filter_entities_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
+            if deleted:
+                return await self.api_instance.post("filter?deleted=true", filter_obj)
             return await self.api_instance.post("filter", filter_obj)
 
+    async def filter_stream(self, filter_obj: Any, deleted: bool = False) -> AsyncGenerator[Entity, None]:
+        # Like filter, entities are decoded one at a time as the response arrives
+        with self.tracer.start_span(
+                operation_name=f"filter_entities_stream_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
+            inject_tracing_headers(self.tracer, span, self.api_instance)
+            prefix = "filter?deleted=true" if deleted else "filter"
+            async for entity in self.api_instance.stream("post", prefix, filter_obj):
+                yield entity
+
     async def filter_iter(self, filter_obj: Any) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[Any, None]]:
         async def iter_func(batch_size: Optional[int] = None, offset: Optional[int] = None):
             if not batch_size:
                 batch_size = BATCH_SIZE
-            res = await self.api_instance.post(f"filter?limit={batch_size}&offset={offset or ''}", filter_obj)
+            # The context of an async generator is the consumer's, so the priority is only set around the await
+            with priority(BULK):
+                res = await self.api_instance.post(f"filter?limit={batch_size}&offset={offset or ''}", filter_obj)
             if len(res.results) == 0:
                 return
             else:
@@ -104,10 +271,79 @@ class EntityCRUD(object):
     async def list_iter(self) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[Any, None]]:
         return await self.filter_iter({})
 
+    @with_priority(BULK)
+    async def scan(
+            self, filter_obj: Any, batch_size: int = BATCH_SIZE, concurrency: int = SCAN_CONCURRENCY
+    ) -> List[Entity]:
+        # The first page tells the total amount of entities, the rest of the pages
+        # are read concurrently. Sorting by uuid keeps the offsets stable between pages
+        body = dict(filter_obj)
+        body["sort"] = SCAN_SORT
+        first_page = await self.filter(dict(body, limit=batch_size))
+        if len(first_page.results) < batch_size:
+            return list(first_page.results)
+        iter_func = await self.filter_iter(body)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def read_page(offset: int) -> List[Entity]:
+            async with semaphore:
+                results = []
+                async for entity in iter_func(batch_size, offset):
+                    results.append(entity)
+                    if len(results) == batch_size:
+                        break
+                return results
+
+        pages = await asyncio.gather(*[
+            read_page(offset) for offset in range(batch_size, first_page.entity_count, batch_size)
+        ])
+        entities = list(first_page.results)
+        for page in pages:
+            entities.extend(page)
+        return entities
+
+    async def watch(
+            self, filter_obj: Any = None, change_source: Optional[ChangeSource] = None
+    ) -> AsyncGenerator[EntityEvent, None]:
+        # The watches of the client with the same filter share a single poller, change_source
+        # is only taken into account by the watch starting it
+        filter_obj = filter_obj or {}
+        key = json.dumps(filter_obj, sort_keys=True, default=str)
+        watcher = self._watchers.get(key)
+        if watcher is None:
+            watcher = self._watchers[key] = KindWatcher(
+                change_source or PollingChangeSource(self, filter_obj), self.logger
+            )
+        async for event in watcher.subscribe():
+            yield event
+
+    async def fetch_reference_graph(
+            self,
+            root: Entity,
+            kinds: List[Kind],
+            max_depth: int = 1,
+            concurrency: int = REFERENCE_GRAPH_CONCURRENCY,
+            batch_size: Optional[int] = None
+    ) -> Dict[str, Entity]:
+        """Returns the root entity and the entities it references up to max_depth levels deep,
+        keyed by uuid. Reference fields are taken from the kinds as registered with new_kind"""
+        with self.tracer.start_span(
+                operation_name=f"fetch_reference_graph_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
+            def get_kind(kind: str) -> EntityCRUD:
+                return EntityCRUD(
+                    self.papiea_url, self.prefix, self.version, kind, self.s2skey, self.sslContext, self.logger,
+                    self.tracer, self.transport, parent_span=span
+                )
+
+            return await fetch_reference_graph(root, kinds, get_kind, max_depth, concurrency, batch_size)
+
     async def invoke_procedure(
             self, procedure_name: str, entity_reference: EntityReference, input_: Any
     ) -> Any:
-        with self.tracer.start_span(operation_name=f"invoke_{procedure_name}_procedure_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"invoke_{procedure_name}_procedure_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             payload = input_
             return await self.api_instance.post(
@@ -115,7 +351,9 @@ class EntityCRUD(object):
             )
 
     async def invoke_kind_procedure(self, procedure_name: str, input_: Any) -> Any:
-        with self.tracer.start_span(operation_name=f"invoke_{procedure_name}_kind_procedure_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"invoke_{procedure_name}_kind_procedure_client", child_of=self.parent_span
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             payload = input_
             return await self.api_instance.post(f"procedure/{procedure_name}", payload)
@@ -124,12 +362,15 @@ class EntityCRUD(object):
 class IntentWatcherClient(object):
     def __init__(
             self,
-            papiea_url: str,
+            papiea_url: EngineUrl,
             s2skey: Secret = None,
             sslContext: ssl.SSLContext = ssl.create_default_context(),
             logger: logging.Logger = logging.getLogger(__name__),
-            tracer: Optional[Tracer] = init_default_tracer()
+            tracer: Optional[Tracer] = init_default_tracer(),
+            transport: Optional[Transport] = None,
+            warm_connections: int = 0
     ):
+        papiea_url, transport, self._balancer = engine_transport(papiea_url, transport)
         headers = {
             "Content-Type": "application/json",
         }
@@ -139,12 +380,15 @@ class IntentWatcherClient(object):
         if s2skey is not None:
             headers["Authorization"] = f"Bearer {s2skey}"
         self.api_instance = ApiInstance(
-            f"{papiea_url}/services/intent_watcher", headers=headers, logger=logger, sslContext=sslContext
+            f"{papiea_url}/services/intent_watcher", headers=headers, logger=logger, sslContext=sslContext,
+            transport=transport, warm_connections=warm_connections
         )
 
         self.logger = logger
+        self._poller: Optional[IntentWatcherPoller] = None
 
     async def __aenter__(self) -> "IntentWatcherClient":
+        await self.api_instance.warm_up()
         return self
 
     async def __aexit__(
@@ -153,27 +397,100 @@ class IntentWatcherClient(object):
             exc_val: Optional[BaseException],
             exc_tb: Optional[TracebackType]
     ) -> None:
-        await self.api_instance.close()
+        await self.close()
         self.tracer.close()
 
+    async def close(self) -> None:
+        if self._poller is not None:
+            await self._poller.stop()
+        await self.api_instance.close()
+        if self._balancer is not None:
+            await self._balancer.close()
+
     async def get_intent_watcher(self, id: str) -> IntentWatcher:
-        with self.tracer.start_span(operation_name=f"get_intent_watcher_client") as span:
+        with self.tracer.start_span(operation_name=f"get_intent_watcher_client") as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             return await self.api_instance.get(id)
 
-    async def list_intent_watcher(self) -> List[IntentWatcher]:
-        with self.tracer.start_span(operation_name=f"list_intent_watchers_client") as span:
+    async def list_intent_watcher(
+            self, offset: Optional[int] = None, limit: Optional[int] = None, sort: Optional[str] = None
+    ) -> List[IntentWatcher]:
+        with self.tracer.start_span(operation_name=f"list_intent_watchers_client") as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
-            res = await self.api_instance.get("")
+            res = await self.api_instance.get(pagination_query(offset, limit, sort))
             return res.results
 
     # filter_intent_watcher(AttributeDict(status=IntentfulStatus.Pending))
-    async def filter_intent_watcher(self, filter_obj: Any) -> List[IntentWatcher]:
-        with self.tracer.start_span(operation_name=f"filter_intent_watcher_client") as span:
+    async def filter_intent_watcher(
+            self, filter_obj: Any, offset: Optional[int] = None, limit: Optional[int] = None, sort: Optional[str] = None
+    ) -> List[IntentWatcher]:
+        with self.tracer.start_span(operation_name=f"filter_intent_watcher_client") as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
-            res = await self.api_instance.post("filter", filter_obj)
+            res = await self.api_instance.post("filter" + pagination_query(offset, limit, sort), filter_obj)
             return res.results
 
+    async def filter_intent_watcher_iter(
+            self, filter_obj: Any, sort: Optional[str] = None
+    ) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[IntentWatcher, None]]:
+        async def iter_func(batch_size: Optional[int] = None, offset: Optional[int] = None):
+            if not batch_size:
+                batch_size = BATCH_SIZE
+            offset = offset or 0
+            while True:
+                res = await self.api_instance.post(
+                    "filter" + pagination_query(offset, batch_size, sort), filter_obj
+                )
+                for watcher in res.results:
+                    yield watcher
+                if len(res.results) < batch_size:
+                    return
+                offset += batch_size
+
+        return iter_func
+
+    async def list_intent_watcher_iter(
+            self, sort: Optional[str] = None
+    ) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[IntentWatcher, None]]:
+        return await self.filter_intent_watcher_iter({}, sort)
+
+    async def watch_transitions(
+            self, filter_obj: Any = None, interval: float = WATCH_INTERVAL_SECS, batch_size: int = BATCH_SIZE
+    ) -> AsyncGenerator[IntentWatcherTransition, None]:
+        filter_obj = filter_obj or {}
+        # Only the watchers that may still change are loaded up front, and not the terminal ones
+        # unless the filter asks for a status. The newest change is read after them, so
+        # a watcher changing in between is still seen by the first scan. The newest creation
+        # is read before them, so a watcher created in between is reported as new
+        newest_created = await self.filter_intent_watcher(filter_obj, limit=1, sort=CREATED_WATCHERS_SORT)
+        created_since = newest_created[0].get("created_at") if len(newest_created) > 0 else None
+        known = {}
+        active_filter = filter_obj
+        if "status" not in filter_obj:
+            active_filter = dict(filter_obj, status={"$in": ACTIVE_WATCHER_STATUSES})
+        async for watcher in (await self.filter_intent_watcher_iter(active_filter))(batch_size):
+            known[watcher.uuid] = watcher
+        newest = await self.filter_intent_watcher(filter_obj, limit=batch_size, sort=TRANSITIONS_SORT)
+        since = newest[0].get("last_status_changed") if len(newest) > 0 else None
+        for watcher in newest:
+            # Changed at since, so the first scan sees them again
+            if since is not None and watcher.get("last_status_changed") == since:
+                known[watcher.uuid] = watcher
+        iter_func = await self.filter_intent_watcher_iter(filter_obj, TRANSITIONS_SORT)
+        created_iter_func = await self.filter_intent_watcher_iter(filter_obj, CREATED_WATCHERS_SORT)
+        while True:
+            await asyncio.sleep(interval)
+            # New watchers first, one changing right after it was created is then reported in order
+            created, created_since = await created_watchers(created_iter_func, known, created_since, batch_size)
+            transitions, since = await changed_watchers(iter_func, known, since, batch_size)
+            for transition in created + transitions:
+                yield transition
+
+    async def wait_for_completion(self, watcher_ref: AttributeDict, timeout_secs: Optional[float] = None) -> IntentWatcher:
+        # Concurrent waits of the client are batched by a shared poller
+        if self._poller is None:
+            self._poller = IntentWatcherPoller(self, INTENT_POLL_INTERVAL_SECS, BATCH_SIZE)
+        return await self._poller.wait(watcher_ref.uuid, timeout_secs)
+
     async def wait_for_watcher_status(self, watcher_ref: AttributeDict, watcher_status: IntentfulStatus,
                                       timeout_secs: float = 50, delay_millis: float = 500) -> bool:
         start_time = time.time()
@@ -187,37 +504,43 @@ class IntentWatcherClient(object):
             if time_elapsed > timeout_secs:
                 raise Exception(f"Timeout waiting for change in watcher status with uuid: {watcher_ref.uuid} for entity with uuid: {watcher.entity_ref.uuid} and kind: {watcher.entity_ref.kind} in provider with prefix: {watcher.entity_ref.provider_prefix} and version: {watcher.entity_ref.provider_version},"
                                 f" desired status: {watcher_status} and current status: {watcher.status}")
-            time.sleep(delay_secs)
+            await asyncio.sleep(delay_secs)
 
 
 class ProviderClient(object):
     def __init__(
             self,
-            papiea_url: str,
+            papiea_url: EngineUrl,
             provider: str,
             version: str,
             s2skey: Optional[str] = None,
             sslContext: ssl.SSLContext = ssl.create_default_context(),
             logger: logging.Logger = logging.getLogger(__name__),
-            tracer: Optional[Tracer] = init_default_tracer()
+            tracer: Optional[Tracer] = init_default_tracer(),
+            transport: Optional[Transport] = None,
+            warm_connections: int = 0
     ):
+        papiea_url, transport, self._balancer = engine_transport(papiea_url, transport)
         self.papiea_url = papiea_url
         self.provider = provider
         self.version = version
         self.s2skey = s2skey
         self.sslContext = sslContext
         self.logger = logger
+        self.transport = transport
         headers = {
             "Content-Type": "application/json",
         }
         if s2skey is not None:
             headers["Authorization"] = f"Bearer {s2skey}"
         self.api_instance = ApiInstance(
-            f"{papiea_url}/services/{provider}/{version}", headers=headers, logger=logger, sslContext=sslContext
+            f"{papiea_url}/services/{provider}/{version}", headers=headers, logger=logger, sslContext=sslContext,
+            transport=transport, warm_connections=warm_connections
         )
         self.tracer = tracer
 
     async def __aenter__(self) -> "ProviderClient":
+        await self.api_instance.warm_up()
         return self
 
     async def __aexit__(
@@ -227,15 +550,33 @@ class ProviderClient(object):
             exc_tb: Optional[TracebackType],
     ) -> None:
         await self.api_instance.close()
+        if self._balancer is not None:
+            await self._balancer.close()
         self.tracer.close()
 
-    def get_kind(self, kind: str) -> EntityCRUD:
+    def get_kind(self, kind: str, parent_span: Optional[Span] = None) -> EntityCRUD:
         return EntityCRUD(
-            self.papiea_url, self.provider, self.version, kind, self.s2skey, self.sslContext, self.logger
+            self.papiea_url, self.provider, self.version, kind, self.s2skey, self.sslContext, self.logger,
+            self.tracer, self.transport, parent_span=parent_span
         )
 
+    async def fetch_reference_graph(
+            self,
+            root: Entity,
+            kinds: List[Kind],
+            max_depth: int = 1,
+            concurrency: int = REFERENCE_GRAPH_CONCURRENCY,
+            batch_size: Optional[int] = None
+    ) -> Dict[str, Entity]:
+        with self.tracer.start_span(operation_name=f"fetch_reference_graph_client") as span, request_span_scope(span):
+            return await fetch_reference_graph(
+                root, kinds, lambda kind: self.get_kind(kind, span), max_depth, concurrency, batch_size
+            )
+
     async def invoke_procedure(self, procedure_name: str, input: Any) -> Any:
-        with self.tracer.start_span(operation_name=f"invoke_{procedure_name}_procedure_client") as span:
+        with self.tracer.start_span(
+                operation_name=f"invoke_{procedure_name}_procedure_client"
+        ) as span, request_span_scope(span):
             inject_tracing_headers(self.tracer, span, self.api_instance)
             payload = input
             return await self.api_instance.post(f"procedure/{procedure_name}", payload)
@@ -0,0 +1,77 @@
+import ssl
+import zlib
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from .transport import Transport
+
+# Bodies below this many bytes are sent as is, compressing them costs more than it saves
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+Compressor = Callable[[bytes], bytes]
+
+
+def gzip_compress(body: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+# The engine parses request bodies with express.json, which only inflates gzip and
+# deflate and answers 415 to any other Content-Encoding, so only those are offered
+COMPRESSORS: Dict[str, Compressor] = {
+    "gzip": gzip_compress,
+    "deflate": zlib.compress,
+}
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    compressor = COMPRESSORS.get(encoding)
+    if compressor is None:
+        raise Exception(f"Unsupported content encoding: {encoding}, available: {', '.join(COMPRESSORS)}")
+    return compressor(body)
+
+
+class CompressingTransport(Transport):
+    """Compresses request bodies of at least threshold bytes before passing them to another transport.
+
+    Responses are decompressed by aiohttp, which advertises every encoding it can
+    decode in Accept-Encoding. Requests are only compressed with gzip or deflate,
+    the codings the engine decodes
+    """
+
+    def __init__(self, transport: Transport, encoding: str = "gzip", threshold: int = DEFAULT_COMPRESSION_THRESHOLD):
+        if encoding not in COMPRESSORS:
+            raise Exception(f"Unsupported content encoding: {encoding}, available: {', '.join(COMPRESSORS)}")
+        self.transport = transport
+        self.encoding = encoding
+        self.threshold = threshold
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        if data is not None and len(data) >= self.threshold and "Content-Encoding" not in headers:
+            data = compress(data, self.encoding)
+            headers = CIMultiDict(headers)
+            headers["Content-Encoding"] = self.encoding
+        return self.transport.request(method, url, data, headers, ssl_context)
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        await self.transport.close()
+
+
+def compression_middleware(threshold: int = DEFAULT_COMPRESSION_THRESHOLD):
+    # Compresses buffered responses of at least threshold bytes with the gzip or
+    # deflate coding the client accepts, the negotiation is done by aiohttp
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        response = await handler(request)
+        if (isinstance(response, web.Response) and "Content-Encoding" not in response.headers
+                and isinstance(response.body, (bytes, bytearray)) and len(response.body) >= threshold):
+            response.enable_compression()
+        return response
+
+    return middleware
@@ -114,6 +114,7 @@ Metadata = AttributeDict
 #     spec_version: int
 #     created_at: Any
 #     deleted_at: Optional[Any]
+#     updated_at: Optional[int]
 #     extension: Optional[Dict[str, Any]]
 
 
@@ -151,6 +152,23 @@ IntentWatcher = AttributeDict
 #     created_at: Optional[Any]
 
 
+class EntityEventType(str):
+    Created = "created"
+    Updated = "updated"
+    Deleted = "deleted"
+    # The entity changed and does not match the filter of the watch anymore
+    Left = "left"
+
+
+EntityEvent = AttributeDict
+
+# class EntityEvent(TypedDict):
+#     type: EntityEventType
+#     entity: Entity
+#     old_spec_version: Optional[int]
+#     new_spec_version: Optional[int]
+
+
 class Action(str):
     Read = "read"
     Update = "write"
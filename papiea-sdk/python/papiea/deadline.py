@@ -0,0 +1,55 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from aiohttp import web
+
+# Remaining time budget of a request in milliseconds, relative so it does not depend on synchronized clocks
+DEADLINE_HEADER = "X-Papiea-Deadline-Ms"
+
+# Absolute time.monotonic() by which the requests of the current task have to finish
+_deadline = ContextVar("papiea_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    # Seconds left before the current deadline, None without one
+    deadline_at = _deadline.get()
+    if deadline_at is None:
+        return None
+    return deadline_at - time.monotonic()
+
+
+@contextmanager
+def deadline(timeout_secs: Optional[float]) -> Iterator[None]:
+    """Bounds every engine request made inside the block, e.g.
+
+        with deadline(2):
+            entity = await client.get(ref)
+            await client.update(entity.metadata, spec)
+
+    Nested deadlines can only shorten the outer one. Requests still in flight when
+    the deadline passes are cancelled with DeadlineExceededException
+    """
+    if timeout_secs is None:
+        yield
+        return
+    deadline_at = time.monotonic() + timeout_secs
+    current = _deadline.get()
+    if current is not None:
+        deadline_at = min(deadline_at, current)
+    token = _deadline.set(deadline_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def header_deadline(request: web.Request) -> Optional[float]:
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0) / 1000
+    except ValueError:
+        return None
@@ -0,0 +1,166 @@
+import asyncio
+import math
+import ssl
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from multidict import CIMultiDict
+
+from .balancer import BalancedRequest, BalancingTransport
+from .circuit_breaker import READS, route_class
+from .core import AttributeDict
+from .transport import AwaitedResponse, Transport, TransportResponse
+
+HEDGE_PERCENTILE = 95
+# Delay before enough latencies are known to take the percentile from
+INITIAL_HEDGE_DELAY_SECS = 0.05
+MIN_HEDGE_DELAY_SECS = 0.005
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+# Every read earns this fraction of a hedge, at most MAX_HEDGE_TOKENS are saved up for a burst
+HEDGE_BUDGET_RATIO = 0.1
+MAX_HEDGE_TOKENS = 10
+
+HedgeStats = AttributeDict
+# class HedgeStats(TypedDict):
+#     reads: int
+#     hedged: int
+#     hedge_wins: int
+#     over_budget: int
+#     delay_ms: float
+
+
+def _retrieve_error(task: asyncio.Future) -> None:
+    # The losing copy may fail after the winner returned, its error is not logged as unhandled
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgingTransport(Transport):
+    """Sends a second copy of a read that is slower than usual and takes the first answer.
+
+    A read with no response after the percentile-th percentile of the recent read
+    latencies is hedged: the same request is sent again, to another endpoint when
+    the transport is a BalancingTransport, the first successful response wins and
+    the other request is cancelled. Each read earns budget_ratio of a hedge, so
+    hedges add at most that fraction of the reads to the engine load. Only reads
+    are hedged, writes are passed on as they are. To hedge across engine replicas
+    the balancer goes inside:
+
+        transport = HedgingTransport(BalancingTransport(urls))
+        client = EntityCRUD(transport.base_url, prefix, version, kind, transport=transport)
+    """
+
+    def __init__(
+            self,
+            transport: Transport,
+            percentile: float = HEDGE_PERCENTILE,
+            initial_delay_secs: float = INITIAL_HEDGE_DELAY_SECS,
+            min_delay_secs: float = MIN_HEDGE_DELAY_SECS,
+            budget_ratio: float = HEDGE_BUDGET_RATIO,
+            max_tokens: float = MAX_HEDGE_TOKENS
+    ):
+        self.transport = transport
+        self.percentile = percentile
+        self.initial_delay_secs = initial_delay_secs
+        self.min_delay_secs = min_delay_secs
+        self.budget_ratio = budget_ratio
+        self.max_tokens = max_tokens
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+        self._tokens = max_tokens
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def base_url(self) -> Optional[str]:
+        return getattr(self.transport, "base_url", None)
+
+    def delay(self) -> float:
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.initial_delay_secs
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, math.ceil(len(latencies) * self.percentile / 100) - 1)
+        return max(self.min_delay_secs, latencies[index])
+
+    def _take_token(self) -> bool:
+        if self._tokens < 1:
+            self.over_budget += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _fetch(self, request) -> TransportResponse:
+        async with request as resp:
+            body = await resp.read()
+            return TransportResponse(resp.status, resp.headers, body)
+
+    def _hedge_request(self, first, method, url, data, headers, ssl_context):
+        if isinstance(self.transport, BalancingTransport) and isinstance(first, BalancedRequest):
+            return self.transport.request(method, url, data, headers, ssl_context, avoid=first.endpoint)
+        return self.transport.request(method, url, data, headers, ssl_context)
+
+    async def _request(self, method, url, data, headers, ssl_context) -> TransportResponse:
+        # The latency of the read is taken from the start of the first attempt, whichever copy wins.
+        # Timing the copies would drop the cancelled slow ones and pull the hedge delay down
+        started_at = time.perf_counter()
+        response = await self._hedged_request(method, url, data, headers, ssl_context)
+        self._latencies.append(time.perf_counter() - started_at)
+        return response
+
+    async def _hedged_request(self, method, url, data, headers, ssl_context) -> TransportResponse:
+        self.reads += 1
+        self._tokens = min(self.max_tokens, self._tokens + self.budget_ratio)
+        first_request = self.transport.request(method, url, data, headers, ssl_context)
+        first = asyncio.ensure_future(self._fetch(first_request))
+        first.add_done_callback(_retrieve_error)
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.delay())
+            if not done and self._take_token():
+                self.hedged += 1
+                hedge = asyncio.ensure_future(
+                    self._fetch(self._hedge_request(first_request, method, url, data, headers, ssl_context))
+                )
+                hedge.add_done_callback(_retrieve_error)
+                pending.add(hedge)
+            failed = None
+            while True:
+                if not done:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # A server error of one copy still leaves the other one to succeed
+                    if task.exception() is None and task.result().status < 500:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    failed = failed or task
+                if not pending:
+                    return failed.result()
+                done = set()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        if route_class(method, url) != READS:
+            return self.transport.request(method, url, data, headers, ssl_context)
+        return AwaitedResponse(self._request(method, url, data, headers, ssl_context))
+
+    def stats(self) -> HedgeStats:
+        return HedgeStats(
+            reads=self.reads,
+            hedged=self.hedged,
+            hedge_wins=self.hedge_wins,
+            over_budget=self.over_budget,
+            delay_ms=round(self.delay() * 1000, 3),
+        )
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        await self.transport.close()
@@ -0,0 +1,133 @@
+import json
+import re
+from typing import Any, AsyncGenerator, AsyncIterable, List, Optional
+
+from .utils import json_loads_attrs
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Only these bytes change the parser state, everything in between is skipped by the regex
+STRUCTURAL = re.compile(rb'["{}\[\],:]')
+STRING_SPECIAL = re.compile(rb'["\\]')
+
+QUOTE, BACKSLASH, COLON, COMMA = ord('"'), ord("\\"), ord(":"), ord(",")
+OPENING = (ord("{"), ord("["))
+CLOSING = (ord("}"), ord("]"))
+LBRACKET, RBRACKET = ord("["), ord("]")
+
+
+class JsonArrayStream(object):
+    """Incremental parser for the items of an array under a key of a top level json object.
+
+    Bytes are fed as they arrive and every completed item of the array is decoded
+    on its own, so only the item being parsed is held in memory rather than the
+    whole document. Used for the {"results": [...], "entity_count": n} responses
+    of the engine list and filter routes
+    """
+
+    def __init__(self, key: str = "results"):
+        self.key = json.dumps(key).encode("utf-8")
+        self.done = False
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start: Optional[int] = None
+        self._last_string: Optional[bytes] = None
+        self._current_key: Optional[bytes] = None
+        self._in_array = False
+        self._item_start: Optional[int] = None
+
+    def _emit(self, end: int, items: List[Any]) -> None:
+        item = bytes(self._buffer[self._item_start:end]).strip()
+        if item:
+            items.append(json_loads_attrs(item))
+
+    def feed(self, data: bytes) -> List[Any]:
+        items = []
+        if self.done:
+            return items
+        self._buffer += data
+        buf = self._buffer
+        pos = self._pos
+        size = len(buf)
+        while pos < size:
+            if self._in_string:
+                match = STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    pos = size
+                    break
+                i = match.start()
+                if buf[i] == BACKSLASH:
+                    if i + 1 >= size:
+                        # The escaped byte has not arrived yet
+                        pos = i
+                        break
+                    pos = i + 2
+                    continue
+                pos = i + 1
+                self._in_string = False
+                if self._depth == 1:
+                    self._last_string = bytes(buf[self._string_start:pos])
+                self._string_start = None
+                continue
+            match = STRUCTURAL.search(buf, pos)
+            if match is None:
+                pos = size
+                break
+            i = match.start()
+            c = buf[i]
+            pos = i + 1
+            if c == QUOTE:
+                self._in_string = True
+                self._string_start = i
+            elif c in OPENING:
+                self._depth += 1
+                if c == LBRACKET and self._depth == 2 and self._current_key == self.key:
+                    self._in_array = True
+                    self._item_start = pos
+            elif c in CLOSING:
+                if self._in_array and self._depth == 2:
+                    if c != RBRACKET:
+                        raise Exception(f"Malformed json array under key {self.key.decode('utf-8')}")
+                    self._emit(i, items)
+                    self._item_start = None
+                    self._in_array = False
+                    self.done = True
+                    break
+                self._depth -= 1
+            elif c == COLON and self._depth == 1:
+                self._current_key = self._last_string
+            elif c == COMMA:
+                if self._depth == 1:
+                    self._current_key = None
+                elif self._in_array and self._depth == 2:
+                    self._emit(i, items)
+                    self._item_start = pos
+        # Drop everything that can no longer be part of an item or a key
+        keep_from = pos
+        for start in (self._item_start, self._string_start):
+            if start is not None:
+                keep_from = min(keep_from, start)
+        if keep_from > 0:
+            del buf[:keep_from]
+            pos -= keep_from
+            if self._item_start is not None:
+                self._item_start -= keep_from
+            if self._string_start is not None:
+                self._string_start -= keep_from
+        self._pos = pos
+        if self.done:
+            self._buffer = bytearray()
+        return items
+
+
+async def iter_json_array(chunks: AsyncIterable[bytes], key: str = "results") -> AsyncGenerator[Any, None]:
+    parser = JsonArrayStream(key)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            return
+    if not parser.done:
+        raise Exception(f"Response ended before the json array under key {key} was complete")
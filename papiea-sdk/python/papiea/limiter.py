@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import ssl
+import time
+from typing import Any, Dict, List, Optional
+
+from multidict import CIMultiDict
+
+from .circuit_breaker import endpoint_of
+from .core import AttributeDict
+from .priority import DEFAULT, PRIORITY_CLASSES, FairQueue, request_priority, request_tenant
+from .python_sdk_exceptions import ConcurrencyLimitException
+from .transport import Transport
+
+INITIAL_LIMIT = 20
+MIN_LIMIT = 1
+MAX_LIMIT = 200
+DECREASE_FACTOR = 0.7
+# A response slower than this multiple of the fastest recent one is a sign of queuing in the engine,
+# the slack keeps the jitter of sub-millisecond local round trips from counting
+LATENCY_TOLERANCE = 2.0
+LATENCY_SLACK_SECS = 0.01
+MAX_WAIT_SECS = 5
+MAX_QUEUE = 1000
+# The fastest recent latency is forgotten after this many samples so the baseline follows the engine
+BASELINE_WINDOW = 100
+
+WaitStats = AttributeDict
+# class WaitStats(TypedDict):
+#     requests: int
+#     queued: int
+#     mean_wait_ms: float
+#     max_wait_ms: float
+
+LimiterStats = AttributeDict
+# class LimiterStats(TypedDict):
+#     endpoint: str
+#     limit: int
+#     in_flight: int
+#     queued: int
+#     rejected: int
+#     min_latency_ms: Optional[float]
+#     wait: Dict[str, WaitStats]
+
+
+class AdaptiveLimiter(object):
+    """Caps the requests in flight to one endpoint and adapts the cap by AIMD.
+
+    Each fast successful response raises the limit by 1 / limit, i.e. by one per
+    round of limit requests. A server error, 429, timeout or a response slower
+    than latency_tolerance times the fastest recent one multiplies it by
+    decrease_factor, at most once per round trip so a burst of failures counts as
+    one. Requests over the limit wait in a queue of at most max_queue for up to
+    max_wait_secs, then fail with ConcurrencyLimitException. Queued requests are
+    let through by weighted fair queuing over their priority classes and tenants,
+    a limiter with min_limit == max_limit is a fixed size pool
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            initial_limit: int = INITIAL_LIMIT,
+            min_limit: int = MIN_LIMIT,
+            max_limit: int = MAX_LIMIT,
+            decrease_factor: float = DECREASE_FACTOR,
+            latency_tolerance: float = LATENCY_TOLERANCE,
+            max_wait_secs: float = MAX_WAIT_SECS,
+            max_queue: int = MAX_QUEUE,
+            weights: Optional[Dict[str, float]] = None,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        self.endpoint = endpoint
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.max_wait_secs = max_wait_secs
+        self.max_queue = max_queue
+        self.logger = logger
+        self.in_flight = 0
+        self.rejected = 0
+        self.min_latency: Optional[float] = None
+        self._window_min_latency: Optional[float] = None
+        self._window_samples = 0
+        self._last_decrease = 0.0
+        self._waiters = FairQueue(weights)
+        self._wait_totals = {priority_class: [0, 0, 0.0, 0.0] for priority_class in PRIORITY_CLASSES}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _record_wait(self, priority_class: str, queued: bool, wait: float) -> None:
+        totals = self._wait_totals.setdefault(priority_class, [0, 0, 0.0, 0.0])
+        totals[0] += 1
+        if queued:
+            totals[1] += 1
+            totals[2] += wait
+            totals[3] = max(totals[3], wait)
+
+    async def acquire(self, priority_class: str = DEFAULT, tenant: str = "") -> None:
+        if self._has_capacity() and not self._waiters:
+            self.in_flight += 1
+            self._record_wait(priority_class, False, 0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise ConcurrencyLimitException(self.endpoint, int(self.limit), len(self._waiters))
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter, priority_class, tenant)
+        queued_at = time.perf_counter()
+        try:
+            # The slot is taken over from the releasing request, in_flight is already counted
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait_secs)
+            self._record_wait(priority_class, True, time.perf_counter() - queued_at)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._record_wait(priority_class, True, time.perf_counter() - queued_at)
+            self.rejected += 1
+            raise ConcurrencyLimitException(self.endpoint, int(self.limit), len(self._waiters))
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # Granted while timing out, hand the slot on
+            self.in_flight -= 1
+            self._wake()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, dropped: bool, latency: Optional[float]) -> None:
+        # Without a latency, e.g. for a cancelled request, the slot is freed and the limit kept
+        self.in_flight -= 1
+        if latency is None:
+            self._wake()
+            return
+        if not dropped:
+            self._observe_latency(latency)
+            if latency > max(self.min_latency * self.latency_tolerance, self.min_latency + LATENCY_SLACK_SECS):
+                dropped = True
+        now = time.monotonic()
+        if dropped:
+            # One decrease per round trip, the requests failing together saw the same overload
+            if now - self._last_decrease >= (self.min_latency or 0):
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.logger.debug(f"Concurrency limit of {self.endpoint} decreased to {int(self.limit)}")
+        elif self.in_flight + 1 >= int(self.limit) * 0.5:
+            # Only grow while the limit is actually used, an idle client keeps its limit
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _observe_latency(self, latency: float) -> None:
+        if self._window_min_latency is None or latency < self._window_min_latency:
+            self._window_min_latency = latency
+        self._window_samples += 1
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        if self._window_samples >= BASELINE_WINDOW:
+            self.min_latency = self._window_min_latency
+            self._window_min_latency = None
+            self._window_samples = 0
+
+    def stats(self) -> LimiterStats:
+        return LimiterStats(
+            endpoint=self.endpoint,
+            limit=int(self.limit),
+            in_flight=self.in_flight,
+            queued=self.queued,
+            rejected=self.rejected,
+            min_latency_ms=round(self.min_latency * 1000, 3) if self.min_latency is not None else None,
+            wait={
+                priority_class: WaitStats(
+                    requests=requests,
+                    queued=queued,
+                    mean_wait_ms=round(total_wait / queued * 1000, 3) if queued else 0.0,
+                    max_wait_ms=round(max_wait * 1000, 3),
+                )
+                for priority_class, (requests, queued, total_wait, max_wait) in self._wait_totals.items()
+            },
+        )
+
+
+class LimitedRequest(object):
+    def __init__(self, limiter: AdaptiveLimiter, make_request, priority_class: str = DEFAULT, tenant: str = ""):
+        self.limiter = limiter
+        self.make_request = make_request
+        self.priority_class = priority_class
+        self.tenant = tenant
+        self.request = None
+        self._latency = 0.0
+        self._dropped = False
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.priority_class, self.tenant)
+        started_at = time.perf_counter()
+        self.request = self.make_request()
+        try:
+            resp = await self.request.__aenter__()
+        except asyncio.CancelledError:
+            self.limiter.release(False, None)
+            raise
+        except Exception:
+            self.limiter.release(True, time.perf_counter() - started_at)
+            raise
+        # Latency up to the response headers, reading a long streamed body is not engine queuing
+        self._latency = time.perf_counter() - started_at
+        self._dropped = resp.status >= 500 or resp.status == 429
+        return resp
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return await self.request.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.limiter.release(self._dropped, self._latency)
+
+
+class LimitingTransport(Transport):
+    # Passes requests to another transport through an AdaptiveLimiter per endpoint,
+    # the keyword arguments are the settings of the limiters. Requests are queued
+    # with the priority class of papiea.priority and the hash of their token as tenant
+    def __init__(self, transport: Transport, **limiter_options: Any):
+        self.transport = transport
+        self.limiter_options = limiter_options
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def limiter(self, endpoint: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            limiter = AdaptiveLimiter(endpoint, **self.limiter_options)
+            self.limiters[endpoint] = limiter
+        return limiter
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        return LimitedRequest(
+            self.limiter(endpoint_of(url)), lambda: self.transport.request(method, url, data, headers, ssl_context),
+            request_priority(method, url), request_tenant(headers)
+        )
+
+    def stats(self) -> List[LimiterStats]:
+        return [limiter.stats() for limiter in self.limiters.values()]
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        await self.transport.close()
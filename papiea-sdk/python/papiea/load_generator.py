@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from .benchmark import LatencyRecorder, run_open_loop
+from .client import EntityCRUD, ProviderClient
+from .core import AttributeDict, Entity
+from .python_sdk_exceptions import ConflictingEntityException
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+OPERATIONS = ["create", "update", "get", "filter", "procedure", "kind_procedure", "provider_procedure"]
+DEFAULT_MIX = "get=5,filter=2,update=2,create=1"
+
+MOCK_KIND = {
+    "Location": {
+        "type": "object",
+        "x-papiea-entity": "spec-only",
+        "properties": {
+            "x": {"type": "number"},
+            "y": {"type": "number"},
+        },
+    }
+}
+
+LoadReport = AttributeDict
+# class LoadReport(TypedDict):
+#     mode: str
+#     users: int
+#     target_rate: Optional[float]
+#     duration_secs: float
+#     requests: int
+#     errors: int
+#     error_rate: float
+#     throughput: float
+#     operations: Dict[str, dict]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise Exception(f"Unknown operation: {name} in mix, supported operations are: {', '.join(OPERATIONS)}")
+        weights[name] = float(weight) if weight else 1
+    return weights
+
+
+class LoadGenerator(object):
+    """Drives a weighted mix of operations on a kind through EntityCRUD and ProviderClient.
+
+    In closed loop mode every virtual user issues its next operation once the
+    previous one completed, optionally paced so the users together do not exceed
+    target_rate. In open loop mode operations are scheduled at target_rate
+    regardless of completion with at most `users` in flight, and latency is
+    measured from the scheduled start so that queueing is not hidden
+    """
+
+    def __init__(
+            self,
+            client: EntityCRUD,
+            provider_client: ProviderClient,
+            mix: Dict[str, float],
+            users: int,
+            duration: float,
+            open_loop: bool = False,
+            target_rate: Optional[float] = None,
+            spec_template: Any = None,
+            procedure: Optional[str] = None,
+            procedure_input: Any = None,
+            filter_obj: Any = None,
+            entities: int = 10,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        if open_loop and not target_rate:
+            raise Exception("Open loop load requires a target rate")
+        self.client = client
+        self.provider_client = provider_client
+        self.operations = list(mix.keys())
+        self.weights = list(mix.values())
+        self.users = users
+        self.duration = duration
+        self.open_loop = open_loop
+        self.target_rate = target_rate
+        self.spec_template = spec_template if spec_template is not None else {"x": 10, "y": 20}
+        self.procedure = procedure
+        self.procedure_input = procedure_input
+        self.filter_obj = filter_obj if filter_obj is not None else {}
+        self.initial_entities = entities
+        self.logger = logger
+        self.recorders: Dict[str, LatencyRecorder] = {name: LatencyRecorder(name) for name in self.operations}
+        self._entities: List[Entity] = []
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def setup(self) -> None:
+        for _ in range(self.initial_entities):
+            await self._create()
+
+    async def _create(self) -> Any:
+        result = await self.client.create({"spec": self.spec_template})
+        self._entities.append(AttributeDict(metadata=result.metadata, spec=result.spec))
+        return result
+
+    async def _update(self) -> Any:
+        entity = random.choice(self._entities)
+        lock = self._locks.setdefault(entity.metadata.uuid, asyncio.Lock())
+        async with lock:
+            try:
+                result = await self.client.update(entity.metadata, entity.spec)
+            except ConflictingEntityException:
+                current = await self.client.get(entity.metadata)
+                entity.metadata = current.metadata
+                raise
+            entity.metadata.spec_version += 1
+            return result
+
+    async def run_operation(self, name: str) -> Any:
+        if name == "create":
+            return await self._create()
+        if name == "update":
+            return await self._update()
+        if name == "get":
+            return await self.client.get(random.choice(self._entities).metadata)
+        if name == "filter":
+            return await self.client.filter(self.filter_obj)
+        if name == "procedure":
+            entity = random.choice(self._entities)
+            return await self.client.invoke_procedure(self.procedure, entity.metadata, self.procedure_input)
+        if name == "kind_procedure":
+            return await self.client.invoke_kind_procedure(self.procedure, self.procedure_input)
+        if name == "provider_procedure":
+            return await self.provider_client.invoke_procedure(self.procedure, self.procedure_input)
+
+    async def _timed(self, name: str, scheduled_at: float) -> None:
+        recorder = self.recorders[name]
+        try:
+            await self.run_operation(name)
+        except Exception as e:
+            recorder.record_error(e)
+            return
+        recorder.record(time.perf_counter() - scheduled_at)
+
+    def _pick(self) -> str:
+        return random.choices(self.operations, self.weights)[0]
+
+    async def _closed_loop_user(self, deadline: float) -> None:
+        interval = self.users / self.target_rate if self.target_rate else 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < deadline:
+            await self._timed(self._pick(), time.perf_counter())
+            if interval > 0:
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    async def run(self) -> LoadReport:
+        if len(self._entities) == 0 and any(name in self.operations for name in ["update", "get", "procedure"]):
+            await self._create()
+        for recorder in self.recorders.values():
+            recorder.started_at = time.perf_counter()
+        if self.open_loop:
+            await run_open_loop(
+                lambda scheduled_at: self._timed(self._pick(), scheduled_at), self.target_rate, self.duration, self.users
+            )
+        else:
+            deadline = time.perf_counter() + self.duration
+            await asyncio.gather(*[self._closed_loop_user(deadline) for _ in range(self.users)])
+        for recorder in self.recorders.values():
+            recorder.finish()
+        return self.report()
+
+    def report(self) -> LoadReport:
+        operations = {}
+        requests = 0
+        errors = 0
+        duration = 0
+        for name, recorder in self.recorders.items():
+            result = recorder.result()
+            result.error_rate = round(recorder.errors / (result.count + recorder.errors), 4) \
+                if result.count + recorder.errors > 0 else 0
+            result.error_types = recorder.error_types
+            result.histogram = recorder.histogram(LATENCY_BUCKETS_MS)
+            operations[name] = result
+            requests += result.count + recorder.errors
+            errors += recorder.errors
+            duration = max(duration, result.duration_secs)
+        return LoadReport(
+            mode="open" if self.open_loop else "closed",
+            users=self.users,
+            target_rate=self.target_rate,
+            duration_secs=duration,
+            requests=requests,
+            errors=errors,
+            error_rate=round(errors / requests, 4) if requests > 0 else 0,
+            throughput=round(requests / duration, 2) if duration > 0 else 0,
+            operations=operations,
+        )
+
+
+def format_report(report: LoadReport) -> str:
+    rate = f", target rate {report.target_rate}/s" if report.target_rate else ""
+    lines = [
+        f"{report.mode} loop, {report.users} users{rate}, {report.duration_secs}s",
+        f"requests: {report.requests}, throughput: {report.throughput}/s, "
+        f"errors: {report.errors} ({report.error_rate * 100:.2f}%)",
+        "",
+        f"{'operation':<20} {'count':>8} {'ops/s':>10} {'errors':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}",
+    ]
+    for name, op in report.operations.items():
+        lines.append(
+            f"{name:<20} {op.count:>8} {op.ops_per_sec:>10} {op.errors:>8} {op.p50_ms:>10} "
+            f"{op.p95_ms:>10} {op.p99_ms:>10} {op.max_ms:>10}"
+        )
+    for name, op in report.operations.items():
+        if op.count == 0:
+            continue
+        lines.append("")
+        lines.append(f"{name} latency histogram")
+        for bucket, count in op.histogram.items():
+            bar = "#" * round(40 * count / op.count)
+            lines.append(f"  {bucket:>10} {count:>8} {bar}")
+    return "\n".join(lines)
+
+
+async def run_load(args: argparse.Namespace) -> LoadReport:
+    logger = logging.getLogger("papiea-bench")
+    engine = None
+    sdk = None
+    papiea_url, prefix, kind, s2skey = args.papiea_url, args.prefix, args.kind, args.s2skey
+    if args.mock:
+        from .mock_engine import MockEngine
+        from .python_sdk import ProviderSdk
+        engine = MockEngine(port=args.mock_port, logger=logger)
+        await engine.start()
+        papiea_url, prefix, kind, s2skey = engine.url, "papiea_bench", "Location", engine.admin_key
+        sdk = ProviderSdk.create_provider(papiea_url, s2skey, None, None, logger=logger)
+        sdk.new_kind(MOCK_KIND)
+        sdk.version(args.version)
+        sdk.prefix(prefix)
+        await sdk.register()
+    elif papiea_url is None or prefix is None or kind is None:
+        raise Exception("--papiea-url, --prefix and --kind are required unless --mock is used")
+    try:
+        async with EntityCRUD(papiea_url, prefix, args.version, kind, s2skey, logger=logger) as client, \
+                ProviderClient(papiea_url, prefix, args.version, s2skey, logger=logger) as provider_client:
+            generator = LoadGenerator(
+                client,
+                provider_client,
+                parse_mix(args.mix),
+                args.users,
+                args.duration,
+                open_loop=args.open_loop,
+                target_rate=args.rate,
+                spec_template=json.loads(args.spec) if args.spec else None,
+                procedure=args.procedure,
+                procedure_input=json.loads(args.procedure_input) if args.procedure_input else None,
+                filter_obj=json.loads(args.filter) if args.filter else None,
+                entities=args.entities,
+                logger=logger,
+            )
+            await generator.setup()
+            return await generator.run()
+    finally:
+        if sdk is not None:
+            await sdk.__aexit__(None, None, None)
+        if engine is not None:
+            await engine.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="papiea-bench", description="Load generator for papiea engines and providers")
+    parser.add_argument("--papiea-url", help="papiea engine url, e.g. http://localhost:3000")
+    parser.add_argument("--s2skey", help="s2s key used to authorize the requests")
+    parser.add_argument("--prefix", help="provider prefix")
+    parser.add_argument("--version", default="0.1.0", help="provider version")
+    parser.add_argument("--kind", help="kind to drive the load on")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"weighted operation mix, supported operations: {', '.join(OPERATIONS)}")
+    parser.add_argument("--users", type=int, default=10, help="virtual users (max in flight requests in open loop)")
+    parser.add_argument("--duration", type=float, default=30, help="load duration in seconds")
+    parser.add_argument("--open-loop", action="store_true", help="issue requests at --rate regardless of completion")
+    parser.add_argument("--rate", type=float, help="target requests per second for all the users together")
+    parser.add_argument("--spec", help="spec json of created entities")
+    parser.add_argument("--filter", help="filter json of filter operations")
+    parser.add_argument("--procedure", help="procedure name invoked by the procedure operations")
+    parser.add_argument("--procedure-input", help="procedure input json")
+    parser.add_argument("--entities", type=int, default=10, help="entities created before the load starts")
+    parser.add_argument("--json", help="write the report as json to this file, '-' for stdout")
+    parser.add_argument("--mock", action="store_true", help="run against an in-process mock engine")
+    parser.add_argument("--mock-port", type=int, default=3335)
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.get_event_loop().run_until_complete(run_load(args))
+    except Exception as e:
+        print(f"papiea-bench: {e}", file=sys.stderr)
+        sys.exit(2)
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,659 @@
+import asyncio
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from .core import Entity, IntentfulBehaviour, IntentfulStatus, IntentWatcher, Kind, Provider
+from .deadline import DEADLINE_HEADER
+from .transport import UNIX_SCHEME, SessionTransport, Transport
+from .utils import matches_filter, values_at
+from .watch import TERMINAL_WATCHER_STATUSES
+
+DEFAULT_PAGE_SIZE = 30
+DEFAULT_RETRY_DELAY_SECS = 1
+DEFAULT_CALLBACK_TIMEOUT_SECS = 60
+
+
+def now() -> str:
+    # Millisecond precision like the dates of the engine, so they sort as strings
+    return datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def error_response(status: int, message: str, error_type: str = "papiea_exception") -> web.Response:
+    return web.json_response({"error": {"code": status, "message": message, "type": error_type}}, status=status)
+
+
+class NotFound(Exception):
+    # Raised by the lookups of the handlers and answered with a 404, other errors are left to fail the request
+    def __init__(self, message: str, error_type: str = "entity_not_found_error"):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+def lookup(items: Dict[Any, Any], key: Any, description: str) -> Any:
+    if key not in items:
+        raise NotFound(f"{description} not found: {key}")
+    return items[key]
+
+
+def deep_merge(target: Any, partial: Any) -> Any:
+    if not isinstance(target, dict) or not isinstance(partial, dict):
+        return copy.deepcopy(partial)
+    merged = dict(target)
+    for key, value in partial.items():
+        merged[key] = deep_merge(target.get(key), value)
+    return merged
+
+
+def status_hash(status: Any) -> str:
+    # Stable across processes, unlike hash() of str which is salted per process
+    return hashlib.sha256(json.dumps(status, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def sort_entities(items: List[Any], sort: Optional[str]) -> List[Any]:
+    if not sort:
+        return items
+    fields = []
+    for field_sort in sort.split(","):
+        field, _, order = field_sort.partition(":")
+        fields.append((field, order == "desc"))
+    # Stable sorts applied from the least significant field, nulls go first
+    # in ascending order like in mongo
+    for field, descending in reversed(fields):
+        def key(item, field=field):
+            values = values_at(item, field)
+            value = values[0] if len(values) > 0 else None
+            return (value is not None, str(value) if not isinstance(value, (int, float)) else value)
+        try:
+            items = sorted(items, key=key, reverse=descending)
+        except TypeError:
+            items = sorted(items, key=lambda item, field=field: str(key(item)), reverse=descending)
+    return items
+
+
+def paginate(items: List[Any], offset: Any, limit: Any) -> dict:
+    skip = int(offset) if offset else 0
+    size = int(limit) if limit else DEFAULT_PAGE_SIZE
+    return {"results": items[skip:skip + size], "entity_count": len(items)}
+
+
+class SignatureDiffer(object):
+    # Supports the subset of SFS used for benchmarks and tests: plain field paths
+    # ("x", "a.b") and addition/removal of keyed array items ("objects.+{name}")
+    SIGNATURE_RE = re.compile(r"^(?P<path>[\w.\-]+?)(\.(?P<op>[+-])\{(?P<key>\w+)\})?$")
+
+    def __init__(self, signature: str):
+        match = self.SIGNATURE_RE.match(signature)
+        if match is None:
+            self.path = re.split(r"[^\w\-]", signature.lstrip("[{"))[0]
+            self.op = None
+            self.key = None
+        else:
+            self.path = match.group("path")
+            self.op = match.group("op")
+            self.key = match.group("key")
+
+    def diffs(self, spec: Any, status: Any) -> List[dict]:
+        spec_vals = values_at(spec, self.path)
+        status_vals = values_at(status, self.path)
+        if self.op is None:
+            if spec_vals == status_vals:
+                return []
+            return [{"keys": {}, "key": self.path, "spec-val": spec_vals, "status-val": status_vals}]
+        spec_items = spec_vals[0] if len(spec_vals) > 0 and isinstance(spec_vals[0], list) else []
+        status_items = status_vals[0] if len(status_vals) > 0 and isinstance(status_vals[0], list) else []
+        if self.op == "+":
+            source, other = spec_items, status_items
+        else:
+            source, other = status_items, spec_items
+        other_keys = {json.dumps(item.get(self.key)) for item in other if isinstance(item, dict)}
+        diffs = []
+        for item in source:
+            if isinstance(item, dict) and json.dumps(item.get(self.key)) not in other_keys:
+                diffs.append({
+                    "keys": {self.key: item.get(self.key)},
+                    "key": self.key,
+                    "spec-val": [item] if self.op == "+" else [],
+                    "status-val": [item] if self.op == "-" else [],
+                })
+        return diffs
+
+
+class MockEngine(object):
+    """In-process stand-in for the papiea engine implementing the routes used by the SDK.
+
+    Entities, intent watchers and s2s keys are kept in memory. Intentful handlers
+    of registered providers are invoked over http at callback_rate calls per second
+    (unlimited if None), which makes SDK throughput and latency measurable on a
+    single machine without mongo and the node engine. With port None the engine
+    does not listen and is only reachable through an InMemoryTransport over
+    its app; callback_transport likewise replaces http for the callbacks.
+    unix_socket makes it listen on a unix domain socket instead of tcp
+    """
+
+    def __init__(
+            self,
+            host: str = "localhost",
+            port: Optional[int] = 3333,
+            admin_key: str = "mock_admin_key",
+            callback_rate: Optional[float] = None,
+            callback_concurrency: int = 10,
+            logger: logging.Logger = logging.getLogger(__name__),
+            callback_transport: Optional[Transport] = None,
+            unix_socket: Optional[str] = None
+    ):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.admin_key = admin_key
+        self.callback_rate = callback_rate
+        self.callback_concurrency = callback_concurrency
+        self.logger = logger
+        self.providers: Dict[Tuple[str, str], Provider] = {}
+        self.entities: Dict[str, Entity] = {}
+        self.graveyard: Dict[str, Entity] = {}
+        self.watchers: Dict[str, IntentWatcher] = {}
+        self.s2skeys: Dict[str, Any] = {
+            admin_key: {"key": admin_key, "uuid": str(uuid.uuid4()), "user_info": {"is_admin": True},
+                        "owner": "admin", "created_at": now(), "deleted_at": None}
+        }
+        self.request_count = 0
+        self.callback_count = 0
+        self._retry_at: Dict[str, float] = {}
+        # Uuids of the entities whose spec or status changed since the driver last diffed them
+        self._dirty: Set[str] = set()
+        self._intents_changed = asyncio.Event()
+        self._handlers: Set[asyncio.Future] = set()
+        self._runner = None
+        self._driver = None
+        self.callback_transport = callback_transport
+        self._owns_transport = False
+        self.app = web.Application(middlewares=[self._count_requests])
+        self._add_routes()
+
+    async def __aenter__(self) -> "MockEngine":
+        await self.start()
+        return self
+
+    async def __aexit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    @property
+    def url(self) -> str:
+        if self.unix_socket is not None:
+            return f"{UNIX_SCHEME}{self.unix_socket}"
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        if self.port is not None or self.unix_socket is not None:
+            runner = web.AppRunner(self.app)
+            await runner.setup()
+            self._runner = runner
+            if self.unix_socket is not None:
+                site = web.UnixSite(runner, self.unix_socket)
+            else:
+                site = web.TCPSite(runner, self.host, self.port)
+            await site.start()
+        if self.callback_transport is None:
+            self.callback_transport = SessionTransport(DEFAULT_CALLBACK_TIMEOUT_SECS)
+            self._owns_transport = True
+        self._driver = asyncio.ensure_future(self._drive_intents())
+
+    async def close(self) -> None:
+        if self._driver is not None:
+            self._driver.cancel()
+            try:
+                await self._driver
+            except asyncio.CancelledError:
+                pass
+            self._driver = None
+        for handler in list(self._handlers):
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._owns_transport:
+            await self.callback_transport.close()
+            self.callback_transport = None
+            self._owns_transport = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _count_requests(self, request: web.Request, handler):
+        self.request_count += 1
+        try:
+            return await handler(request)
+        except NotFound as e:
+            return error_response(404, str(e), e.error_type)
+
+    def _add_routes(self) -> None:
+        self.app.add_routes([
+            web.post(r"/provider{slash:/*}", self.register_provider),
+            web.get("/provider/{prefix}/{version}/auth/user_info", self.user_info),
+            web.get("/provider/{prefix}/{version}/s2skey", self.list_keys),
+            web.post("/provider/{prefix}/{version}/s2skey", self.create_or_deactivate_key),
+            web.patch("/provider/{prefix}/{version}/update_status", self.update_status),
+            web.post("/provider/{prefix}/{version}/update_status", self.replace_status),
+            web.get(r"/services/intent_watcher{slash:/?}", self.list_watchers),
+            web.post("/services/intent_watcher/filter", self.filter_watchers),
+            web.get("/services/intent_watcher/{id}", self.get_watcher),
+            web.post("/services/{prefix}/{version}/check_permission", self.check_permission),
+            web.post("/services/{prefix}/{version}/procedure/{name}", self.provider_procedure),
+            web.post("/services/{prefix}/{version}/{kind}/filter", self.filter_entities),
+            web.post("/services/{prefix}/{version}/{kind}/procedure/{name}", self.kind_procedure),
+            web.post("/services/{prefix}/{version}/{kind}/{uuid}/procedure/{name}", self.entity_procedure),
+            web.get(r"/services/{prefix}/{version}/{kind}{slash:/?}", self.list_entities),
+            web.post(r"/services/{prefix}/{version}/{kind}{slash:/?}", self.create_entity),
+            web.get("/services/{prefix}/{version}/{kind}/{uuid}", self.get_entity),
+            web.put("/services/{prefix}/{version}/{kind}/{uuid}", self.update_entity),
+            web.delete("/services/{prefix}/{version}/{kind}/{uuid}", self.delete_entity),
+        ])
+
+    # Providers and security
+
+    def _provider(self, request: web.Request) -> Provider:
+        return lookup(self.providers, (request.match_info["prefix"], request.match_info["version"]), "Provider")
+
+    def _kind(self, request: web.Request) -> Kind:
+        for kind in self._provider(request)["kinds"]:
+            if kind["name"] == request.match_info["kind"]:
+                return kind
+        raise NotFound(f"Kind not found: {request.match_info['kind']}")
+
+    def _bearer(self, request: web.Request) -> Optional[str]:
+        parts = request.headers.get("Authorization", "").split(" ")
+        if len(parts) == 2 and parts[0] == "Bearer":
+            return parts[1]
+        return None
+
+    async def register_provider(self, request: web.Request) -> web.Response:
+        provider = await request.json()
+        self.providers[(provider["prefix"], provider["version"])] = provider
+        for entity in self.entities.values():
+            if (entity["metadata"]["provider_prefix"], entity["metadata"]["provider_version"]) == \
+                    (provider["prefix"], provider["version"]):
+                self._mark_dirty(entity)
+        return web.json_response("OK")
+
+    async def user_info(self, request: web.Request) -> web.Response:
+        key = self.s2skeys.get(self._bearer(request))
+        if key is None or key["deleted_at"] is not None:
+            return error_response(401, "Unknown s2s key", "unauthorized_error")
+        return web.json_response(key["user_info"])
+
+    async def list_keys(self, request: web.Request) -> web.Response:
+        prefix = request.match_info["prefix"]
+        return web.json_response([
+            key for key in self.s2skeys.values()
+            if key.get("provider_prefix") == prefix and key["deleted_at"] is None
+        ])
+
+    async def create_or_deactivate_key(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("active") is False:
+            self.s2skeys[body["key"]]["deleted_at"] = now()
+            return web.json_response("OK")
+        key = {
+            "key": body.get("key") or uuid.uuid4().hex,
+            "uuid": str(uuid.uuid4()),
+            "name": body.get("name"),
+            "owner": body.get("owner") or "mock_owner",
+            "provider_prefix": request.match_info["prefix"],
+            "user_info": body.get("user_info", {}),
+            "created_at": now(),
+            "deleted_at": None,
+        }
+        self.s2skeys[key["key"]] = key
+        return web.json_response(key)
+
+    async def check_permission(self, request: web.Request) -> web.Response:
+        return web.json_response({"success": "Ok"})
+
+    async def update_status(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        entity = lookup(self.entities, body["metadata"]["uuid"], "Entity")
+        return self._set_status(entity, deep_merge(entity["status"], body["status"]))
+
+    async def replace_status(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        entity = lookup(self.entities, body["metadata"]["uuid"], "Entity")
+        return self._set_status(entity, body["status"])
+
+    def _set_status(self, entity: Entity, status: Any) -> web.Response:
+        entity["status"] = status
+        entity["metadata"]["status_hash"] = status_hash(status)
+        entity["metadata"]["updated_at"] = now_ms()
+        self._mark_dirty(entity)
+        return web.json_response({"metadata": entity["metadata"], "status": status})
+
+    # Entities
+
+    def _kind_entities(self, request: web.Request, deleted: bool = False) -> List[Entity]:
+        store = self.graveyard if deleted else self.entities
+        prefix, version, kind = request.match_info["prefix"], request.match_info["version"], request.match_info["kind"]
+        return [
+            entity for entity in store.values()
+            if entity["metadata"]["kind"] == kind and entity["metadata"]["provider_prefix"] == prefix
+            and entity["metadata"]["provider_version"] == version
+        ]
+
+    def _filter(self, entities: List[Entity], filter_obj: dict, exact: bool, deleted: bool) -> List[Entity]:
+        filter_obj = {field: copy.deepcopy(value) for field, value in filter_obj.items() if value}
+        deleted_after = None
+        deleted_at = filter_obj.get("metadata", {}).pop("deleted_at", None)
+        if deleted_at == "papiea_one_hour_ago":
+            deleted_after = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        elif deleted_at == "papiea_one_day_ago":
+            deleted_after = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        results = []
+        for entity in entities:
+            if deleted_after is not None and entity["metadata"]["deleted_at"] < deleted_after.isoformat():
+                continue
+            if exact:
+                if any(filter_obj.get(field) and filter_obj[field] != entity.get(field) for field in ["spec", "status"]):
+                    continue
+                if not matches_filter(entity, {"metadata": filter_obj.get("metadata", {})}):
+                    continue
+            elif not matches_filter(entity, filter_obj):
+                continue
+            results.append(entity)
+        return results
+
+    async def list_entities(self, request: web.Request) -> web.Response:
+        query = request.query
+        filter_obj = {field: json.loads(query.get(field, "{}")) for field in ["spec", "status", "metadata"]}
+        deleted = query.get("deleted") == "true"
+        entities = self._filter(self._kind_entities(request, deleted), filter_obj, query.get("exact") == "true", deleted)
+        return web.json_response(paginate(sort_entities(entities, query.get("sort")), query.get("offset"), query.get("limit")))
+
+    async def filter_entities(self, request: web.Request) -> web.Response:
+        query = request.query
+        body = await request.json()
+        filter_obj = {field: body.get(field) or {} for field in ["spec", "status", "metadata"]}
+        deleted = query.get("deleted") == "true"
+        entities = self._filter(self._kind_entities(request, deleted), filter_obj, query.get("exact") == "true", deleted)
+        entities = sort_entities(entities, query.get("sort") or body.get("sort"))
+        return web.json_response(paginate(entities, query.get("offset") or body.get("offset"),
+                                          query.get("limit") or body.get("limit")))
+
+    async def get_entity(self, request: web.Request) -> web.Response:
+        return web.json_response(lookup(self.entities, request.match_info["uuid"], "Entity"))
+
+    async def create_entity(self, request: web.Request) -> web.Response:
+        kind = self._kind(request)
+        body = await request.json()
+        constructor = kind["kind_procedures"].get(f"__{kind['name']}_create")
+        if constructor is not None:
+            status, result = await self._invoke(constructor, {"input": body}, request)
+            if status >= 400:
+                return web.json_response(result, status=status)
+            spec, entity_status, metadata = result["spec"], result["status"], result.get("metadata") or {}
+        else:
+            spec = body.get("spec")
+            if spec is None:
+                return error_response(400, "Spec is missing", "validation_error")
+            entity_status, metadata = copy.deepcopy(spec), body.get("metadata") or {}
+        metadata = dict(
+            metadata,
+            uuid=metadata.get("uuid") or str(uuid.uuid4()),
+            kind=kind["name"],
+            provider_prefix=request.match_info["prefix"],
+            provider_version=request.match_info["version"],
+            spec_version=1,
+            created_at=now(),
+            deleted_at=None,
+            status_hash=status_hash(entity_status),
+            updated_at=now_ms(),
+        )
+        if metadata["uuid"] in self.entities:
+            return error_response(409, f"Entity with uuid: {metadata['uuid']} already exists", "conflicting_entity_error")
+        entity = {"metadata": metadata, "spec": spec, "status": entity_status}
+        self.entities[metadata["uuid"]] = entity
+        self._mark_dirty(entity)
+        watcher = None
+        if spec != entity_status and kind["intentful_behaviour"] != IntentfulBehaviour.SpecOnly:
+            watcher = self._new_watcher(entity, IntentfulStatus.Pending)
+        return web.json_response(dict(entity, intent_watcher=watcher))
+
+    async def update_entity(self, request: web.Request) -> web.Response:
+        kind = self._kind(request)
+        body = await request.json()
+        entity = lookup(self.entities, request.match_info["uuid"], "Entity")
+        if body["metadata"]["spec_version"] != entity["metadata"]["spec_version"]:
+            return error_response(409, f"Spec version mismatch for entity with uuid: {entity['metadata']['uuid']}",
+                                  "conflicting_entity_error")
+        entity["spec"] = body["spec"]
+        entity["metadata"]["spec_version"] += 1
+        entity["metadata"]["updated_at"] = now_ms()
+        if "extension" in body["metadata"]:
+            entity["metadata"]["extension"] = body["metadata"]["extension"]
+        watcher = None
+        if kind["intentful_behaviour"] == IntentfulBehaviour.SpecOnly:
+            entity["status"] = copy.deepcopy(body["spec"])
+            entity["metadata"]["status_hash"] = status_hash(entity["status"])
+        else:
+            for old_watcher in self._entity_watchers(entity):
+                self._set_watcher_status(old_watcher, IntentfulStatus.Outdated)
+            watcher = self._new_watcher(entity, IntentfulStatus.Active)
+            self._retry_at.pop(entity["metadata"]["uuid"], None)
+            self._mark_dirty(entity)
+        return web.json_response(dict(entity, intent_watcher=watcher))
+
+    async def delete_entity(self, request: web.Request) -> web.Response:
+        kind = self._kind(request)
+        entity = lookup(self.entities, request.match_info["uuid"], "Entity")
+        destructor = kind["kind_procedures"].get(f"__{kind['name']}_delete")
+        if destructor is not None:
+            status, result = await self._invoke(destructor, {"input": entity}, request)
+            if status >= 400:
+                return web.json_response(result, status=status)
+        del self.entities[entity["metadata"]["uuid"]]
+        entity["metadata"]["deleted_at"] = now()
+        entity["metadata"]["updated_at"] = now_ms()
+        self.graveyard[entity["metadata"]["uuid"]] = entity
+        return web.json_response("OK")
+
+    # Procedures
+
+    async def _invoke(self, procedure: Any, payload: Any, request: Optional[web.Request]) -> Tuple[int, Any]:
+        headers = CIMultiDict({"Content-Type": "application/json"})
+        if request is not None and "Authorization" in request.headers:
+            headers["Authorization"] = request.headers["Authorization"]
+        # The caller's remaining deadline is passed on, otherwise the callback timeout is the budget
+        if request is not None and DEADLINE_HEADER in request.headers:
+            headers[DEADLINE_HEADER] = request.headers[DEADLINE_HEADER]
+        else:
+            headers[DEADLINE_HEADER] = str(DEFAULT_CALLBACK_TIMEOUT_SECS * 1000)
+        async with self.callback_transport.request(
+                "post", procedure["procedure_callback"], json.dumps(payload).encode("utf-8"), headers, None
+        ) as resp:
+            text = await resp.text()
+            result = json.loads(text) if text else None
+            if resp.status >= 400:
+                return resp.status, {"error": {"code": resp.status, "message": "Procedure Invocation Error",
+                                               "type": "procedure_invocation_error", "cause": result}}
+            return resp.status, result
+
+    async def provider_procedure(self, request: web.Request) -> web.Response:
+        procedure = lookup(self._provider(request)["procedures"], request.match_info["name"], "Procedure")
+        status, result = await self._invoke(procedure, {"input": await request.json()}, request)
+        return web.json_response(result, status=status)
+
+    async def kind_procedure(self, request: web.Request) -> web.Response:
+        procedure = lookup(self._kind(request)["kind_procedures"], request.match_info["name"], "Procedure")
+        status, result = await self._invoke(procedure, {"input": await request.json()}, request)
+        return web.json_response(result, status=status)
+
+    async def entity_procedure(self, request: web.Request) -> web.Response:
+        procedure = lookup(self._kind(request)["entity_procedures"], request.match_info["name"], "Procedure")
+        entity = lookup(self.entities, request.match_info["uuid"], "Entity")
+        status, result = await self._invoke(procedure, dict(entity, input=await request.json()), request)
+        return web.json_response(result, status=status)
+
+    # Intent watchers
+
+    def _new_watcher(self, entity: Entity, status: IntentfulStatus) -> IntentWatcher:
+        metadata = entity["metadata"]
+        watcher = {
+            "uuid": str(uuid.uuid4()),
+            "entity_ref": {
+                "uuid": metadata["uuid"],
+                "kind": metadata["kind"],
+                "provider_prefix": metadata["provider_prefix"],
+                "provider_version": metadata["provider_version"],
+            },
+            "spec_version": metadata["spec_version"],
+            "status": status,
+            "created_at": now(),
+            "last_status_changed": None,
+        }
+        self.watchers[watcher["uuid"]] = watcher
+        return self._watcher_response(watcher)
+
+    def _entity_watchers(self, entity: Entity) -> List[IntentWatcher]:
+        return [
+            watcher for watcher in self.watchers.values()
+            if watcher["entity_ref"]["uuid"] == entity["metadata"]["uuid"]
+            and watcher["status"] not in TERMINAL_WATCHER_STATUSES
+        ]
+
+    def _set_watcher_status(self, watcher: IntentWatcher, status: IntentfulStatus) -> None:
+        if watcher["status"] != status:
+            watcher["status"] = status
+            watcher["last_status_changed"] = now()
+
+    @staticmethod
+    def _watcher_response(watcher: IntentWatcher) -> dict:
+        return {field: watcher[field] for field in [
+            "uuid", "entity_ref", "spec_version", "status", "created_at", "last_status_changed"
+        ]}
+
+    def _filtered_watchers(self, filter_obj: dict, query: Any) -> web.Response:
+        watchers = [watcher for watcher in self.watchers.values() if matches_filter(watcher, filter_obj)]
+        watchers = sort_entities(watchers, query.get("sort"))
+        page = paginate(watchers, query.get("offset"), query.get("limit"))
+        page["results"] = [self._watcher_response(watcher) for watcher in page["results"]]
+        return web.json_response(page)
+
+    async def list_watchers(self, request: web.Request) -> web.Response:
+        filter_obj = {}
+        for field in ["status", "created_at"]:
+            if field in request.query:
+                filter_obj[field] = request.query[field]
+        if "entity_ref" in request.query:
+            filter_obj["entity_ref"] = json.loads(request.query["entity_ref"])
+        return self._filtered_watchers(filter_obj, request.query)
+
+    async def filter_watchers(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        filter_obj = {field: body[field] for field in ["uuid", "entity_ref", "created_at", "status"] if body.get(field)}
+        return self._filtered_watchers(filter_obj, request.query)
+
+    async def get_watcher(self, request: web.Request) -> web.Response:
+        watcher = lookup(self.watchers, request.match_info["id"], "Intent watcher")
+        return web.json_response(self._watcher_response(watcher))
+
+    # Intentful driver
+
+    def _mark_dirty(self, entity: Entity) -> None:
+        self._dirty.add(entity["metadata"]["uuid"])
+        self._intents_changed.set()
+
+    def _entity_kind(self, entity: Entity) -> Optional[Kind]:
+        metadata = entity["metadata"]
+        provider = self.providers.get((metadata["provider_prefix"], metadata["provider_version"]))
+        if provider is None:
+            return None
+        return next((kind for kind in provider["kinds"] if kind["name"] == metadata["kind"]), None)
+
+    def _next_retry_secs(self) -> Optional[float]:
+        # Time until the earliest retry of a dirty entity, None waits for the next change
+        if len(self._dirty) == 0:
+            return None
+        return max(0.0, min(self._retry_at.get(entity_uuid, 0) for entity_uuid in self._dirty) - time.time())
+
+    def _pending_diffs(self) -> List[Tuple[Entity, Any, List[dict]]]:
+        # Only the dirty entities are diffed, the ones waiting for their retry stay dirty
+        pending = []
+        for entity_uuid in list(self._dirty):
+            entity = self.entities.get(entity_uuid)
+            kind = self._entity_kind(entity) if entity is not None else None
+            if kind is None or kind["intentful_behaviour"] == IntentfulBehaviour.SpecOnly:
+                self._dirty.discard(entity_uuid)
+                continue
+            if self._retry_at.get(entity_uuid, 0) > time.time():
+                continue
+            self._dirty.discard(entity_uuid)
+            diffs = []
+            for signature in kind["intentful_signatures"]:
+                diff_fields = SignatureDiffer(signature["signature"]).diffs(entity["spec"], entity["status"])
+                if len(diff_fields) > 0:
+                    diffs.append((signature, diff_fields))
+            if len(diffs) == 0:
+                for watcher in self._entity_watchers(entity):
+                    self._set_watcher_status(watcher, IntentfulStatus.Completed_Successfully)
+            else:
+                pending.append((entity, diffs[0][0], diffs[0][1]))
+        return pending
+
+    async def _handle_diff(self, entity: Entity, signature: Any, diff_fields: List[dict]) -> None:
+        for watcher in self._entity_watchers(entity):
+            self._set_watcher_status(watcher, IntentfulStatus.Active)
+        payload = dict(copy.deepcopy(entity), input=diff_fields)
+        delay = DEFAULT_RETRY_DELAY_SECS
+        try:
+            self.callback_count += 1
+            status, result = await self._invoke(signature, payload, None)
+            if status < 400 and isinstance(result, dict) and result.get("delay_secs") is not None:
+                delay = result["delay_secs"]
+        except Exception as e:
+            self.logger.error(f"Failed to invoke intentful handler {signature['name']}, reason: {e}")
+        self._retry_at[entity["metadata"]["uuid"]] = time.time() + delay
+
+    async def _drive_intents(self) -> None:
+        semaphore = asyncio.Semaphore(self.callback_concurrency)
+        in_flight = set()
+
+        async def handle(entity, signature, diff_fields):
+            try:
+                await self._handle_diff(entity, signature, diff_fields)
+            finally:
+                in_flight.discard(entity["metadata"]["uuid"])
+                semaphore.release()
+                # Diffed again once its retry is due, the handler may not have reached the spec
+                self._mark_dirty(entity)
+
+        while True:
+            self._intents_changed.clear()
+            for entity, signature, diff_fields in self._pending_diffs():
+                if entity["metadata"]["uuid"] in in_flight:
+                    continue
+                await semaphore.acquire()
+                in_flight.add(entity["metadata"]["uuid"])
+                handler = asyncio.ensure_future(handle(entity, signature, diff_fields))
+                self._handlers.add(handler)
+                handler.add_done_callback(self._handlers.discard)
+                if self.callback_rate:
+                    await asyncio.sleep(1 / self.callback_rate)
+            try:
+                await asyncio.wait_for(self._intents_changed.wait(), self._next_retry_secs())
+            except asyncio.TimeoutError:
+                pass
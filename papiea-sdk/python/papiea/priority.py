@@ -0,0 +1,131 @@
+import functools
+import hashlib
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from multidict import CIMultiDict
+
+from .circuit_breaker import STATUS_UPDATES, route_class
+
+# Status updates of intentful handlers, the engine waits on them
+CRITICAL = "critical"
+DEFAULT = "default"
+# Background task bookkeeping, scans and other bulk traffic
+BULK = "bulk"
+PRIORITY_CLASSES = [CRITICAL, DEFAULT, BULK]
+
+# Share of the free slots each class gets while all of them are waiting
+DEFAULT_WEIGHTS = {CRITICAL: 8, DEFAULT: 4, BULK: 1}
+
+_priority = ContextVar("papiea_priority", default=None)
+
+Flow = Tuple[str, str]
+
+
+@contextmanager
+def priority(priority_class: str) -> Iterator[None]:
+    # Engine requests made inside the block are queued with this priority class
+    if priority_class not in PRIORITY_CLASSES:
+        raise Exception(f"Unknown priority class: {priority_class}, expected one of: {', '.join(PRIORITY_CLASSES)}")
+    token = _priority.set(priority_class)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def with_priority(priority_class: str):
+    # Runs the decorated coroutine function inside priority(priority_class)
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with priority(priority_class):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def request_priority(method: str, url: str) -> str:
+    # The priority set by the caller, otherwise status updates are critical and the rest default
+    priority_class = _priority.get()
+    if priority_class is not None:
+        return priority_class
+    if route_class(method, url) == STATUS_UPDATES:
+        return CRITICAL
+    return DEFAULT
+
+
+def request_tenant(headers: CIMultiDict) -> str:
+    # Requests are grouped by the token they are made with, hashed so the queue holds no secrets
+    authorization = headers.get("Authorization")
+    if authorization is None:
+        return ""
+    return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:16]
+
+
+class FairQueue(object):
+    """Weighted fair queue of waiters over priority classes and tenants.
+
+    Every waiter gets a virtual finish time advancing by 1 / weight per waiter of
+    its flow, a flow being a (priority class, tenant) pair. The weight of a class
+    is split evenly between its tenants with waiters, so a class gets its share
+    of the slots regardless of how many tenants use it and no tenant starves the
+    others in the class. Waiters are served by increasing finish time
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self._heap: List[Tuple[float, int, Flow, Any]] = []
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._finish: Dict[Flow, float] = {}
+        self._queued: Dict[Flow, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __bool__(self) -> bool:
+        return len(self._heap) > 0
+
+    def _weight(self, flow: Flow) -> float:
+        priority_class, tenant = flow
+        tenants = sum(1 for other, count in self._queued.items() if other[0] == priority_class and count > 0)
+        if self._queued.get(flow, 0) == 0:
+            tenants += 1
+        return self.weights.get(priority_class, 1) / tenants
+
+    def append(self, item: Any, priority_class: str = DEFAULT, tenant: str = "") -> None:
+        flow = (priority_class, tenant)
+        start = max(self._virtual_time, self._finish.get(flow, 0.0))
+        finish = start + 1 / self._weight(flow)
+        self._finish[flow] = finish
+        self._queued[flow] = self._queued.get(flow, 0) + 1
+        self._sequence += 1
+        heapq.heappush(self._heap, (finish, self._sequence, flow, item))
+
+    def popleft(self) -> Any:
+        finish, _, flow, item = heapq.heappop(self._heap)
+        self._virtual_time = finish
+        self._dequeued(flow)
+        return item
+
+    def remove(self, item: Any) -> None:
+        for i, entry in enumerate(self._heap):
+            if entry[3] is item:
+                self._heap[i] = self._heap[-1]
+                self._heap.pop()
+                heapq.heapify(self._heap)
+                self._dequeued(entry[2])
+                return
+        raise ValueError("Item is not queued")
+
+    def _dequeued(self, flow: Flow) -> None:
+        self._queued[flow] -= 1
+        if self._queued[flow] == 0:
+            # An idle flow starts over from the current virtual time when it comes back
+            del self._queued[flow]
+            del self._finish[flow]
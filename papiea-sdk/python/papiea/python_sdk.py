@@ -1,15 +1,20 @@
 import logging
 import json
 import ssl
+import time
 from enum import Enum
 from types import TracebackType
-from typing import Any, Callable, List, NoReturn, Optional, Type, Union
+from typing import Any, Callable, Dict, List, NoReturn, Optional, Type, Union
 
 from aiohttp import web
 from opentracing import Tracer, Format, child_of
 
 from .api import ApiInstance
+from .balancer import EngineUrl, engine_transport
+from .callback_capture import REDACTED_HEADERS, CallbackCapture
+from .circuit_breaker import CircuitBreakers, find_breakers
 from .client import IntentWatcherClient, EntityCRUD
+from .compression import DEFAULT_COMPRESSION_THRESHOLD, compression_middleware
 from .core import (
     DataDescription,
     Entity,
@@ -26,20 +31,43 @@ from .core import (
     ConstructorProcedureDescription,
     ConstructorResult, CreateS2SKeyRequest, AttributeDict
 )
+from .deadline import deadline, header_deadline
+from .priority import BULK, with_priority
 from .python_sdk_context import IntentfulCtx, ProceduralCtx
 from .python_sdk_exceptions import ApiException, InvocationError, SecurityApiError
 from .utils import json_loads_attrs, validate_error_codes
 from .tracing_utils import init_default_tracer, get_special_operation_name
+from .transport import UNIX_SCHEME, Transport
 
 BackgroundTaskCallback = Callable[[IntentfulCtx, Optional[Any]], Any]
+# Receives the route of an intentful callback and the seconds spent in
+# each of its phases: parse, context, handler and serialize
+CallbackPhaseObserver = Callable[[str, Dict[str, float]], None]
 
 class ProviderServerManager(object):
-    def __init__(self, public_host: str = "localhost", public_port: int = 9000):
+    def __init__(self, public_host: str = "localhost", public_port: int = 9000, unix_socket: Optional[str] = None):
         self.public_host = public_host
         self.public_port = public_port
+        # Listen on this unix domain socket path instead of tcp, for engines in the same host/pod
+        self.unix_socket = unix_socket
         self.should_run = False
-        self.app = web.Application()
+        # Deadline of the handlers when the engine does not send one in the deadline header
+        self.callback_budget_secs: Optional[float] = None
+        self.app = web.Application(middlewares=[self._deadline_middleware])
         self._runner = None
+        self._capture: Optional[CallbackCapture] = None
+        # Circuits of the engine requests that are not closed are reported by the healthcheck
+        self.circuit_breakers: Optional[CircuitBreakers] = None
+        self.callback_phase_observer: Optional[CallbackPhaseObserver] = None
+
+    @web.middleware
+    async def _deadline_middleware(self, request: web.Request, handler):
+        # Engine calls made through the context of a handler inherit the remaining time of the callback
+        timeout_secs = header_deadline(request)
+        if timeout_secs is None:
+            timeout_secs = self.callback_budget_secs
+        with deadline(timeout_secs):
+            return await handler(request)
 
     def register_handler(
             self, route: str, handler: Callable[[web.Request], web.Response]
@@ -53,31 +81,62 @@ class ProviderServerManager(object):
             self.should_run = True
 
         async def healthcheck_callback_fn(request):
+            if self.circuit_breakers is not None:
+                return web.json_response(
+                    {"status": "Available", "circuits": self.circuit_breakers.open_circuits()}, status=200
+                )
             return web.json_response({"status": "Available"}, status=200)
 
         self.app.add_routes([web.get("/healthcheck", healthcheck_callback_fn)])
 
+    def capture(self, path: str, sample_rate: float = 1.0, redact_headers: List[str] = REDACTED_HEADERS) -> None:
+        if self._runner is not None:
+            raise Exception("Callback capture has to be enabled before the provider server is started")
+        if self._capture is not None:
+            raise Exception(f"Callbacks are already captured to {self._capture.path}")
+        self._capture = CallbackCapture(path, sample_rate, redact_headers)
+        self.app.middlewares.append(self._capture.middleware)
+
+    def compress_responses(self, threshold: int = DEFAULT_COMPRESSION_THRESHOLD) -> None:
+        # Procedure results and intent handler responses of at least threshold bytes are
+        # gzip or deflate compressed when the engine accepts it
+        if self._runner is not None:
+            raise Exception("Response compression has to be enabled before the provider server is started")
+        self.app.middlewares.append(compression_middleware(threshold))
+
     async def start_server(self) -> NoReturn:
         if self.should_run:
             runner = web.AppRunner(self.app)
             await runner.setup()
             self._runner = runner
-            site = web.TCPSite(runner, self.public_host, self.public_port)
+            if self.unix_socket is not None:
+                site = web.UnixSite(runner, self.unix_socket)
+            else:
+                site = web.TCPSite(runner, self.public_host, self.public_port)
             await site.start()
 
     async def close(self) -> None:
         if self._runner is not None:
             await self._runner.cleanup()
+            self._runner = None
+        if self._capture is not None:
+            await self._capture.close()
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
 
     def callback_url(self) -> str:
+        if self.unix_socket is not None:
+            return f"{UNIX_SCHEME}{self.unix_socket}"
         return f"http://{self.public_host}:{self.public_port}"
 
     def procedure_callback_url(self, procedure_name: str, kind: Optional[str]) -> str:
         if kind is not None:
-            return f"http://{self.public_host}:{self.public_port}/{kind}/{procedure_name}"
+            return f"{self.callback_url()}/{kind}/{procedure_name}"
         else:
             return (
-                f"http://{self.public_host}:{self.public_port}/{procedure_name}"
+                f"{self.callback_url()}/{procedure_name}"
             )
 
 
@@ -136,14 +195,17 @@ class SecurityApi(object):
 class ProviderSdk(object):
     def __init__(
             self,
-            papiea_url: str,
+            papiea_url: EngineUrl,
             s2skey: Secret,
             ssl_context: ssl.SSLContext,
             server_manager: Optional[ProviderServerManager] = None,
             allow_extra_props: bool = False,
             logger: logging.Logger = None,
-            tracer: Tracer = init_default_tracer()
+            tracer: Tracer = init_default_tracer(),
+            transport: Optional[Transport] = None,
+            warm_connections: int = 0
     ):
+        papiea_url, transport, self._balancer = engine_transport(papiea_url, transport)
         self._version = None
         self._prefix = None
         self._kind = []
@@ -161,7 +223,10 @@ class ProviderSdk(object):
         self.allow_extra_props = allow_extra_props
         self.ssl_context = ssl_context
         self._security_api = SecurityApi(self, s2skey)
-        self._intent_watcher_client = IntentWatcherClient(papiea_url, s2skey, ssl_context, logger, tracer)
+        self.transport = transport
+        if self._server_manager.circuit_breakers is None:
+            self._server_manager.circuit_breakers = find_breakers(transport)
+        self._intent_watcher_client = IntentWatcherClient(papiea_url, s2skey, ssl_context, logger, tracer, transport)
         self._provider_api = ApiInstance(
             self.provider_url,
             headers={
@@ -169,7 +234,9 @@ class ProviderSdk(object):
                 "Authorization": f"Bearer {self._s2skey}"
             },
             sslContext=self.ssl_context,
-            logger=self.logger
+            logger=self.logger,
+            transport=transport,
+            warm_connections=warm_connections
         )
         self._oauth2 = None
         self._authModel = None
@@ -185,6 +252,9 @@ class ProviderSdk(object):
             exc_tb: Optional[TracebackType],
     ) -> None:
         await self._provider_api.close()
+        await self._intent_watcher_client.close()
+        if self._balancer is not None:
+            await self._balancer.close()
 
     @property
     def provider(self) -> Provider:
@@ -340,6 +410,8 @@ class ProviderSdk(object):
                 self._provider.authModel = self._authModel
             await self._provider_api.post("/", self._provider)
             await self._server_manager.start_server()
+            # Ready for the status updates of the first callbacks
+            await self._provider_api.warm_up()
         elif self._prefix is None:
             ProviderSdk._provider_description_error("prefix")
         elif self._version is None:
@@ -360,17 +432,21 @@ class ProviderSdk(object):
 
     @staticmethod
     def create_provider(
-            papiea_url: str,
+            papiea_url: EngineUrl,
             s2skey: Secret,
             public_host: Optional[str],
             public_port: Optional[int],
             ssl_context: ssl.SSLContext = ssl.create_default_context(),
             allow_extra_props: bool = False,
             logger: logging.Logger = logging.getLogger(__name__),
-            tracer: Tracer = init_default_tracer()
+            tracer: Tracer = init_default_tracer(),
+            transport: Optional[Transport] = None,
+            unix_socket: Optional[str] = None,
+            warm_connections: int = 0
     ) -> "ProviderSdk":
-        server_manager = ProviderServerManager(public_host, public_port)
-        return ProviderSdk(papiea_url, s2skey, ssl_context, server_manager, allow_extra_props, logger, tracer)
+        server_manager = ProviderServerManager(public_host, public_port, unix_socket)
+        return ProviderSdk(papiea_url, s2skey, ssl_context, server_manager, allow_extra_props, logger, tracer,
+                           transport, warm_connections)
 
     def secure_with(
             self, oauth_config: Any, casbin_model: str, casbin_initial_policy: str
@@ -570,17 +646,28 @@ class KindBuilder:
                     carrier=req.headers,
                 )
                 with self.tracer.start_span(operation_name=f"{sfs_signature}_handler_procedure", references=child_of(span_context)):
+                    started_at = time.perf_counter()
                     body_obj = json_loads_attrs(await req.text())
-                    result = await handler(
-                        IntentfulCtx(self.provider, prefix, version, req.headers),
-                        Entity(
-                            metadata=body_obj.metadata,
-                            spec=body_obj.get("spec", {}),
-                            status=body_obj.get("status", {}),
-                        ),
-                        body_obj.input,
+                    parsed_at = time.perf_counter()
+                    ctx = IntentfulCtx(self.provider, prefix, version, req.headers)
+                    entity = Entity(
+                        metadata=body_obj.metadata,
+                        spec=body_obj.get("spec", {}),
+                        status=body_obj.get("status", {}),
                     )
-                return web.json_response(result)
+                    context_built_at = time.perf_counter()
+                    result = await handler(ctx, entity, body_obj.input)
+                    handled_at = time.perf_counter()
+                response = web.json_response(result)
+                observer = self.server_manager.callback_phase_observer
+                if observer is not None:
+                    observer(req.path, {
+                        "parse": parsed_at - started_at,
+                        "context": context_built_at - parsed_at,
+                        "handler": handled_at - context_built_at,
+                        "serialize": time.perf_counter() - handled_at,
+                    })
+                return response
             except InvocationError as e:
                 return web.json_response(e.to_response(), status=e.status_code)
             except Exception as e:
@@ -663,16 +750,20 @@ class BackgroundTaskBuilder:
         kind.on("state", callback_func)
         return BackgroundTaskBuilder(provider, tracer, name, kind, metadata_extension)
 
+    @with_priority(BULK)
     async def update_task_entity(self):
         if self.task_entity:
             async with EntityCRUD(self.provider.papiea_url, self.provider.get_prefix(), self.provider.get_version(),
-                                  self.name, self.provider.s2s_key, self.ssl_context) as client:
+                                  self.name, self.provider.s2s_key, self.ssl_context,
+                                  transport=self.provider.transport) as client:
                 self.task_entity = await client.get(self.task_entity.metadata)
 
+    @with_priority(BULK)
     async def start_task(self):
         if self.task_entity is None:
             async with EntityCRUD(self.provider.papiea_url, self.provider.get_prefix(), self.provider.get_version(),
-                                  self.name, self.provider.s2s_key, self.ssl_context) as client:
+                                  self.name, self.provider.s2s_key, self.ssl_context,
+                                  transport=self.provider.transport) as client:
                 if not self.metadata_extension is None:
                     self.task_entity = await client.create({
                         "spec": {"state": json.dumps(self.BackgroundTaskState.RunningSpecState)},
@@ -691,7 +782,8 @@ class BackgroundTaskBuilder:
         else:
             await self.update_task_entity()
             async with EntityCRUD(self.provider.papiea_url, self.provider.get_prefix(), self.provider.get_version(),
-                                  self.name, self.provider.s2s_key, self.ssl_context) as client:
+                                  self.name, self.provider.s2s_key, self.ssl_context,
+                                  transport=self.provider.transport) as client:
                 self.task_entity = await client.update(self.task_entity.metadata,
                                                        {"spec": {"state": json.dumps(self.BackgroundTaskState.RunningSpecState)}})
             url = f"{self.provider.get_prefix()}/{self.provider.get_version()}"
@@ -701,6 +793,7 @@ class BackgroundTaskBuilder:
                  "status": {"state": json.dumps(self.BackgroundTaskState.RunningStatusState)}},
             )
 
+    @with_priority(BULK)
     async def stop_task(self):
         if self.task_entity is None:
             raise Exception(f"Attempting to stop missing background task ({self.name}) on provider: "
@@ -708,7 +801,8 @@ class BackgroundTaskBuilder:
         else:
             await self.update_task_entity()
             async with EntityCRUD(self.provider.papiea_url, self.provider.get_prefix(), self.provider.get_version(),
-                                  self.name, self.provider.s2s_key, self.ssl_context) as client:
+                                  self.name, self.provider.s2s_key, self.ssl_context,
+                                  transport=self.provider.transport) as client:
                 self.task_entity = await client.update(self.task_entity.metadata,
                                                        {"spec": {"state": json.dumps(self.BackgroundTaskState.IdleSpecState)}})
             url = f"{self.provider.get_prefix()}/{self.provider.get_version()}"
@@ -718,6 +812,7 @@ class BackgroundTaskBuilder:
                  "status": {"state": json.dumps(self.BackgroundTaskState.IdleStatusState)}},
             )
 
+    @with_priority(BULK)
     async def kill_task(self):
         if self.task_entity is None:
             raise Exception(f"Attempting to kill missing background task ({self.name}) on provider: "
@@ -725,7 +820,8 @@ class BackgroundTaskBuilder:
         else:
             await self.update_task_entity()
             async with EntityCRUD(self.provider.papiea_url, self.provider.get_prefix(), self.provider.get_version(),
-                                  self.name, self.provider.s2s_key, self.ssl_context) as client:
+                                  self.name, self.provider.s2s_key, self.ssl_context,
+                                  transport=self.provider.transport) as client:
                 await client.delete(self.task_entity.metadata)
 
     @staticmethod
@@ -742,6 +838,7 @@ class BackgroundTaskBuilder:
                         BackgroundTaskBuilder.modify_task_schema(nested_prop["properties"])
                     nested_prop["x-papiea"] = "status-only"
 
+    @with_priority(BULK)
     async def update_task(self, task_context: dict):
         if self.task_entity is None:
             raise Exception(f"Attempting to update missing background task ({self.name}) on provider: "
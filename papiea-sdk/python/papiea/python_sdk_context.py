@@ -1,7 +1,6 @@
 import json
 from typing import Any, List, Optional, Tuple
 from deprecated import deprecated
-from aiohttp import ClientSession
 from multidict import CIMultiDict
 
 from .client import EntityCRUD
@@ -38,6 +37,7 @@ class ProceduralCtx(object):
             self.get_invoking_token(),
             self.ssl_context,
             self.provider.logger,
+            transport=self.provider.transport,
         )
 
     async def check_permission(
@@ -71,14 +71,15 @@ class ProceduralCtx(object):
     ) -> bool:
         try:
             data_binary = json.dumps(entity_action).encode("utf-8")
-            async with ClientSession(headers=headers) as session:
-                async with session.post(
-                    f"{ self.base_url }/{ provider_prefix }/{ provider_version }/check_permission",
-                    data=data_binary,
-                    headers=headers,
-                    ssl=self.ssl_context
-                ) as resp:
-                    res = await resp.text()
+            # Goes through the provider api transport, which also handles unix:// and in-memory engines
+            async with self.provider_api.transport.request(
+                "post",
+                f"{ self.base_url }/{ provider_prefix }/{ provider_version }/check_permission",
+                data_binary,
+                CIMultiDict(headers),
+                self.ssl_context
+            ) as resp:
+                res = await resp.text()
             res = json.loads(res)
             return res["success"] == "Ok"
         except Exception as e:
@@ -75,6 +75,29 @@ class PapieaServerException(PapieaBaseException):
     pass
 
 
+class CircuitOpenException(Exception):
+    # Raised without sending the request while the circuit of the endpoint and route class is open
+    def __init__(self, endpoint: str, route_class: str, retry_after: float):
+        super().__init__(f"Circuit for {route_class} requests to {endpoint} is open, retry in {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimitException(Exception):
+    # Raised when a request waited longer than allowed for a slot of the concurrency limiter
+    def __init__(self, endpoint: str, limit: int, queued: int):
+        super().__init__(f"Concurrency limit {limit} of {endpoint} reached with {queued} requests queued")
+        self.endpoint = endpoint
+        self.limit = limit
+        self.queued = queued
+
+
+class DeadlineExceededException(Exception):
+    # Raised when the deadline of the current operation passes before the engine answered
+    pass
+
+
 class InvocationError(Exception):
     def __init__(
             self,
@@ -92,6 +115,10 @@ class InvocationError(Exception):
     def from_error(e: Exception, message: str = ''):
         if e.__class__ == ApiException:
             return InvocationError(e.status, "Procedure Handler Error", e.details.error)
+        if isinstance(e, CircuitOpenException):
+            return InvocationError(503, "Procedure Handler Error", {"message": str(e)})
+        if isinstance(e, DeadlineExceededException):
+            return InvocationError(504, "Procedure Handler Error", {"message": str(e)})
         if message != '':
             return InvocationError(500, message, { "message": str(e) })
         return InvocationError(500, "Procedure Handler Error", e)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import time
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Set, Type
+
+from .client import BATCH_SIZE, SCAN_CONCURRENCY, EntityCRUD
+from .core import AttributeDict, Entity, EntityEventType
+from .utils import flatten_filter, matches_filter, values_at
+from .watch import PollingChangeSource
+
+ReplicaQueryResult = AttributeDict
+
+REFRESH_INTERVAL_SECS = 5
+
+
+def _index_key(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class KindReplica(object):
+    """In-memory replica of the entities of a kind matching filter_obj.
+
+    The replica is bootstrapped with a single parallel scan and then refreshed
+    every refresh_interval seconds with the entities changed since the previous
+    refresh, see PollingChangeSource. Entities that are deleted or stop matching
+    filter_obj are dropped. Queries are answered locally using the secondary
+    indexes where possible and report the staleness of the data in seconds
+    """
+
+    def __init__(
+            self,
+            client: EntityCRUD,
+            filter_obj: Any = None,
+            indexes: List[str] = [],
+            refresh_interval: float = REFRESH_INTERVAL_SECS,
+            batch_size: int = BATCH_SIZE,
+            concurrency: int = SCAN_CONCURRENCY,
+            logger: Optional[logging.Logger] = None
+    ):
+        self.client = client
+        self.filter_obj = filter_obj or {}
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.logger = logger or client.logger
+        self._entities: Dict[str, Entity] = {}
+        self._indexes: Dict[str, Dict[Any, Set[str]]] = {path: {} for path in indexes}
+        self._synced_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._source = PollingChangeSource(client, self.filter_obj, refresh_interval, batch_size)
+        self._started = False
+
+    async def __aenter__(self) -> "KindReplica":
+        await self.start()
+        return self
+
+    async def __aexit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._poll())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._source.close()
+        self._started = False
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh replica of kind: {self.client.kind}, reason: {e}")
+
+    async def refresh(self) -> None:
+        started_at = time.time()
+        if not self._started:
+            entities = await self._source.start(
+                lambda: self.client.scan(self.filter_obj, self.batch_size, self.concurrency)
+            )
+            self._entities = {}
+            self._indexes = {path: {} for path in self._indexes}
+            for entity in entities:
+                self._put(entity)
+            self._started = True
+        else:
+            for event in await self._source.poll():
+                if event.type in (EntityEventType.Created, EntityEventType.Updated):
+                    self._put(event.entity)
+                else:
+                    self._remove(event.entity.metadata.uuid)
+        self._synced_at = started_at
+
+    def add_index(self, path: str) -> None:
+        if path in self._indexes:
+            return
+        self._indexes[path] = {}
+        for entity in self._entities.values():
+            self._index(path, entity)
+
+    @property
+    def staleness(self) -> float:
+        if self._synced_at is None:
+            return float("inf")
+        return time.time() - self._synced_at
+
+    def get(self, uuid: str) -> Optional[Entity]:
+        return self._entities.get(uuid)
+
+    def query(self, filter_obj: Any) -> ReplicaQueryResult:
+        candidates = None
+        for path, condition in flatten_filter(filter_obj).items():
+            index = self._indexes.get(path)
+            keys = self._lookup_keys(condition)
+            if index is None or keys is None:
+                continue
+            uuids = set()
+            for key in keys:
+                uuids.update(index.get(key, ()))
+            candidates = uuids if candidates is None else candidates & uuids
+        if candidates is None:
+            entities = self._entities.values()
+        else:
+            entities = [self._entities[uuid] for uuid in candidates]
+        results = [entity for entity in entities if matches_filter(entity, filter_obj)]
+        return ReplicaQueryResult(results=results, entity_count=len(results), staleness=self.staleness)
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    @staticmethod
+    def _lookup_keys(condition: Any) -> Optional[List[Any]]:
+        if not isinstance(condition, dict):
+            return [_index_key(condition)]
+        if list(condition.keys()) == ["$eq"]:
+            return [_index_key(condition["$eq"])]
+        if list(condition.keys()) == ["$in"]:
+            return [_index_key(value) for value in condition["$in"]]
+        return None
+
+    def _index(self, path: str, entity: Entity) -> None:
+        index = self._indexes[path]
+        for value in values_at(entity, path):
+            index.setdefault(_index_key(value), set()).add(entity.metadata.uuid)
+            if isinstance(value, list):
+                for item in value:
+                    index.setdefault(_index_key(item), set()).add(entity.metadata.uuid)
+
+    def _unindex(self, path: str, entity: Entity) -> None:
+        index = self._indexes[path]
+        for value in values_at(entity, path):
+            keys = [_index_key(value)]
+            if isinstance(value, list):
+                keys.extend(_index_key(item) for item in value)
+            for key in keys:
+                uuids = index.get(key)
+                if uuids is not None:
+                    uuids.discard(entity.metadata.uuid)
+                    if len(uuids) == 0:
+                        del index[key]
+
+    def _put(self, entity: Entity) -> None:
+        self._remove(entity.metadata.uuid)
+        self._entities[entity.metadata.uuid] = entity
+        for path in self._indexes:
+            self._index(path, entity)
+
+    def _remove(self, uuid: str) -> None:
+        entity = self._entities.pop(uuid, None)
+        if entity is not None:
+            for path in self._indexes:
+                self._unindex(path, entity)
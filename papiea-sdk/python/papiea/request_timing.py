@@ -0,0 +1,189 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from aiohttp import TraceConfig
+from opentracing import Span
+
+from .core import AttributeDict
+
+TIMING_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+# Disjoint phases of a request up to its response headers, total is the sum of them
+PHASES = ["queued", "dns", "connect", "send", "server", "total"]
+
+RequestTimings = AttributeDict
+# class RequestTimings(TypedDict):
+#     method: str
+#     url: str
+#     status: Optional[int]
+#     error: Optional[str]
+#     reused: bool
+#     queued_ms: float
+#     dns_ms: float
+#     connect_ms: float
+#     send_ms: float
+#     server_ms: float
+#     total_ms: float
+
+# Span of the client call in progress, its requests are tagged with their timings
+_request_span = ContextVar("papiea_request_span", default=None)
+
+
+@contextmanager
+def request_span_scope(span: Span) -> Iterator[None]:
+    # Tags span with the timings of the requests made within, until the client call ends
+    token = _request_span.set(span)
+    try:
+        yield
+    finally:
+        _request_span.reset(token)
+
+
+def request_span() -> Optional[Span]:
+    return _request_span.get()
+
+
+class RequestTimer(object):
+    """Times the phases of the requests of aiohttp sessions created with its trace config.
+
+    The phases are waiting for a free connection of the pool, dns resolution,
+    opening the connection including the tls handshake, sending the request and
+    waiting for the response headers, i.e. server time plus network round trip.
+    Each request updates a histogram per phase, tags the span of the client call
+    with http.timing.<phase>_ms and is logged with its breakdown when slower than
+    slow_request_secs
+    """
+
+    def __init__(
+            self,
+            slow_request_secs: Optional[float] = None,
+            buckets_ms: List[float] = TIMING_BUCKETS_MS,
+            logger: logging.Logger = logging.getLogger(__name__)
+    ):
+        self.slow_request_secs = slow_request_secs
+        self.buckets_ms = buckets_ms
+        self.logger = logger
+        self.requests = 0
+        self.errors = 0
+        self.slow_requests = 0
+        self._histograms: Dict[str, List[int]] = {phase: [0] * (len(buckets_ms) + 1) for phase in PHASES}
+
+    def trace_config(self) -> TraceConfig:
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_queued_start.append(self._phase_start("queued"))
+        trace_config.on_connection_queued_end.append(self._phase_end("queued"))
+        trace_config.on_dns_resolvehost_start.append(self._phase_start("dns"))
+        trace_config.on_dns_resolvehost_end.append(self._phase_end("dns"))
+        trace_config.on_connection_create_start.append(self._phase_start("connect"))
+        trace_config.on_connection_create_end.append(self._phase_end("connect"))
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        if hasattr(trace_config, "on_request_headers_sent"):
+            trace_config.on_request_headers_sent.append(self._on_request_headers_sent)
+        else:
+            # aiohttp before 3.8 only signals the body, requests without one are timed in _finish
+            trace_config.on_request_chunk_sent.append(self._on_request_headers_sent)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        return trace_config
+
+    @staticmethod
+    async def _on_request_start(session, ctx, params) -> None:
+        ctx.started_at = time.perf_counter()
+        ctx.phase_started_at = {}
+        ctx.durations = {phase: 0.0 for phase in PHASES}
+        ctx.headers_sent_at = None
+        ctx.reused = False
+
+    @staticmethod
+    def _phase_start(phase: str):
+        async def on_phase_start(session, ctx, params) -> None:
+            ctx.phase_started_at[phase] = time.perf_counter()
+
+        return on_phase_start
+
+    @staticmethod
+    def _phase_end(phase: str):
+        async def on_phase_end(session, ctx, params) -> None:
+            started_at = ctx.phase_started_at.pop(phase, None)
+            if started_at is not None:
+                ctx.durations[phase] += time.perf_counter() - started_at
+
+        return on_phase_end
+
+    @staticmethod
+    async def _on_connection_reuse(session, ctx, params) -> None:
+        ctx.reused = True
+
+    @staticmethod
+    async def _on_request_headers_sent(session, ctx, params) -> None:
+        if ctx.headers_sent_at is None:
+            ctx.headers_sent_at = time.perf_counter()
+
+    async def _on_request_end(self, session, ctx, params) -> None:
+        self._finish(ctx, params.method, str(params.url), params.response.status, None)
+
+    async def _on_request_exception(self, session, ctx, params) -> None:
+        self.errors += 1
+        self._finish(ctx, params.method, str(params.url), None, type(params.exception).__name__)
+
+    def _finish(self, ctx, method: str, url: str, status: Optional[int], error: Optional[str]) -> None:
+        now = time.perf_counter()
+        durations = ctx.durations
+        # The connection is opened while resolving, its time is counted without the dns lookup
+        durations["connect"] = max(0.0, durations["connect"] - durations["dns"])
+        headers_sent_at = ctx.headers_sent_at
+        if headers_sent_at is None:
+            # A response without the headers sent signal, the request went out once the connection was ready
+            ready_at = ctx.started_at + durations["queued"] + durations["dns"] + durations["connect"]
+            headers_sent_at = ready_at if status is not None else now
+        durations["send"] = max(
+            0.0, headers_sent_at - ctx.started_at - durations["queued"] - durations["dns"] - durations["connect"]
+        )
+        durations["server"] = now - headers_sent_at
+        durations["total"] = now - ctx.started_at
+        timings = RequestTimings(
+            method=method,
+            url=url,
+            status=status,
+            error=error,
+            reused=ctx.reused,
+            **{f"{phase}_ms": round(durations[phase] * 1000, 3) for phase in PHASES}
+        )
+        self.record(timings)
+
+    def record(self, timings: RequestTimings) -> None:
+        self.requests += 1
+        for phase in PHASES:
+            self._observe(phase, timings[f"{phase}_ms"])
+        span = request_span()
+        if span is not None:
+            for phase in PHASES:
+                span.set_tag(f"http.timing.{phase}_ms", timings[f"{phase}_ms"])
+            span.set_tag("http.connection_reused", timings.reused)
+        if self.slow_request_secs is not None and timings.total_ms > self.slow_request_secs * 1000:
+            self.slow_requests += 1
+            breakdown = ", ".join(f"{phase} {timings[f'{phase}_ms']}ms" for phase in PHASES[:-1])
+            self.logger.warning(
+                f"Slow request {timings.method} {timings.url} took {timings.total_ms}ms "
+                f"({breakdown}, {'reused' if timings.reused else 'new'} connection)"
+            )
+
+    def _observe(self, phase: str, value_ms: float) -> None:
+        counts = self._histograms[phase]
+        for i, bucket in enumerate(self.buckets_ms):
+            if value_ms <= bucket:
+                counts[i] += 1
+                return
+        counts[-1] += 1
+
+    def histogram(self, phase: str) -> Dict[str, int]:
+        counts = self._histograms[phase]
+        histogram = {f"<={bucket}ms": count for bucket, count in zip(self.buckets_ms, counts)}
+        histogram[f">{self.buckets_ms[-1]}ms"] = counts[-1]
+        return histogram
+
+    def histograms(self) -> Dict[str, Dict[str, int]]:
+        return {phase: self.histogram(phase) for phase in PHASES}
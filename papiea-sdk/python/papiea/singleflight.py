@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import ssl
+from typing import Dict, Optional, Tuple
+
+from multidict import CIMultiDict
+
+from .circuit_breaker import READS, route_class
+from .deadline import DEADLINE_HEADER
+from .priority import request_priority
+from .transport import AwaitedResponse, Transport, TransportResponse
+
+# Headers changing what the engine answers or how, requests only match when they are equal.
+# Tracing headers differ on every call and are left out
+KEY_HEADERS = ["Authorization", "Accept", "Accept-Encoding", "Content-Type", "Content-Encoding"]
+
+FlightKey = Tuple[str, str, str, str, str]
+
+
+def flight_key(method: str, url: str, data: Optional[bytes], headers: CIMultiDict) -> FlightKey:
+    # Hashed so the key holds no credentials. The priority class is part of the key, a
+    # critical read would otherwise wait in the queue of a bulk one it was merged into
+    key_headers = "\n".join(f"{name}:{','.join(headers.getall(name, []))}" for name in KEY_HEADERS)
+    return (
+        method.lower(),
+        url,
+        hashlib.sha256(data or b"").hexdigest(),
+        hashlib.sha256(key_headers.encode("utf-8")).hexdigest(),
+        request_priority(method, url),
+    )
+
+
+class SingleflightTransport(Transport):
+    """Merges identical reads in flight at the same time into one request.
+
+    Gets and filters with the same url, body, priority class and KEY_HEADERS as a
+    read already in flight wait for its response instead of being sent, every caller
+    gets its own copy of the buffered response. Writes are always passed on, and so
+    are reads with a deadline, as a merged caller would be bound by the deadline of
+    the first one. suppressed counts the reads that were not sent
+    """
+
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        self.requests = 0
+        self.suppressed = 0
+        self._in_flight: Dict[FlightKey, asyncio.Future] = {}
+
+    async def _fetch(self, key, method, url, data, headers, ssl_context) -> TransportResponse:
+        try:
+            async with self.transport.request(method, url, data, headers, ssl_context) as resp:
+                body = await resp.read()
+                return TransportResponse(resp.status, resp.headers, body)
+        finally:
+            del self._in_flight[key]
+
+    async def _request(self, method, url, data, headers, ssl_context) -> TransportResponse:
+        key = flight_key(method, url, data, headers)
+        self.requests += 1
+        flight = self._in_flight.get(key)
+        if flight is None:
+            # A task of its own, so one caller being cancelled does not fail the others
+            flight = asyncio.ensure_future(self._fetch(key, method, url, data, headers, ssl_context))
+            self._in_flight[key] = flight
+            # Retrieves the error of a flight whose callers all went away, so it is not logged as unhandled
+            flight.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            self.suppressed += 1
+        resp = await asyncio.shield(flight)
+        return TransportResponse(resp.status, resp.headers, resp.body)
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        if route_class(method, url) != READS or DEADLINE_HEADER in headers:
+            return self.transport.request(method, url, data, headers, ssl_context)
+        return AwaitedResponse(self._request(method, url, data, headers, ssl_context))
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        await self.transport.close()
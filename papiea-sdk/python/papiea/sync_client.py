@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import ssl
+import threading
+from types import TracebackType
+from typing import Any, AsyncGenerator, Awaitable, Dict, Iterator, List, Optional, Tuple, Type, TypeVar
+
+from opentracing import Tracer
+
+from .balancer import EngineUrl
+from .client import BATCH_SIZE, REFERENCE_GRAPH_CONCURRENCY, SCAN_CONCURRENCY, EntityCRUD, FilterResults, \
+    IntentWatcherClient, ProviderClient
+from .core import AttributeDict, Entity, EntityEvent, EntityReference, EntitySpec, IntentfulStatus, IntentWatcher, \
+    Kind, Metadata, Secret, Spec
+from .tracing_utils import init_default_tracer
+from .transport import DEFAULT_CONNECT_TIMEOUT_SECS, SessionTransport, Transport
+from .watch import WATCH_INTERVAL_SECS, IntentWatcherTransition
+
+T = TypeVar("T")
+
+
+class BackgroundLoop(object):
+    """Event loop running forever on a daemon thread.
+
+    Coroutines submitted from any other thread run on it and their results are
+    returned to the caller, so sync code shares one loop and one connection pool
+    instead of creating them on every call with asyncio.run
+    """
+
+    def __init__(self, name: str = "papiea-sync-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._transport: Optional[SessionTransport] = None
+        self._lock = threading.Lock()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        if threading.current_thread() is self._thread:
+            raise Exception("Sync papiea clients cannot be called from their own background event loop")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def iterate(self, agen: AsyncGenerator[T, None]) -> Iterator[T]:
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(agen.aclose())
+
+    @property
+    def transport(self) -> SessionTransport:
+        # Created on the loop since aiohttp sessions belong to the loop they are created in
+        with self._lock:
+            if self._transport is None:
+                async def create():
+                    return SessionTransport(connect_timeout=DEFAULT_CONNECT_TIMEOUT_SECS)
+
+                self._transport = self.run(create())
+            return self._transport
+
+    def stop(self) -> None:
+        if self._transport is not None:
+            self.run(self._transport.close())
+            self._transport = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+_background_loop: Optional[BackgroundLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def background_loop() -> BackgroundLoop:
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = BackgroundLoop()
+        return _background_loop
+
+
+class SyncEntityCRUD(object):
+    def __init__(
+            self,
+            papiea_url: EngineUrl,
+            prefix: str,
+            version: str,
+            kind: str,
+            s2skey: Optional[str] = None,
+            sslContext: ssl.SSLContext = ssl.create_default_context(),
+            logger: logging.Logger = logging.getLogger(__name__),
+            tracer: Tracer = init_default_tracer(),
+            loop: Optional[BackgroundLoop] = None,
+            transport: Optional[Transport] = None
+    ):
+        self._loop = loop or background_loop()
+        transport = transport or self._loop.transport
+
+        async def create():
+            return EntityCRUD(papiea_url, prefix, version, kind, s2skey, sslContext, logger, tracer, transport)
+
+        self.client: EntityCRUD = self._loop.run(create())
+
+    def __enter__(self) -> "SyncEntityCRUD":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._loop.run(self.client.__aexit__(None, None, None))
+
+    def get(self, entity_reference: EntityReference) -> Entity:
+        return self._loop.run(self.client.get(entity_reference))
+
+    def get_all(self) -> List[Entity]:
+        return self._loop.run(self.client.get_all())
+
+    def get_all_stream(self) -> Iterator[Entity]:
+        return self._loop.iterate(self.client.get_all_stream())
+
+    def create(self, payload: Any) -> EntitySpec:
+        return self._loop.run(self.client.create(payload))
+
+    def update(self, metadata: Metadata, spec: Spec) -> EntitySpec:
+        return self._loop.run(self.client.update(metadata, spec))
+
+    def create_and_wait(self, payload: Any, timeout_secs: Optional[float] = None) -> Tuple[Optional[IntentWatcher], Entity]:
+        return self._loop.run(self.client.create_and_wait(payload, timeout_secs))
+
+    def update_and_wait(
+            self, metadata: Metadata, spec: Spec, timeout_secs: Optional[float] = None
+    ) -> Tuple[Optional[IntentWatcher], Entity]:
+        return self._loop.run(self.client.update_and_wait(metadata, spec, timeout_secs))
+
+    def delete(self, entity_reference: EntityReference) -> None:
+        return self._loop.run(self.client.delete(entity_reference))
+
+    def filter(self, filter_obj: Any, deleted: bool = False) -> FilterResults:
+        return self._loop.run(self.client.filter(filter_obj, deleted))
+
+    def filter_stream(self, filter_obj: Any, deleted: bool = False) -> Iterator[Entity]:
+        return self._loop.iterate(self.client.filter_stream(filter_obj, deleted))
+
+    def filter_iter(self, filter_obj: Any, batch_size: Optional[int] = None, offset: Optional[int] = None) -> Iterator[Entity]:
+        iter_func = self._loop.run(self.client.filter_iter(filter_obj))
+        return self._loop.iterate(iter_func(batch_size, offset))
+
+    def list_iter(self, batch_size: Optional[int] = None, offset: Optional[int] = None) -> Iterator[Entity]:
+        return self.filter_iter({}, batch_size, offset)
+
+    def scan(self, filter_obj: Any, batch_size: int = BATCH_SIZE, concurrency: int = SCAN_CONCURRENCY) -> List[Entity]:
+        return self._loop.run(self.client.scan(filter_obj, batch_size, concurrency))
+
+    def watch(self, filter_obj: Any = None) -> Iterator[EntityEvent]:
+        return self._loop.iterate(self.client.watch(filter_obj))
+
+    def fetch_reference_graph(
+            self,
+            root: Entity,
+            kinds: List[Kind],
+            max_depth: int = 1,
+            concurrency: int = REFERENCE_GRAPH_CONCURRENCY,
+            batch_size: Optional[int] = None
+    ) -> Dict[str, Entity]:
+        return self._loop.run(self.client.fetch_reference_graph(root, kinds, max_depth, concurrency, batch_size))
+
+    def invoke_procedure(self, procedure_name: str, entity_reference: EntityReference, input_: Any) -> Any:
+        return self._loop.run(self.client.invoke_procedure(procedure_name, entity_reference, input_))
+
+    def invoke_kind_procedure(self, procedure_name: str, input_: Any) -> Any:
+        return self._loop.run(self.client.invoke_kind_procedure(procedure_name, input_))
+
+
+class SyncIntentWatcherClient(object):
+    def __init__(
+            self,
+            papiea_url: EngineUrl,
+            s2skey: Secret = None,
+            sslContext: ssl.SSLContext = ssl.create_default_context(),
+            logger: logging.Logger = logging.getLogger(__name__),
+            tracer: Optional[Tracer] = init_default_tracer(),
+            loop: Optional[BackgroundLoop] = None,
+            transport: Optional[Transport] = None
+    ):
+        self._loop = loop or background_loop()
+        transport = transport or self._loop.transport
+
+        async def create():
+            return IntentWatcherClient(papiea_url, s2skey, sslContext, logger, tracer, transport)
+
+        self.client: IntentWatcherClient = self._loop.run(create())
+
+    def __enter__(self) -> "SyncIntentWatcherClient":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._loop.run(self.client.__aexit__(None, None, None))
+
+    def get_intent_watcher(self, id: str) -> IntentWatcher:
+        return self._loop.run(self.client.get_intent_watcher(id))
+
+    def list_intent_watcher(
+            self, offset: Optional[int] = None, limit: Optional[int] = None, sort: Optional[str] = None
+    ) -> List[IntentWatcher]:
+        return self._loop.run(self.client.list_intent_watcher(offset, limit, sort))
+
+    def filter_intent_watcher(
+            self, filter_obj: Any, offset: Optional[int] = None, limit: Optional[int] = None, sort: Optional[str] = None
+    ) -> List[IntentWatcher]:
+        return self._loop.run(self.client.filter_intent_watcher(filter_obj, offset, limit, sort))
+
+    def filter_intent_watcher_iter(
+            self, filter_obj: Any, sort: Optional[str] = None, batch_size: Optional[int] = None, offset: Optional[int] = None
+    ) -> Iterator[IntentWatcher]:
+        iter_func = self._loop.run(self.client.filter_intent_watcher_iter(filter_obj, sort))
+        return self._loop.iterate(iter_func(batch_size, offset))
+
+    def list_intent_watcher_iter(
+            self, sort: Optional[str] = None, batch_size: Optional[int] = None, offset: Optional[int] = None
+    ) -> Iterator[IntentWatcher]:
+        return self.filter_intent_watcher_iter({}, sort, batch_size, offset)
+
+    def watch_transitions(
+            self, filter_obj: Any = None, interval: float = WATCH_INTERVAL_SECS, batch_size: int = BATCH_SIZE
+    ) -> Iterator[IntentWatcherTransition]:
+        return self._loop.iterate(self.client.watch_transitions(filter_obj, interval, batch_size))
+
+    def wait_for_completion(self, watcher_ref: AttributeDict, timeout_secs: Optional[float] = None) -> IntentWatcher:
+        return self._loop.run(self.client.wait_for_completion(watcher_ref, timeout_secs))
+
+    def wait_for_watcher_status(self, watcher_ref: AttributeDict, watcher_status: IntentfulStatus,
+                                timeout_secs: float = 50, delay_millis: float = 500) -> bool:
+        return self._loop.run(
+            self.client.wait_for_watcher_status(watcher_ref, watcher_status, timeout_secs, delay_millis)
+        )
+
+
+class SyncProviderClient(object):
+    def __init__(
+            self,
+            papiea_url: EngineUrl,
+            provider: str,
+            version: str,
+            s2skey: Optional[str] = None,
+            sslContext: ssl.SSLContext = ssl.create_default_context(),
+            logger: logging.Logger = logging.getLogger(__name__),
+            tracer: Optional[Tracer] = init_default_tracer(),
+            loop: Optional[BackgroundLoop] = None,
+            transport: Optional[Transport] = None
+    ):
+        self._loop = loop or background_loop()
+        transport = transport or self._loop.transport
+
+        async def create():
+            return ProviderClient(papiea_url, provider, version, s2skey, sslContext, logger, tracer, transport)
+
+        self.client: ProviderClient = self._loop.run(create())
+
+    def __enter__(self) -> "SyncProviderClient":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._loop.run(self.client.__aexit__(None, None, None))
+
+    def get_kind(self, kind: str) -> SyncEntityCRUD:
+        client = self.client
+        return SyncEntityCRUD(
+            client.papiea_url, client.provider, client.version, kind, client.s2skey, client.sslContext, client.logger,
+            client.tracer, self._loop, client.transport
+        )
+
+    def fetch_reference_graph(
+            self,
+            root: Entity,
+            kinds: List[Kind],
+            max_depth: int = 1,
+            concurrency: int = REFERENCE_GRAPH_CONCURRENCY,
+            batch_size: Optional[int] = None
+    ) -> Dict[str, Entity]:
+        return self._loop.run(self.client.fetch_reference_graph(root, kinds, max_depth, concurrency, batch_size))
+
+    def invoke_procedure(self, procedure_name: str, input: Any) -> Any:
+        return self._loop.run(self.client.invoke_procedure(procedure_name, input))
@@ -0,0 +1,388 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import ssl
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, Callable, Dict, IO, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+import aiohttp
+from aiohttp import BaseConnector, ClientSession, ClientTimeout, TCPConnector, TraceConfig, UnixConnector, web
+from aiohttp.http import HttpVersion11, RawRequestMessage
+from aiohttp.streams import StreamReader
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+UNIX_SCHEME = "unix://"
+# Major version of aiohttp whose Application._handle the in-memory transport dispatches to
+IN_MEMORY_AIOHTTP_MAJOR = 3
+DEFAULT_CONNECT_TIMEOUT_SECS = 5
+
+# Returns the simulated latency of a replayed response in seconds
+LatencyDistribution = Callable[[], float]
+
+
+class BufferedContent(object):
+    # Stands in for the aiohttp StreamReader of a response that is already in memory
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, n: int) -> AsyncGenerator[bytes, None]:
+        for i in range(0, len(self.body), n):
+            yield self.body[i:i + n]
+
+
+class TransportResponse(object):
+    # Buffered response with the subset of the aiohttp ClientResponse interface
+    # used by ApiInstance and check_response
+    def __init__(self, status: int, headers: Any, body: bytes):
+        self.status = status
+        self.headers = CIMultiDict(headers)
+        self.body = body
+        self.content = BufferedContent(body)
+
+    async def __aenter__(self) -> "TransportResponse":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    async def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class AwaitedResponse(object):
+    # Async context manager over a coroutine producing a TransportResponse
+    def __init__(self, coro):
+        self.coro = coro
+
+    async def __aenter__(self) -> TransportResponse:
+        return await self.coro
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+
+class Transport(ABC):
+    # Issues the http requests of an ApiInstance. request() returns an async
+    # context manager yielding a response with status, headers, read(), text()
+    # and content.iter_chunked()
+    @abstractmethod
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        ...
+
+    async def renew(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+def engine_root(url: str) -> str:
+    # Root of the engine serving url. Nothing is routed there, so a request to it
+    # is answered with a 404 without running a query
+    if url.startswith(UNIX_SCHEME):
+        socket_path, _ = split_unix_url(url)
+        return f"{UNIX_SCHEME}{quote(socket_path, safe='')}/"
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+async def warm_up(transport: Transport, url: str, connections: int, ssl_context: Optional[ssl.SSLContext]) -> int:
+    # Opens keep-alive connections to the engine of url ahead of the first requests with
+    # concurrent HEAD requests to its root. The api paths are not used as express serves
+    # HEAD with the GET handlers, e.g. the entity list query. Any answer leaves its
+    # connection in the pool. Returns how many were answered
+    root = engine_root(url)
+
+    async def open_connection() -> bool:
+        try:
+            async with transport.request("head", root, None, CIMultiDict(), ssl_context) as resp:
+                await resp.read()
+                return True
+        except Exception:
+            return False
+
+    opened = await asyncio.gather(*[open_connection() for i in range(connections)])
+    return sum(opened)
+
+
+def split_unix_url(url: str) -> Tuple[str, str]:
+    """Splits a unix:// url into the socket path and the http url to request over it.
+
+    The socket path is either percent-encoded as the host, e.g.
+    unix://%2Fvar%2Frun%2Fpapiea/services, or is the leading part of the path up
+    to a segment ending with .sock, e.g. unix:///var/run/papiea.sock/services
+    """
+    rest = url[len(UNIX_SCHEME):]
+    if not rest.startswith("/"):
+        host, _, path = rest.partition("/")
+        return unquote(host), f"http://localhost/{path}"
+    end = rest.find(".sock")
+    while end != -1 and end + 5 < len(rest) and rest[end + 5] != "/":
+        end = rest.find(".sock", end + 1)
+    if end == -1:
+        raise Exception(f"Cannot find the socket path in url: {url}, it has to end with .sock or be percent-encoded")
+    end += 5
+    return rest[:end], "http://localhost" + (rest[end:] or "/")
+
+
+class SessionTransport(Transport):
+    # aiohttp ClientSession transport. unix:// urls are sent over a unix domain
+    # socket with a session per socket path, everything else goes over tcp.
+    # timeout bounds whole requests and connect_timeout opening connections, both
+    # in seconds. Without a timeout requests are bounded by the deadline of the call.
+    # keepalive_timeout is how long idle tcp connections are kept, the aiohttp default without it.
+    # trace_configs are given to every session, e.g. the one of a RequestTimer
+    def __init__(
+            self,
+            timeout: Optional[float] = None,
+            connect_timeout: Optional[float] = None,
+            keepalive_timeout: Optional[float] = None,
+            trace_configs: Optional[List[TraceConfig]] = None
+    ):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.trace_configs = trace_configs
+        self.session = self._new_session()
+        self._unix_sessions: Dict[str, ClientSession] = {}
+
+    def _new_session(self, connector: Optional[BaseConnector] = None) -> ClientSession:
+        if connector is None and self.keepalive_timeout is not None:
+            connector = TCPConnector(keepalive_timeout=self.keepalive_timeout)
+        return ClientSession(
+            connector=connector, timeout=ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout),
+            trace_configs=self.trace_configs
+        )
+
+    def _session_for(self, url: str) -> Tuple[ClientSession, str]:
+        if not url.startswith(UNIX_SCHEME):
+            return self.session, url
+        socket_path, url = split_unix_url(url)
+        session = self._unix_sessions.get(socket_path)
+        if session is None:
+            session = self._new_session(UnixConnector(path=socket_path))
+            self._unix_sessions[socket_path] = session
+        return session, url
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        session, url = self._session_for(url)
+        return session.request(method.upper(), url, data=data, headers=headers, ssl=ssl_context)
+
+    async def renew(self) -> None:
+        await self.close()
+        self.session = self._new_session()
+
+    async def close(self) -> None:
+        await self.session.close()
+        for session in self._unix_sessions.values():
+            await session.close()
+        self._unix_sessions = {}
+
+
+class InMemoryConnection(object):
+    # Stands in for both the server protocol and the socket transport of an
+    # in-memory request, there is no peer and reading is never paused
+    ssl_context = None
+    peername = None
+    sockname = None
+    _reading_paused = False
+
+    @property
+    def transport(self) -> "InMemoryConnection":
+        return self
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return default
+
+    def pause_reading(self, *args, **kwargs) -> None:
+        pass
+
+    def resume_reading(self, *args, **kwargs) -> None:
+        pass
+
+
+class InMemoryTransport(Transport):
+    """Dispatches requests straight into an aiohttp Application without sockets or http parsing.
+
+    Routing, middlewares and handlers of the application run as they would behind
+    a server, e.g. for the MockEngine app or ProviderServerManager.app. Only the
+    path and query of the url are used. Handlers have to return a buffered
+    response (web.Response or web.json_response), streamed responses are not supported.
+    Building and dispatching the requests relies on aiohttp internals, the parsed
+    request message and the private Application._handle, so the aiohttp version is
+    checked against IN_MEMORY_AIOHTTP_MAJOR when the transport is created.
+    aiohttp.test_utils.make_mocked_request is not used as it creates mocks on every
+    request, which would dominate the cost the transport is meant to leave out
+    """
+
+    def __init__(self, app: web.Application):
+        major = int(aiohttp.__version__.split(".")[0])
+        if major != IN_MEMORY_AIOHTTP_MAJOR or not callable(getattr(app, "_handle", None)):
+            raise Exception(f"In-memory transport does not support aiohttp {aiohttp.__version__}, "
+                            f"it requires aiohttp {IN_MEMORY_AIOHTTP_MAJOR}.x")
+        self.app = app
+        self._connection = InMemoryConnection()
+
+    async def _request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict) -> TransportResponse:
+        if not self.app.frozen:
+            self.app.freeze()
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        headers = CIMultiDict(headers)
+        if data is not None:
+            headers["Content-Length"] = str(len(data))
+        loop = asyncio.get_event_loop()
+        # Fields by name, a change of the message in aiohttp fails here rather than misplacing them
+        message = RawRequestMessage(
+            method=method.upper(), path=path, version=HttpVersion11, headers=CIMultiDictProxy(headers),
+            raw_headers=tuple((name.encode("utf-8"), value.encode("utf-8")) for name, value in headers.items()),
+            should_close=False, compression=None, upgrade=False, chunked=False, url=URL(path)
+        )
+        payload = StreamReader(self._connection, limit=2 ** 16, loop=loop)
+        if data:
+            payload.feed_data(data)
+        payload.feed_eof()
+        request = web.Request(message, payload, self._connection, None, asyncio.current_task(), loop)
+        try:
+            response = await self.app._handle(request)
+        except web.HTTPException as e:
+            response = e
+        body = response.body if isinstance(response, web.Response) else None
+        if body is None:
+            body = b""
+        elif isinstance(body, str):
+            body = body.encode(response.charset or "utf-8")
+        elif not isinstance(body, (bytes, bytearray)):
+            raise Exception(f"In-memory transport cannot serve a streamed response for {method} {path}")
+        return TransportResponse(response.status, response.headers, bytes(body))
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        return AwaitedResponse(self._request(method, url, data, headers))
+
+
+RecordKey = Tuple[str, str, str]
+
+
+def record_key(method: str, url: str, data: Optional[bytes]) -> RecordKey:
+    # Keyed by path rather than full url so recordings do not depend on the engine address
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    return method.lower(), path, hashlib.sha256(data or b"").hexdigest()
+
+
+class RecordingTransport(Transport):
+    """Passes requests to another transport and appends every exchange to an NDJSON file.
+
+    Each line holds method, path, body hash and the response status, content type
+    and base64 encoded body, which is what ReplayTransport serves the responses from.
+    Bodies are stored as received from the inner transport, binary ones included
+    """
+
+    def __init__(self, path: str, transport: Transport):
+        self.path = path
+        self.transport = transport
+        self._file: Optional[IO[str]] = None
+
+    async def _request(self, method, url, data, headers, ssl_context) -> TransportResponse:
+        async with self.transport.request(method, url, data, headers, ssl_context) as resp:
+            body = await resp.read()
+            response = TransportResponse(resp.status, {"Content-Type": resp.headers.get("Content-Type", "")}, body)
+        method, path, body_hash = record_key(method, url, data)
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps({
+            "method": method,
+            "path": path,
+            "body_hash": body_hash,
+            "status": response.status,
+            "content_type": response.headers["Content-Type"],
+            "body_b64": base64.b64encode(body).decode("ascii"),
+        }, separators=(",", ":")) + "\n")
+        self._file.flush()
+        return response
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        return AwaitedResponse(self._request(method, url, data, headers, ssl_context))
+
+    async def renew(self) -> None:
+        await self.transport.renew()
+
+    async def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        await self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """Serves recorded responses from memory without opening any socket.
+
+    Repeated requests with the same key get the recorded responses in order,
+    the last one is served again once they run out. latency optionally delays
+    every response by a sampled amount of seconds
+    """
+
+    def __init__(self, path: str, latency: Optional[LatencyDistribution] = None):
+        self.latency = latency
+        self._responses: Dict[RecordKey, List[dict]] = {}
+        self._served: Dict[RecordKey, int] = {}
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    key = (record["method"], record["path"], record["body_hash"])
+                    self._responses.setdefault(key, []).append(record)
+
+    async def _request(self, method, url, data) -> TransportResponse:
+        key = record_key(method, url, data)
+        responses = self._responses.get(key)
+        if responses is None:
+            raise Exception(f"No recorded response for {key[0]} {key[1]} with body hash: {key[2]}")
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        record = responses[min(served, len(responses) - 1)]
+        if self.latency is not None:
+            await asyncio.sleep(self.latency())
+        return TransportResponse(record["status"], {"Content-Type": record["content_type"]},
+                                 base64.b64decode(record["body_b64"]))
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: CIMultiDict,
+                ssl_context: Optional[ssl.SSLContext]):
+        return AwaitedResponse(self._request(method, url, data))
+
+    def reset(self) -> None:
+        self._served = {}
+
+
+def constant_latency(seconds: float) -> LatencyDistribution:
+    return lambda: seconds
+
+
+def uniform_latency(low: float, high: float) -> LatencyDistribution:
+    return lambda: random.uniform(low, high)
+
+
+def lognormal_latency(median: float, sigma: float = 0.5) -> LatencyDistribution:
+    # Long tailed like real request latencies, median in seconds
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)
+
+
+def empirical_latency(samples: List[float]) -> LatencyDistribution:
+    return lambda: random.choice(samples)
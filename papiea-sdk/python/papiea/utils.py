@@ -1,7 +1,9 @@
 import json
-from typing import Any, Optional
+from typing import Any, List, Optional
 
-from .core import AttributeDict, ErrorSchemas
+from .core import AttributeDict, DataDescription, Entity, EntityReference, ErrorSchemas
+
+ARRAY_ITEM = "[]"
 
 
 def json_loads_attrs(s: str) -> Any:
@@ -16,4 +18,130 @@ def validate_error_codes(error_schemas: Optional[ErrorSchemas]):
         for code in error_schemas:
             numeric_code = int(code)
             if not isinstance(numeric_code, int) or not (400 < numeric_code < 599):
-                raise Exception(f"Error description should feature status code in 4xx or 5xx, received: {numeric_code}")
\ No newline at end of file
+                raise Exception(f"Error description should feature status code in 4xx or 5xx, received: {numeric_code}")
+
+
+def reference_paths(kind_structure: DataDescription) -> List[List[str]]:
+    # Entity references are described as objects featuring both 'uuid' and 'kind'
+    # properties. Array items are denoted by ARRAY_ITEM segment in the resulting paths
+    paths = []
+
+    def collect(schema: Any, path: List[str]):
+        if not isinstance(schema, dict):
+            return
+        if schema.get("type") == "array":
+            collect(schema.get("items"), path + [ARRAY_ITEM])
+            return
+        properties = schema.get("properties")
+        if not isinstance(properties, dict):
+            return
+        if "uuid" in properties and "kind" in properties:
+            paths.append(path)
+            return
+        for name, prop in properties.items():
+            collect(prop, path + [name])
+
+    for kind_name in kind_structure:
+        collect(kind_structure[kind_name], [])
+    return paths
+
+
+def extract_references(obj: Any, paths: List[List[str]]) -> List[EntityReference]:
+    refs = []
+
+    def extract(value: Any, path: List[str]):
+        if value is None:
+            return
+        if len(path) == 0:
+            if isinstance(value, dict) and value.get("uuid") and value.get("kind"):
+                refs.append(value)
+            return
+        if path[0] == ARRAY_ITEM:
+            if isinstance(value, list):
+                for item in value:
+                    extract(item, path[1:])
+        elif isinstance(value, dict):
+            extract(value.get(path[0]), path[1:])
+
+    for path in paths:
+        extract(obj, path)
+    return refs
+
+
+def flatten_filter(filter_obj: Any, prefix: str = "") -> dict:
+    # Mirrors the dot notation the engine applies to filters: nested objects
+    # become dotted paths while arrays and operator objects are kept as a whole
+    result = {}
+    for key, value in filter_obj.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict) and len(value) > 0 and not any(k.startswith("$") for k in value):
+            result.update(flatten_filter(value, path))
+        else:
+            result[path] = value
+    return result
+
+
+def values_at(obj: Any, path: str) -> List[Any]:
+    values = [obj]
+    for segment in path.split("."):
+        next_values = []
+        for value in values:
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                if isinstance(item, dict) and segment in item:
+                    next_values.append(item[segment])
+        values = next_values
+    return values
+
+
+def _match_operator(candidates: List[Any], exists: bool, operator: str, arg: Any) -> bool:
+    if operator == "$eq":
+        return arg in candidates
+    if operator == "$ne":
+        return arg not in candidates
+    if operator == "$in":
+        return any(value in arg for value in candidates)
+    if operator == "$nin":
+        return not any(value in arg for value in candidates)
+    if operator == "$exists":
+        return exists == bool(arg)
+    comparisons = {
+        "$gt": lambda a, b: a > b,
+        "$gte": lambda a, b: a >= b,
+        "$lt": lambda a, b: a < b,
+        "$lte": lambda a, b: a <= b,
+    }
+    if operator in comparisons:
+        for value in candidates:
+            try:
+                if comparisons[operator](value, arg):
+                    return True
+            except TypeError:
+                pass
+        return False
+    raise Exception(f"Unsupported filter operator: {operator}")
+
+
+def matches_filter(obj: Any, filter_obj: Any) -> bool:
+    for path, condition in flatten_filter(filter_obj).items():
+        values = values_at(obj, path)
+        candidates = []
+        for value in values:
+            candidates.append(value)
+            if isinstance(value, list):
+                candidates.extend(value)
+        if isinstance(condition, dict) and len(condition) > 0 and all(k.startswith("$") for k in condition):
+            for operator, arg in condition.items():
+                if not _match_operator(candidates, len(values) > 0, operator, arg):
+                    return False
+        elif condition not in candidates:
+            return False
+    return True
+
+
+def entity_version(entity: Entity) -> Any:
+    # Changes either with a spec update (spec_version) or a status update (status_hash)
+    metadata = entity.metadata
+    if metadata.get("status_hash") is not None:
+        return metadata.spec_version, metadata.status_hash
+    return metadata.spec_version, json.dumps(entity.get("status"), sort_keys=True, default=str)
@@ -0,0 +1,331 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .core import Entity, EntityEvent, EntityEventType, IntentfulStatus, IntentWatcher
+from .utils import entity_version
+
+WATCH_INTERVAL_SECS = 5
+WATCH_LOOKBACK_MS = 1000
+WATCH_ERROR_BACKOFF_SECS = 1
+INTENT_POLL_INTERVAL_SECS = 0.5
+
+ACTIVE_WATCHER_STATUSES = [IntentfulStatus.Pending, IntentfulStatus.Active]
+TERMINAL_WATCHER_STATUSES = [
+    IntentfulStatus.Completed_Successfully,
+    IntentfulStatus.Completed_Partially,
+    IntentfulStatus.Failed,
+    IntentfulStatus.Outdated,
+]
+
+WATCH_BATCH_SIZE = 20
+CHANGES_SORT = "metadata.updated_at:asc"
+# Deleted entities are only kept searchable in the graveyard for a day
+DELETED_SINCE = "papiea_one_day_ago"
+
+IntentWatcherTransition = Tuple[IntentWatcher, Optional[IntentfulStatus], IntentfulStatus]
+
+
+def entity_event(event_type: EntityEventType, entity: Entity, old_spec_version: Optional[int] = None) -> EntityEvent:
+    return EntityEvent(
+        type=event_type,
+        entity=entity,
+        old_spec_version=old_spec_version,
+        new_spec_version=entity.metadata.spec_version if event_type != EntityEventType.Deleted else None
+    )
+
+
+class ChangeSource(ABC):
+    # Transport delivering the changes of the entities matching a filter to a
+    # KindWatcher. Polling is the default one, a push based source (e.g.
+    # server-sent events) may replace it
+    @abstractmethod
+    async def next_events(self) -> List[EntityEvent]:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+def changed_since(filter_obj: Any, since: Optional[int]) -> Any:
+    metadata = dict(filter_obj.get("metadata") or {})
+    if since is not None:
+        metadata["updated_at"] = {"$gte": since}
+    return dict(filter_obj, metadata=metadata)
+
+
+class PollingChangeSource(ChangeSource):
+    """Polls the engine for the entities of filter_obj changed since the previous poll.
+
+    Every interval the entities whose metadata.updated_at is past the cursor are
+    read sorted by updated_at, with the filter applied by the engine. Only the
+    versions of the matching entities are kept, so that entities changed to no
+    longer match are reported as Left and deleted ones as Deleted. Entities
+    starting to match are reported as Created. The cursor is taken from the
+    engine timestamps and moved back by lookback_ms, writes committed out of
+    order are therefore not missed and repeated versions are ignored
+    """
+
+    def __init__(
+            self,
+            client,
+            filter_obj: Any = None,
+            interval: float = WATCH_INTERVAL_SECS,
+            batch_size: int = WATCH_BATCH_SIZE,
+            lookback_ms: int = WATCH_LOOKBACK_MS
+    ):
+        self.client = client
+        self.filter_obj = filter_obj or {}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lookback_ms = lookback_ms
+        self._versions: Optional[Dict[str, Any]] = None
+        self._cursor: Optional[int] = None
+
+    async def _changed(self, filter_obj: Any, deleted: bool = False) -> List[Entity]:
+        body = dict(changed_since(filter_obj, self._since()), sort=CHANGES_SORT)
+        entities = []
+        offset = 0
+        while True:
+            res = await self.client.filter(dict(body, limit=self.batch_size, offset=offset), deleted=deleted)
+            entities.extend(res.results)
+            if len(res.results) < self.batch_size:
+                return entities
+            offset += self.batch_size
+
+    def _since(self) -> Optional[int]:
+        if self._cursor is None:
+            return None
+        return self._cursor - self.lookback_ms
+
+    def _advance(self, entities: List[Entity]) -> None:
+        for entity in entities:
+            updated_at = entity.metadata.get("updated_at")
+            if updated_at is not None and (self._cursor is None or updated_at > self._cursor):
+                self._cursor = updated_at
+
+    async def start(self, scan: Optional[Callable[[], Awaitable[List[Entity]]]] = None) -> List[Entity]:
+        # Reads the entities matching the filter, the changes are polled from then on.
+        # The cursor is the latest write of the kind at the time, whatever the filter.
+        # Without any updated_at (entities written by an older engine) every poll reads the whole filter
+        latest = await self.client.filter({"sort": "metadata.updated_at:desc", "limit": 1})
+        self._advance(latest.results)
+        entities = await (scan() if scan is not None else self.client.scan(self.filter_obj))
+        self._versions = {entity.metadata.uuid: entity_version(entity) for entity in entities}
+        return entities
+
+    async def next_events(self) -> List[EntityEvent]:
+        if self._versions is None:
+            await self.start()
+        await asyncio.sleep(self.interval)
+        return await self.poll()
+
+    async def poll(self) -> List[EntityEvent]:
+        events = []
+        matching = await self._changed(self.filter_obj)
+        matched = set()
+        for entity in matching:
+            uuid = entity.metadata.uuid
+            matched.add(uuid)
+            old_version = self._versions.get(uuid)
+            version = entity_version(entity)
+            if old_version is None:
+                events.append(entity_event(EntityEventType.Created, entity))
+            elif old_version != version:
+                events.append(entity_event(EntityEventType.Updated, entity, old_spec_version=old_version[0]))
+            self._versions[uuid] = version
+        changed = []
+        if len(self.filter_obj) > 0 and len(self._versions) > 0:
+            # Only the changed entities of the kind can have stopped matching
+            changed = await self._changed({})
+            for entity in changed:
+                uuid = entity.metadata.uuid
+                if uuid in self._versions and uuid not in matched:
+                    old_version = self._versions.pop(uuid)
+                    events.append(entity_event(EntityEventType.Left, entity, old_spec_version=old_version[0]))
+        deleted = []
+        if len(self._versions) > 0:
+            deleted = await self._changed({"metadata": {"deleted_at": DELETED_SINCE}}, deleted=True)
+            for entity in deleted:
+                old_version = self._versions.pop(entity.metadata.uuid, None)
+                if old_version is not None:
+                    events.append(entity_event(EntityEventType.Deleted, entity, old_spec_version=old_version[0]))
+        self._advance(matching)
+        self._advance(changed)
+        self._advance(deleted)
+        return events
+
+    async def close(self) -> None:
+        self._versions = None
+        self._cursor = None
+
+
+class KindWatcher(object):
+    # Fans the events of a change source out to every subscriber
+    def __init__(self, source: ChangeSource, logger: logging.Logger):
+        self.source = source
+        self.logger = logger
+        self._subscribers: Dict[object, asyncio.Queue] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def subscribe(self) -> AsyncGenerator[EntityEvent, None]:
+        key = object()
+        queue = asyncio.Queue()
+        self._subscribers[key] = queue
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            del self._subscribers[key]
+            if len(self._subscribers) == 0:
+                await self.stop()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.source.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                events = await self.source.next_events()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Failed to fetch entity changes, reason: {e}")
+                await asyncio.sleep(WATCH_ERROR_BACKOFF_SECS)
+                continue
+            for event in events:
+                for queue in self._subscribers.values():
+                    queue.put_nowait(event)
+
+
+async def changed_watchers(
+        iter_func: Callable[..., AsyncGenerator[IntentWatcher, None]],
+        known: Dict[str, IntentWatcher],
+        since: Optional[str],
+        batch_size: int
+) -> Tuple[List[IntentWatcherTransition], Optional[str]]:
+    # iter_func has to page watchers most recently changed first, so the scan stops at the
+    # first watcher whose status last changed before since, the newest change seen by the
+    # previous scan: the rest did not change since then. known holds the last seen watchers
+    # that may still change, the ones in a terminal status are dropped once older than the
+    # newest change. Returns the transitions in the order they happened and the new since
+    transitions = []
+    newest = since
+    async for watcher in iter_func(batch_size):
+        changed_at = watcher.get("last_status_changed")
+        if changed_at is None or (since is not None and changed_at < since):
+            break
+        if newest is None or changed_at > newest:
+            newest = changed_at
+        old = known.get(watcher.uuid)
+        old_status = old.status if old is not None else None
+        if old_status == watcher.status:
+            continue
+        known[watcher.uuid] = watcher
+        transitions.append((watcher, old_status, watcher.status))
+    if newest is not None:
+        for watcher_uuid, watcher in list(known.items()):
+            if watcher.status in TERMINAL_WATCHER_STATUSES and (watcher.get("last_status_changed") or "") < newest:
+                del known[watcher_uuid]
+    transitions.reverse()
+    return transitions, newest
+
+
+async def created_watchers(
+        iter_func: Callable[..., AsyncGenerator[IntentWatcher, None]],
+        known: Dict[str, IntentWatcher],
+        since: Optional[str],
+        batch_size: int
+) -> Tuple[List[IntentWatcherTransition], Optional[str]]:
+    # iter_func has to page watchers most recently created first. Watchers whose status never
+    # changed have no last_status_changed and sort after all the others, so changed_watchers
+    # never reaches them. They are reported here once created at or after since, the newest
+    # creation seen by the previous scan. Returns them in the order they were created and the new since
+    transitions = []
+    newest = since
+    async for watcher in iter_func(batch_size):
+        created_at = watcher.get("created_at")
+        if created_at is None or (since is not None and created_at < since):
+            break
+        if newest is None or created_at > newest:
+            newest = created_at
+        # Changed ones are left to changed_watchers
+        if watcher.get("last_status_changed") is not None or watcher.uuid in known:
+            continue
+        known[watcher.uuid] = watcher
+        transitions.append((watcher, None, watcher.status))
+    transitions.reverse()
+    return transitions, newest
+
+
+class IntentWatcherPoller(object):
+    # Resolves all the outstanding waits of a client with a single watcher query
+    # per interval, filtered by the uuids being waited for (in chunks of batch_size)
+    def __init__(self, client, interval: float = INTENT_POLL_INTERVAL_SECS, batch_size: int = WATCH_BATCH_SIZE):
+        self.client = client
+        self.interval = interval
+        self.batch_size = batch_size
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self, watcher_uuid: str, timeout: Optional[float] = None) -> IntentWatcher:
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.setdefault(watcher_uuid, []).append(future)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"Timeout waiting for intent watcher with uuid: {watcher_uuid} to complete")
+        finally:
+            waiters = self._waiters.get(watcher_uuid, [])
+            if future in waiters:
+                waiters.remove(future)
+            if len(waiters) == 0:
+                self._waiters.pop(watcher_uuid, None)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            while len(self._waiters) > 0:
+                try:
+                    uuids = list(self._waiters.keys())
+                    for i in range(0, len(uuids), self.batch_size):
+                        chunk = uuids[i:i + self.batch_size]
+                        watchers = await self.client.filter_intent_watcher(
+                            {"uuid": {"$in": chunk}}, limit=len(chunk)
+                        )
+                        self._resolve(watchers)
+                except Exception as e:
+                    self.client.logger.error(f"Failed to poll intent watchers, reason: {e}")
+                if len(self._waiters) > 0:
+                    await asyncio.sleep(self.interval)
+        finally:
+            self._task = None
+
+    def _resolve(self, watchers: List[IntentWatcher]) -> None:
+        for watcher in watchers:
+            if watcher.status not in TERMINAL_WATCHER_STATUSES:
+                continue
+            # Resolved waits remove themselves, nothing is kept once a watcher is finished
+            for future in self._waiters.get(watcher.uuid, []):
+                if not future.done():
+                    future.set_result(watcher)
@@ -27,5 +27,11 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires=">=3.7",
-    install_requires=["aiohttp>=3.6.2", "jaeger-client>=4.4.0"],
+    install_requires=["aiohttp>=3.6.2,<4", "jaeger-client>=4.4.0"],
+    entry_points={
+        "console_scripts": [
+            "papiea-bench=papiea.load_generator:main",
+            "papiea-replay=papiea.callback_capture:main",
+        ],
+    },
 )
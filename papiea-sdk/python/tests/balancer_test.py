@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from papiea.balancer import BalancingTransport
+from papiea.circuit_breaker import CLOSED, OPEN, WRITES, CircuitBreakers, CircuitBreakingTransport
+from papiea.client import EntityCRUD
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.transport import SessionTransport
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3346
+REPLICA_PORT = 3347
+PROVIDER_PORT = 9026
+
+
+class TestBalancer:
+    @pytest.mark.asyncio
+    async def test_balancing_ejects_and_probes_endpoints(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_balancing", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            replica_url = f"http://localhost:{REPLICA_PORT}"
+            balancer = BalancingTransport([replica_url, engine.url], eject_after=1, probe_interval=0.1)
+            async with EntityCRUD(
+                    balancer.base_url, "mock_balancing", PROVIDER_VERSION, "Object", engine.admin_key,
+                    transport=balancer
+            ) as client:
+                for i in range(10):
+                    await client.create({"spec": {"name": f"object_{i}"}})
+                replica, primary = balancer.stats()
+                assert not replica.healthy and replica.ejections == 1
+                assert primary.requests >= 10 and primary.failures == 0
+                # The replica comes up and is put back in rotation by the next probe
+                async with MockEngine(port=REPLICA_PORT):
+                    await asyncio.sleep(0.2)
+                    await client.filter({})
+                    await asyncio.sleep(0.1)
+                    assert balancer.stats()[0].healthy
+            await balancer.close()
+
+    @pytest.mark.asyncio
+    async def test_balancer_skips_endpoints_with_open_circuit(self):
+        replica_url = f"http://localhost:{REPLICA_PORT}"
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            shared_breakers = CircuitBreakers()
+            async with ProviderSdk.create_provider(
+                    [engine.url, replica_url], engine.admin_key, "localhost", PROVIDER_PORT,
+                    transport=CircuitBreakingTransport(SessionTransport(10), shared_breakers)
+            ) as sdk:
+                # The breakers below the balancer of the sdk are found for the healthcheck
+                assert sdk.server.circuit_breakers is shared_breakers
+                sdk.new_kind(SPEC_ONLY_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_balanced_breakers")
+                await sdk.register()
+                await sdk.server.close()
+            breakers = CircuitBreakers(failure_threshold=1, open_secs=10)
+            # Wrapping the balancer still keys the circuits per endpoint
+            transport = CircuitBreakingTransport(BalancingTransport([replica_url, engine.url], eject_after=100), breakers)
+            async with EntityCRUD(
+                    replica_url, "mock_balanced_breakers", PROVIDER_VERSION, "Object", engine.admin_key,
+                    transport=transport
+            ) as client:
+                for i in range(10):
+                    await client.create({"spec": {"name": f"object_{i}"}})
+                replica = breakers.get(replica_url, WRITES)
+                assert replica.state == OPEN and replica.stats().rejected == 0
+                assert breakers.get(engine.url, WRITES).state == CLOSED
+                assert breakers.get(engine.url, WRITES).stats().requests >= 10
+            await transport.close()
@@ -0,0 +1,50 @@
+import pytest
+from aiohttp import ClientSession
+
+from papiea.callback_capture import captured_body, load_capture, replay_callbacks
+from papiea.client import EntityCRUD
+from papiea.core import ProcedureDescription
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.transport import InMemoryTransport
+from tests.mock_provider import LOCATION_KIND, PROVIDER_VERSION
+
+MOCK_ENGINE_PORT = 3343
+PROVIDER_PORT = 9023
+
+
+class TestCallbackCapture:
+    @pytest.mark.asyncio
+    async def test_captured_callbacks_replay_in_process(self, tmp_path):
+        capture_path = str(tmp_path / "callbacks.ndjson")
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_capture")
+
+                async def double(ctx, entity, input):
+                    return {"x": entity.spec.x * input}
+
+                location.entity_procedure("double", ProcedureDescription(), double)
+                sdk.server.capture(capture_path)
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_capture", PROVIDER_VERSION, "Location", engine.admin_key
+                ) as client:
+                    entity = await client.create({"spec": {"x": 10, "y": 11}})
+                    res = await client.invoke_procedure("double", entity.metadata, 2)
+                    assert res.x == 20
+                async with ClientSession() as session:
+                    async with session.post(f"http://localhost:{PROVIDER_PORT}/unknown", data=b"\x1f\x8b") as resp:
+                        assert resp.status == 404
+                await sdk.server.close()
+                records = load_capture(capture_path)
+                assert [record.status for record in records] == [200, 404]
+                assert captured_body(records[1]) == b"\x1f\x8b"
+                report = await replay_callbacks(
+                    records, "http://provider", speed=0, transport=InMemoryTransport(sdk.server.app)
+                )
+                assert report.requests == 2 and report.errors == 0 and report.status_mismatches == 0
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from papiea.circuit_breaker import CLOSED, OPEN, READS, CircuitBreakers, CircuitBreakingTransport
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk_exceptions import ApiException, CircuitOpenException
+from papiea.transport import SessionTransport
+from tests.mock_provider import PROVIDER_VERSION
+
+MOCK_ENGINE_PORT = 3348
+
+
+class TestCircuitBreaker:
+    @pytest.mark.asyncio
+    async def test_circuit_breaker_fails_fast(self):
+        engine_url = f"http://localhost:{MOCK_ENGINE_PORT}"
+        breakers = CircuitBreakers(failure_threshold=2, open_secs=0.2)
+        transport = CircuitBreakingTransport(SessionTransport(10), breakers)
+        async with EntityCRUD(
+                engine_url, "mock_breaker", PROVIDER_VERSION, "Object", transport=transport
+        ) as client:
+            # The failed request and its retry open the circuit
+            with pytest.raises(Exception):
+                await client.get(AttributeDict(uuid="missing"))
+            circuit = breakers.get(engine_url, READS)
+            assert circuit.state == OPEN
+            with pytest.raises(CircuitOpenException):
+                await client.get(AttributeDict(uuid="missing"))
+            assert circuit.stats().rejected == 1
+            async with MockEngine(port=MOCK_ENGINE_PORT):
+                await asyncio.sleep(0.2)
+                with pytest.raises(ApiException):
+                    await client.get(AttributeDict(uuid="missing"))
+                assert circuit.state == CLOSED
+        await transport.close()
@@ -0,0 +1,74 @@
+import pytest
+from aiohttp import ClientSession
+
+from papiea.client import EntityCRUD
+from papiea.compression import CompressingTransport
+from papiea.core import ProcedureDescription
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.transport import SessionTransport, Transport
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND
+
+MOCK_ENGINE_PORT = 3345
+PROVIDER_PORT = 9025
+
+
+class TestCompression:
+    @pytest.mark.asyncio
+    async def test_compression(self):
+        class WireRecordingTransport(Transport):
+            # Records the content encoding and size of the request bodies as sent
+            def __init__(self, transport):
+                self.transport = transport
+                self.sent = []
+
+            def request(self, method, url, data, headers, ssl_context):
+                if data is not None:
+                    self.sent.append((headers.get("Content-Encoding"), len(data)))
+                return self.transport.request(method, url, data, headers, ssl_context)
+
+            async def close(self):
+                await self.transport.close()
+
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                kind = sdk.new_kind(SPEC_ONLY_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_compression")
+
+                async def echo(ctx, input):
+                    return {"name": input}
+
+                kind.kind_procedure("echo", ProcedureDescription(), echo)
+                sdk.server.compress_responses(100)
+                await sdk.register()
+                wire = WireRecordingTransport(SessionTransport(10))
+                transport = CompressingTransport(wire, "gzip", 100)
+                async with EntityCRUD(
+                        engine.url, "mock_compression", PROVIDER_VERSION, "Object", engine.admin_key,
+                        transport=transport
+                ) as client:
+                    name = "compressible" * 1000
+                    created = await client.create({"spec": {"name": name}})
+                    encoding, size = wire.sent[-1]
+                    assert encoding == "gzip" and size < len(name) / 10
+                    assert (await client.get(created.metadata)).spec.name == name
+                    assert (await client.invoke_kind_procedure("echo", name)).name == name
+                    assert wire.sent[-1][0] == "gzip"
+                    # Small bodies are sent as is
+                    await client.invoke_kind_procedure("echo", "short")
+                    assert wire.sent[-1][0] is None
+                with pytest.raises(Exception):
+                    CompressingTransport(wire, "br")
+                # The provider compresses its responses for a client accepting gzip
+                callback = engine.providers[("mock_compression", PROVIDER_VERSION)]["kinds"][0]["kind_procedures"]["echo"]
+                async with ClientSession(auto_decompress=False) as session:
+                    async with session.post(
+                            callback["procedure_callback"], json={"input": name}, headers={"Accept-Encoding": "gzip"}
+                    ) as resp:
+                        body = await resp.read()
+                        assert resp.headers["Content-Encoding"] == "gzip" and len(body) < len(name) / 10
+                await transport.close()
+                await sdk.server.close()
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.core import ProcedureDescription
+from papiea.deadline import deadline, remaining
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.python_sdk_exceptions import DeadlineExceededException
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND
+
+MOCK_ENGINE_PORT = 3349
+PROVIDER_PORT = 9028
+
+
+class TestDeadline:
+    @pytest.mark.asyncio
+    async def test_deadline_propagates_to_handlers(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                kind = sdk.new_kind(SPEC_ONLY_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_deadline")
+
+                async def budget(ctx, input):
+                    return {"remaining": remaining()}
+
+                async def slow(ctx, input):
+                    await asyncio.sleep(2)
+                    return {}
+
+                kind.kind_procedure("budget", ProcedureDescription(), budget)
+                kind.kind_procedure("slow", ProcedureDescription(), slow)
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_deadline", PROVIDER_VERSION, "Object", engine.admin_key
+                ) as client:
+                    res = await client.invoke_kind_procedure("budget", {})
+                    assert 0 < res.remaining <= 60
+                    with deadline(5):
+                        res = await client.invoke_kind_procedure("budget", {})
+                    assert 0 < res.remaining <= 5
+                    loop = asyncio.get_event_loop()
+                    started_at = loop.time()
+                    with pytest.raises(DeadlineExceededException):
+                        with deadline(0.3):
+                            await client.invoke_kind_procedure("slow", {})
+                    assert loop.time() - started_at < 1
+                await sdk.server.close()
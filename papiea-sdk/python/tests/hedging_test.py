@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+from multidict import CIMultiDict
+
+from papiea.balancer import LEAST_OUTSTANDING, BalancingTransport
+from papiea.client import EntityCRUD
+from papiea.hedging import HedgingTransport
+from papiea.mock_engine import MockEngine
+from papiea.transport import AwaitedResponse, SessionTransport, Transport, TransportResponse
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3352
+PROVIDER_PORT = 9031
+
+
+class FirstRequestSlowTransport(Transport):
+    # Records the requests sent, the first one answers after delay_secs and the others right away
+    def __init__(self, delay_secs):
+        self.delay_secs = delay_secs
+        self.sent = []
+
+    async def _request(self, method, url, delay_secs):
+        await asyncio.sleep(delay_secs)
+        return TransportResponse(200, {}, b"{}")
+
+    def request(self, method, url, data, headers, ssl_context):
+        self.sent.append((method, url))
+        delay_secs = self.delay_secs if len(self.sent) == 1 else 0
+        return AwaitedResponse(self._request(method, url, delay_secs))
+
+
+class TestHedging:
+    @pytest.mark.asyncio
+    async def test_hedged_reads_avoid_slow_replica(self):
+        class SlowReplicaTransport(Transport):
+            def __init__(self, transport, slow_url, delay_secs):
+                self.transport = transport
+                self.slow_url = slow_url
+                self.delay_secs = delay_secs
+
+            async def _request(self, method, url, data, headers, ssl_context):
+                await asyncio.sleep(self.delay_secs)
+                async with self.transport.request(method, url, data, headers, ssl_context) as resp:
+                    return TransportResponse(resp.status, resp.headers, await resp.read())
+
+            def request(self, method, url, data, headers, ssl_context):
+                if url.startswith(self.slow_url):
+                    return AwaitedResponse(self._request(method, url, data, headers, ssl_context))
+                return self.transport.request(method, url, data, headers, ssl_context)
+
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_hedging", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            # The same engine under two urls, one of them behind a slow network
+            slow_url = engine.url
+            fast_url = f"http://127.0.0.1:{MOCK_ENGINE_PORT}"
+            balancer = BalancingTransport(
+                [slow_url, fast_url], LEAST_OUTSTANDING, SlowReplicaTransport(SessionTransport(10), slow_url, 1)
+            )
+            transport = HedgingTransport(
+                balancer, initial_delay_secs=0.1, min_delay_secs=0.1, budget_ratio=0, max_tokens=3
+            )
+            async with EntityCRUD(
+                    transport.base_url, "mock_hedging", PROVIDER_VERSION, "Object", engine.admin_key,
+                    transport=transport
+            ) as client:
+                entity = await client.create({"spec": {"name": "object"}})
+                for i in range(100):
+                    started_at = time.perf_counter()
+                    assert (await client.get(entity.metadata)).spec.name == "object"
+                    if transport.stats().over_budget > 0:
+                        break
+                    assert time.perf_counter() - started_at < 0.5
+                stats = transport.stats()
+                assert stats.hedged == 3 and stats.hedge_wins == 3 and stats.over_budget == 1
+                assert all(endpoint.outstanding == 0 for endpoint in balancer.stats())
+            await transport.close()
+
+    @pytest.mark.asyncio
+    async def test_hedge_sends_nothing_else_to_the_avoided_endpoint(self):
+        stub = FirstRequestSlowTransport(0.3)
+        balancer = BalancingTransport(["http://a", "http://b"], LEAST_OUTSTANDING, stub)
+        transport = HedgingTransport(balancer, initial_delay_secs=0.05)
+        async with transport.request("get", "http://a/services/kind/uuid", None, CIMultiDict(), None) as resp:
+            assert resp.status == 200
+        await asyncio.sleep(0.05)
+        # The original and its hedge, on one endpoint each, and no probe of the healthy endpoint avoided
+        assert sorted(stub.sent) == [("get", "http://a/services/kind/uuid"), ("get", "http://b/services/kind/uuid")]
+        assert transport.stats().hedge_wins == 1
+        assert all(endpoint.healthy and endpoint.failures == 0 for endpoint in balancer.stats())
+        # The read is timed from the start of the cancelled original, not from the start of its hedge
+        assert transport._latencies[-1] >= 0.05
+        await transport.close()
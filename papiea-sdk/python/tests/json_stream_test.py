@@ -0,0 +1,113 @@
+import json
+import logging
+
+import pytest
+
+from papiea.api import ApiInstance
+from papiea.json_stream import JsonArrayStream, iter_json_array
+from papiea.transport import AwaitedResponse, BufferedContent, Transport, TransportResponse
+
+TRICKY_ITEMS = [
+    {"name": "a]b", "tags": ["[", "]", "{}"]},
+    {"name": "quote \" inside", "path": "C:\\dir\\", "nested": {"results": [1, [2, 3]]}},
+    "plain string with , and :",
+    [],
+    {},
+    12.5,
+    None,
+]
+
+
+def document(items, **fields) -> bytes:
+    return json.dumps(dict(fields, results=items, entity_count=len(items))).encode("utf-8")
+
+
+def feed_in_chunks(data: bytes, size: int) -> list:
+    parser = JsonArrayStream()
+    items = []
+    for i in range(0, len(data), size):
+        items.extend(parser.feed(data[i:i + size]))
+    assert parser.done
+    return items
+
+
+async def chunks_of(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class ChunkedContent(BufferedContent):
+    # Ignores the requested chunk size so that small chunks reach the parser
+    def __init__(self, body: bytes, size: int):
+        super().__init__(body)
+        self.size = size
+
+    async def iter_chunked(self, n: int):
+        async for chunk in super().iter_chunked(self.size):
+            yield chunk
+
+
+class ChunkedTransport(Transport):
+    def __init__(self, body: bytes, size: int):
+        self.body = body
+        self.size = size
+
+    def request(self, method, url, data, headers, ssl_context):
+        async def respond():
+            resp = TransportResponse(200, {"Content-Type": "application/json"}, self.body)
+            resp.content = ChunkedContent(self.body, self.size)
+            return resp
+
+        return AwaitedResponse(respond())
+
+
+async def stream_items(body: bytes, size: int) -> list:
+    api = ApiInstance("http://engine", logger=logging.getLogger(), transport=ChunkedTransport(body, size))
+    return [item async for item in api.stream("post", "filter", {})]
+
+
+class TestJsonArrayStream:
+    def test_items_split_across_chunks(self):
+        data = document(TRICKY_ITEMS)
+        # Every chunk size, so each item, string and escape is split at every position
+        for size in range(1, len(data) + 1):
+            assert feed_in_chunks(data, size) == TRICKY_ITEMS
+
+    def test_only_the_top_level_key_is_streamed(self):
+        data = document([{"id": 1}], other=[{"results": ["not", "these"]}], note='"results": [0]')
+        assert feed_in_chunks(data, 7) == [{"id": 1}]
+
+    def test_empty_array(self):
+        assert feed_in_chunks(document([]), 1) == []
+        assert feed_in_chunks(b'{"results":[ ],"entity_count":0}', 3) == []
+
+    def test_input_after_the_array_is_ignored(self):
+        parser = JsonArrayStream()
+        assert parser.feed(b'{"results": [1, 2], "entity_count": 2}') == [1, 2]
+        assert parser.done and parser.feed(b"trailing garbage") == []
+
+    def test_malformed_input(self):
+        with pytest.raises(Exception, match="Malformed json array"):
+            JsonArrayStream().feed(b'{"results": [1, 2}')
+        with pytest.raises(ValueError):
+            JsonArrayStream().feed(b'{"results": [{"id": 1,}]}')
+
+    @pytest.mark.asyncio
+    async def test_iter_json_array(self):
+        items = [item async for item in iter_json_array(chunks_of(document(TRICKY_ITEMS), 5))]
+        assert items == TRICKY_ITEMS
+        truncated = document(TRICKY_ITEMS)[:40]
+        with pytest.raises(Exception, match="Response ended"):
+            async for _ in iter_json_array(chunks_of(truncated, 5)):
+                pass
+
+    @pytest.mark.asyncio
+    async def test_api_instance_stream(self):
+        data = document(TRICKY_ITEMS)
+        for size in [1, 2, 3, 7, len(data)]:
+            assert await stream_items(data, size) == TRICKY_ITEMS
+        assert await stream_items(document([]), 1) == []
+        with pytest.raises(Exception, match="Malformed json array"):
+            await stream_items(b'{"results": [1, 2}', 4)
+        with pytest.raises(Exception, match="Response ended"):
+            await stream_items(data[:40], 4)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.limiter import LimitingTransport
+from papiea.mock_engine import MockEngine
+from papiea.priority import BULK, CRITICAL, DEFAULT, priority
+from papiea.python_sdk_exceptions import ConcurrencyLimitException
+from papiea.transport import SessionTransport
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3350
+PROVIDER_PORT = 9029
+
+
+class TestLimiter:
+    @pytest.mark.asyncio
+    async def test_concurrency_limiter_queues_and_rejects(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_limiter", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            transport = LimitingTransport(SessionTransport(10), initial_limit=2, max_limit=2)
+            async with EntityCRUD(
+                    engine.url, "mock_limiter", PROVIDER_VERSION, "Object", engine.admin_key, transport=transport
+            ) as client:
+                await asyncio.gather(*[client.create({"spec": {"name": f"object_{i}"}}) for i in range(30)])
+                limiter = transport.limiter(engine.url)
+                assert limiter.stats().in_flight == 0 and limiter.stats().limit <= 2
+                limiter.max_queue = 1
+                results = await asyncio.gather(
+                    *[client.create({"spec": {"name": "overflow"}}) for i in range(10)], return_exceptions=True
+                )
+                rejected = [res for res in results if isinstance(res, ConcurrencyLimitException)]
+                assert len(rejected) > 0 and limiter.stats().rejected == len(rejected)
+            await transport.close()
+
+    @pytest.mark.asyncio
+    async def test_priority_classes_share_a_saturated_pool(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_priority", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            transport = LimitingTransport(SessionTransport(10), initial_limit=1, min_limit=1, max_limit=1)
+            async with EntityCRUD(
+                    engine.url, "mock_priority", PROVIDER_VERSION, "Object", engine.admin_key, transport=transport
+            ) as client:
+                entity = await client.create({"spec": {"name": "object"}})
+                with priority(BULK):
+                    bulk = [asyncio.ensure_future(client.get_all()) for i in range(20)]
+                reads = [asyncio.ensure_future(client.get(entity.metadata)) for i in range(5)]
+                await asyncio.gather(*bulk, *reads)
+                wait = transport.limiter(engine.url).stats().wait
+                assert wait[BULK].requests == 20 and wait[DEFAULT].requests == 6
+                assert wait[DEFAULT].max_wait_ms < wait[BULK].max_wait_ms
+                assert wait[CRITICAL].requests == 0
+            await transport.close()
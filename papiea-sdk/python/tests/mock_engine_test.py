@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.core import IntentfulStatus, ProcedureDescription
+from papiea.mock_engine import MockEngine, status_hash
+from papiea.python_sdk import ProviderSdk
+from tests.mock_provider import LOCATION_KIND, PROVIDER_VERSION, SPEC_ONLY_KIND
+
+MOCK_ENGINE_PORT = 3333
+PROVIDER_PORT = 9006
+
+
+class TestMockEngine:
+    @pytest.mark.asyncio
+    async def test_spec_only_crud_and_filter(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                sdk.new_kind(SPEC_ONLY_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_spec_only")
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_spec_only", PROVIDER_VERSION, "Object", engine.admin_key
+                ) as client:
+                    for i in range(35):
+                        await client.create({"spec": {"name": f"object_{i}"}})
+                    res = await client.filter({"spec": {"name": "object_7"}})
+                    assert res.entity_count == 1
+                    entity = res.results[0]
+                    assert entity.status == entity.spec
+                    await client.update(entity.metadata, {"name": "renamed"})
+                    entity = await client.get(entity.metadata)
+                    assert entity.metadata.spec_version == 2
+                    assert entity.status.name == "renamed"
+                    assert len(await client.scan({}, batch_size=10)) == 35
+                    streamed = [entity async for entity in client.filter_stream({"spec": {"name": "renamed"}})]
+                    assert [entity.metadata.uuid for entity in streamed] == [entity.metadata.uuid]
+                    assert len([entity async for entity in client.get_all_stream()]) == len(await client.get_all())
+                    await client.delete(entity.metadata)
+                    res = await client.filter({"metadata": {"uuid": entity.metadata.uuid}}, deleted=True)
+                    assert res.entity_count == 1
+                await sdk.server.close()
+
+    @pytest.mark.asyncio
+    async def test_intentful_handler_completes_watcher(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_differ")
+
+                async def move_x(ctx, entity, input):
+                    await ctx.update_status(entity.metadata, {"x": entity.spec.x})
+                    return {"delay_secs": 1}
+
+                async def double(ctx, entity, input):
+                    return {"x": entity.spec.x * input}
+
+                location.on("x", move_x)
+                location.entity_procedure("double", ProcedureDescription(), double)
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_differ", PROVIDER_VERSION, "Location", engine.admin_key
+                ) as client:
+                    created = await client.create({"spec": {"x": 10, "y": 11}})
+                    assert created.intent_watcher is None
+                    watcher, entity = await client.update_and_wait(created.metadata, {"x": 20, "y": 11}, 10)
+                    assert watcher.status == IntentfulStatus.Completed_Successfully
+                    assert entity.status.x == 20
+                    res = await client.invoke_procedure("double", entity.metadata, 2)
+                    assert res.x == 40
+                assert engine.callback_count == 1
+                await sdk.server.close()
+
+    @pytest.mark.asyncio
+    async def test_engine_close_cancels_intent_handlers(self):
+        engine = MockEngine(port=MOCK_ENGINE_PORT)
+        await engine.start()
+        async with ProviderSdk.create_provider(
+                engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+        ) as sdk:
+            location = sdk.new_kind(LOCATION_KIND)
+            sdk.version(PROVIDER_VERSION)
+            sdk.prefix("mock_close")
+            called, release = asyncio.Event(), asyncio.Event()
+
+            async def move_x(ctx, entity, input):
+                called.set()
+                await release.wait()
+
+            location.on("x", move_x)
+            await sdk.register()
+            async with EntityCRUD(
+                    engine.url, "mock_close", PROVIDER_VERSION, "Location", engine.admin_key
+            ) as client:
+                created = await client.create({"spec": {"x": 10, "y": 11}})
+                await client.update(created.metadata, {"x": 20, "y": 11})
+                await asyncio.wait_for(called.wait(), 5)
+                handlers = list(engine._handlers)
+                assert len(handlers) == 1
+                await engine.close()
+                assert handlers[0].cancelled() and len(engine._handlers) == 0
+                release.set()
+            await sdk.server.close()
+        assert status_hash({"x": 1, "y": 2}) == status_hash({"y": 2, "x": 1})
@@ -0,0 +1,42 @@
+from typing import Any, List
+
+from papiea.core import Kind
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+
+PROVIDER_VERSION = "0.1.0"
+
+LOCATION_KIND = {
+    "Location": {
+        "type": "object",
+        "x-papiea-entity": "differ",
+        "required": ["x", "y"],
+        "properties": {
+            "x": {"type": "number"},
+            "y": {"type": "number"},
+        },
+    }
+}
+
+SPEC_ONLY_KIND = {
+    "Object": {
+        "type": "object",
+        "x-papiea-entity": "spec-only",
+        "properties": {
+            "name": {"type": "string"},
+        },
+    }
+}
+
+
+async def register_kinds(engine: MockEngine, prefix: str, kinds: List[Any], provider_port: int, **kwargs) -> List[Kind]:
+    # Registers a provider without handlers, for tests that only need its kinds on the engine
+    async with ProviderSdk.create_provider(
+            engine.url, engine.admin_key, "localhost", provider_port, **kwargs
+    ) as sdk:
+        registered = [sdk.new_kind(kind).kind for kind in kinds]
+        sdk.version(PROVIDER_VERSION)
+        sdk.prefix(prefix)
+        await sdk.register()
+        await sdk.server.close()
+    return registered
@@ -0,0 +1,90 @@
+import pytest
+from opentracing.mocktracer import MockTracer
+
+from papiea.client import EntityCRUD, ProviderClient
+from papiea.mock_engine import MockEngine
+from papiea.transport import SessionTransport, Transport
+from papiea.utils import ARRAY_ITEM, extract_references, reference_paths
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3340
+PROVIDER_PORT = 9020
+
+
+def reference(kind):
+    return {"type": "object", "properties": {"uuid": {"type": "string"}, "kind": {"type": "string", "default": kind}}}
+
+
+GRAPH_KINDS = [
+    {"Vm": {
+        "type": "object",
+        "x-papiea-entity": "spec-only",
+        "properties": {"host": reference("Host"), "disks": {"type": "array", "items": reference("Disk")}},
+    }},
+    {"Host": {"type": "object", "x-papiea-entity": "spec-only", "properties": {"backup": reference("Disk")}}},
+    {"Disk": {"type": "object", "x-papiea-entity": "spec-only", "properties": {"attached_to": reference("Vm")}}},
+]
+
+
+class HeaderRecordingTransport(Transport):
+    # Records the urls and headers of the requests as sent to the engine
+    def __init__(self, transport):
+        self.transport = transport
+        self.sent = []
+
+    def request(self, method, url, data, headers, ssl_context):
+        self.sent.append((url, dict(headers)))
+        return self.transport.request(method, url, data, headers, ssl_context)
+
+
+class TestReferenceGraph:
+    @pytest.mark.asyncio
+    async def test_fetch_reference_graph(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            kinds = await register_kinds(engine, "mock_graph", GRAPH_KINDS, PROVIDER_PORT)
+            vm_paths = reference_paths(kinds[0].kind_structure)
+            assert vm_paths == [["host"], ["disks", ARRAY_ITEM]]
+            assert reference_paths(SPEC_ONLY_KIND) == []
+            tracer = MockTracer()
+            tracer.close = lambda: None
+            transport = SessionTransport(10)
+            clients = {
+                kind.name: EntityCRUD(
+                    engine.url, "mock_graph", PROVIDER_VERSION, kind.name, engine.admin_key, transport=transport
+                )
+                for kind in kinds
+            }
+
+            def ref(entity):
+                return {"uuid": entity.metadata.uuid, "kind": entity.metadata.kind}
+
+            vm = await clients["Vm"].create({"spec": {"disks": []}})
+            backup = await clients["Disk"].create({"spec": {}})
+            disks = [await clients["Disk"].create({"spec": {"attached_to": ref(vm)}}) for i in range(2)]
+            host = await clients["Host"].create({"spec": {"backup": ref(backup)}})
+            await clients["Vm"].update(vm.metadata, {"host": ref(host), "disks": [ref(disk) for disk in disks]})
+            vm = await clients["Vm"].get(vm.metadata)
+            assert extract_references(vm.spec, vm_paths) == [ref(host)] + [ref(disk) for disk in disks]
+            assert extract_references({"host": None, "disks": [{"uuid": "no kind"}]}, vm_paths) == []
+
+            graph = await clients["Vm"].fetch_reference_graph(vm, kinds)
+            assert set(graph) == {vm.metadata.uuid, host.metadata.uuid} | {disk.metadata.uuid for disk in disks}
+            wire = HeaderRecordingTransport(transport)
+            async with ProviderClient(
+                    engine.url, "mock_graph", PROVIDER_VERSION, engine.admin_key, tracer=tracer, transport=wire
+            ) as provider_client:
+                # The disks refer back to the vm, which is not fetched again
+                graph = await provider_client.fetch_reference_graph(vm, kinds, max_depth=3, batch_size=1)
+                assert len(graph) == 5 and graph[backup.metadata.uuid].metadata.kind == "Disk"
+            graph_span = tracer.finished_spans()[-1]
+            assert graph_span.operation_name == "fetch_reference_graph_client"
+            fetch_spans = tracer.finished_spans()[:-1]
+            assert len(fetch_spans) == 4 and len(wire.sent) == 4
+            assert all(span.operation_name == "filter_entities_client" for span in fetch_spans)
+            assert all(span.parent_id == graph_span.context.span_id for span in fetch_spans)
+            # Each per-kind fetch reaches the engine within the trace of the graph span
+            trace_id = format(graph_span.context.trace_id, "x")
+            assert all(headers["ot-tracer-traceid"] == trace_id for _, headers in wire.sent)
+            assert {headers["ot-tracer-spanid"] for _, headers in wire.sent} == \
+                {format(span.context.span_id, "x") for span in fetch_spans}
+            await transport.close()
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.mock_engine import MockEngine
+from papiea.replica import KindReplica
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3342
+PROVIDER_PORT = 9022
+
+
+class TestKindReplica:
+    @pytest.mark.asyncio
+    async def test_replica_applies_incremental_changes(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_replica", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            async with EntityCRUD(engine.url, "mock_replica", PROVIDER_VERSION, "Object", engine.admin_key) as client:
+                created = [await client.create({"spec": {"name": f"object_{i % 5}"}}) for i in range(25)]
+                async with KindReplica(client, indexes=["spec.name"], refresh_interval=0.05, batch_size=10) as replica:
+                    assert len(replica) == 25 and replica.staleness < 1
+                    assert replica.query({"spec": {"name": "object_3"}}).entity_count == 5
+                    async def rescan(*args, **kwargs):
+                        raise AssertionError("The replica rescanned the kind")
+
+                    # Refreshes only read the changes
+                    client.scan = rescan
+                    await client.update(created[3].metadata, {"name": "renamed"})
+                    await client.delete(created[8].metadata)
+                    added = await client.create({"spec": {"name": "object_3"}})
+                    await asyncio.sleep(0.2)
+                    assert len(replica) == 25 and replica.get(created[8].metadata.uuid) is None
+                    assert replica.get(added.metadata.uuid).spec.name == "object_3"
+                    res = replica.query({"spec": {"name": {"$in": ["object_3", "renamed"]}}})
+                    assert res.entity_count == 5
+                    assert replica.query({"spec": {"name": "renamed"}}).results[0].metadata.spec_version == 2
@@ -0,0 +1,68 @@
+import pytest
+from aiohttp import TraceConfig
+from opentracing.mocktracer import MockTracer
+
+from papiea.client import EntityCRUD
+from papiea.mock_engine import MockEngine
+from papiea.request_timing import PHASES, RequestTimer, request_span
+from papiea.transport import SessionTransport
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3353
+PROVIDER_PORT = 9032
+
+
+class TestRequestTiming:
+    @pytest.mark.asyncio
+    async def test_request_timings_reach_spans_and_histograms(self, caplog):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_timing", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            timer = RequestTimer(slow_request_secs=0)
+            transport = SessionTransport(connect_timeout=10, trace_configs=[timer.trace_config()])
+            tracer = MockTracer()
+            # The clients close their tracer, which only the jaeger one supports
+            tracer.close = lambda: None
+            async with EntityCRUD(
+                    engine.url, "mock_timing", PROVIDER_VERSION, "Object", engine.admin_key, tracer=tracer,
+                    transport=transport
+            ) as client:
+                entity = await client.create({"spec": {"name": "object"}})
+                await client.get(entity.metadata)
+                # Requests after the client calls no longer tag their finished spans
+                assert request_span() is None
+            create_span, get_span = tracer.finished_spans()
+            assert not create_span.tags["http.connection_reused"] and get_span.tags["http.connection_reused"]
+            assert all(create_span.tags[f"http.timing.{phase}_ms"] >= 0 for phase in PHASES)
+            assert get_span.tags["http.timing.connect_ms"] == 0
+            assert timer.requests == 2 and timer.slow_requests == 2
+            assert sum(timer.histogram("total").values()) == 2
+            assert "Slow request POST" in caplog.text
+            await transport.close()
+
+    @pytest.mark.asyncio
+    async def test_request_timings_without_headers_sent_signal(self, monkeypatch):
+        # aiohttp before 3.8 has no on_request_headers_sent
+        monkeypatch.delattr(TraceConfig, "on_request_headers_sent")
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_timing_fallback", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            timer = RequestTimer()
+            recorded = []
+            record = timer.record
+
+            def recording(timings):
+                recorded.append(timings)
+                record(timings)
+
+            timer.record = recording
+            transport = SessionTransport(connect_timeout=10, trace_configs=[timer.trace_config()])
+            async with EntityCRUD(
+                    engine.url, "mock_timing_fallback", PROVIDER_VERSION, "Object", engine.admin_key,
+                    transport=transport
+            ) as client:
+                entity = await client.create({"spec": {"name": "object"}})
+                await client.get(entity.metadata)
+            # The post is timed from its body being sent, the get from its connection being ready
+            assert [timings.method for timings in recorded] == ["POST", "GET"]
+            assert all(timings.server_ms > 0 for timings in recorded)
+            assert recorded[1].send_ms == 0
+            await transport.close()
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.deadline import deadline
+from papiea.mock_engine import MockEngine
+from papiea.priority import BULK, priority
+from papiea.singleflight import SingleflightTransport
+from papiea.transport import SessionTransport
+from tests.mock_provider import PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3351
+PROVIDER_PORT = 9030
+
+
+class TestSingleflight:
+    @pytest.mark.asyncio
+    async def test_singleflight_merges_identical_reads(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_singleflight", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            transport = SingleflightTransport(SessionTransport(10))
+            async with EntityCRUD(
+                    engine.url, "mock_singleflight", PROVIDER_VERSION, "Object", engine.admin_key, transport=transport
+            ) as client:
+                created = await asyncio.gather(*[client.create({"spec": {"name": "object"}}) for i in range(3)])
+                assert len({entity.metadata.uuid for entity in created}) == 3 and transport.suppressed == 0
+                entities = await asyncio.gather(*[client.get(created[0].metadata) for i in range(10)])
+                assert transport.suppressed == 9
+                assert all(entity == entities[0] for entity in entities)
+                results = await asyncio.gather(*[client.filter({"spec": {"name": "object"}}) for i in range(5)])
+                assert transport.suppressed == 13 and all(res.entity_count == 3 for res in results)
+                await client.get(created[0].metadata)
+                assert transport.suppressed == 13 and transport.requests == 16
+                uuid = created[0].metadata.uuid
+                api = client.api_instance
+                # Different priorities, encodings or a deadline are not merged
+                with priority(BULK):
+                    bulk_get = asyncio.ensure_future(api.get(uuid))
+                    await asyncio.sleep(0)
+                await asyncio.gather(bulk_get, api.get(uuid), api.get(uuid, {"Accept-Encoding": "identity"}))
+                assert transport.suppressed == 13
+                with deadline(5):
+                    await asyncio.gather(api.get(uuid), api.get(uuid))
+                assert transport.suppressed == 13 and transport.requests == 19
+            await transport.close()
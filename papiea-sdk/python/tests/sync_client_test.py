@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.sync_client import BackgroundLoop, SyncEntityCRUD, SyncProviderClient, background_loop
+
+MOCK_ENGINE_PORT = 3336
+PROVIDER_PORT = 9012
+PROVIDER_VERSION = "0.1.0"
+PROVIDER_PREFIX = "mock_sync"
+
+SPEC_ONLY_KIND = {
+    "Object": {
+        "type": "object",
+        "x-papiea-entity": "spec-only",
+        "properties": {
+            "name": {"type": "string"},
+        },
+    }
+}
+
+
+class TestSyncClient:
+    def test_sync_clients_share_loop(self):
+        # The engine runs on a loop of its own so it is not blocked by the sync calls
+        engine_loop = BackgroundLoop("mock-engine-loop")
+        engine = MockEngine(port=MOCK_ENGINE_PORT)
+
+        async def start():
+            await engine.start()
+            async with ProviderSdk.create_provider(engine.url, engine.admin_key, "localhost", PROVIDER_PORT) as sdk:
+                sdk.new_kind(SPEC_ONLY_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix(PROVIDER_PREFIX)
+                await sdk.register()
+                await sdk.server.close()
+
+        engine_loop.run(start())
+        try:
+            with SyncEntityCRUD(engine.url, PROVIDER_PREFIX, PROVIDER_VERSION, "Object", engine.admin_key) as client:
+                with ThreadPoolExecutor(8) as executor:
+                    created = list(executor.map(
+                        lambda i: client.create({"spec": {"name": f"object_{i}"}}), range(45)
+                    ))
+                assert len(created) == 45
+                assert client.get(created[0].metadata).spec == created[0].spec
+                names = {entity.spec.name for entity in client.filter_iter({}, batch_size=10)}
+                assert len(names) == 45
+                iterator = client.list_iter(batch_size=10)
+                assert next(iterator) is not None
+                iterator.close()
+            with SyncProviderClient(engine.url, PROVIDER_PREFIX, PROVIDER_VERSION, engine.admin_key) as provider:
+                with provider.get_kind("Object") as kind_client:
+                    assert kind_client.filter({"spec": {"name": "object_3"}}).entity_count == 1
+            assert client.client.transport is background_loop().transport
+        finally:
+            engine_loop.run(engine.close())
+            engine_loop.stop()
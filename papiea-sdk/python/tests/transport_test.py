@@ -0,0 +1,157 @@
+import logging
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict
+
+from papiea.api import ApiInstance
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict, IntentfulStatus
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.python_sdk_exceptions import ApiException
+from papiea.transport import (
+    AwaitedResponse,
+    InMemoryTransport,
+    RecordingTransport,
+    ReplayTransport,
+    SessionTransport,
+    Transport,
+    TransportResponse,
+    engine_root,
+)
+from tests.mock_provider import LOCATION_KIND, PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3344
+PROVIDER_PORT = 9024
+
+
+class TestTransport:
+    @pytest.mark.asyncio
+    async def test_in_memory_transport(self, monkeypatch):
+        async with MockEngine(port=None) as engine:
+            async with ProviderSdk.create_provider(
+                    "http://mock-engine", engine.admin_key, "localhost", PROVIDER_PORT,
+                    transport=InMemoryTransport(engine.app)
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_in_memory")
+
+                async def move_x(ctx, entity, input):
+                    await ctx.update_status(entity.metadata, {"x": entity.spec.x})
+                    return {"delay_secs": 1}
+
+                location.on("x", move_x)
+                engine.callback_transport = InMemoryTransport(sdk.server.app)
+                await sdk.register()
+                async with EntityCRUD(
+                        "http://mock-engine", "mock_in_memory", PROVIDER_VERSION, "Location", engine.admin_key,
+                        transport=InMemoryTransport(engine.app)
+                ) as client:
+                    created = await client.create({"spec": {"x": 10, "y": 11}})
+                    watcher, entity = await client.update_and_wait(created.metadata, {"x": 30, "y": 11}, 10)
+                    assert watcher.status == IntentfulStatus.Completed_Successfully
+                    assert entity.status.x == 30
+                    with pytest.raises(ApiException) as e:
+                        await client.get(AttributeDict(uuid="missing"))
+                    assert e.value.status == 404
+                await sdk.server.close()
+            # It dispatches to aiohttp internals, other major versions are refused up front
+            monkeypatch.setattr(aiohttp, "__version__", "4.0.0")
+            with pytest.raises(Exception, match="does not support aiohttp 4.0.0"):
+                InMemoryTransport(engine.app)
+
+    @pytest.mark.asyncio
+    async def test_unix_socket_transport(self, tmp_path):
+        engine_socket = str(tmp_path / "engine.sock")
+        provider_socket = str(tmp_path / "provider.sock")
+        async with MockEngine(unix_socket=engine_socket) as engine:
+            assert engine.url == f"unix://{engine_socket}"
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, None, None, unix_socket=provider_socket
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_unix")
+
+                async def move_x(ctx, entity, input):
+                    await ctx.update_status(entity.metadata, {"x": entity.spec.x})
+                    return {"delay_secs": 1}
+
+                location.on("x", move_x)
+                await sdk.register()
+                async with EntityCRUD(engine.url, "mock_unix", PROVIDER_VERSION, "Location", engine.admin_key) as client:
+                    created = await client.create({"spec": {"x": 1, "y": 2}})
+                    watcher, entity = await client.update_and_wait(created.metadata, {"x": 5, "y": 2}, 10)
+                    assert watcher.status == IntentfulStatus.Completed_Successfully
+                    assert entity.status.x == 5
+                await sdk.server.close()
+
+    @pytest.mark.asyncio
+    async def test_record_and_replay(self, tmp_path):
+        class BinaryTransport(Transport):
+            def request(self, method, url, data, headers, ssl_context):
+                async def respond():
+                    return TransportResponse(200, {"Content-Type": "application/octet-stream"}, b"\x1f\x8b\xff\x00")
+
+                return AwaitedResponse(respond())
+
+        recording_path = str(tmp_path / "recording.ndjson")
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_record", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            recording = RecordingTransport(recording_path, SessionTransport(10))
+            async with EntityCRUD(
+                    engine.url, "mock_record", PROVIDER_VERSION, "Object", engine.admin_key, transport=recording
+            ) as client:
+                created = await client.create({"spec": {"name": "object"}})
+                recorded = await client.get(created.metadata)
+            await recording.close()
+        binary = RecordingTransport(recording_path, BinaryTransport())
+        async with binary.request("get", f"{engine.url}/binary", None, CIMultiDict(), None) as resp:
+            assert await resp.read() == b"\x1f\x8b\xff\x00"
+        await binary.close()
+
+        # The engine is gone, responses come from the recording
+        with pytest.raises(TypeError):
+            Transport()
+        replay = ReplayTransport(recording_path)
+        async with EntityCRUD(
+                engine.url, "mock_record", PROVIDER_VERSION, "Object", engine.admin_key, transport=replay
+        ) as client:
+            assert await client.get(created.metadata) == recorded
+        async with replay.request("get", "http://elsewhere/binary", None, CIMultiDict(), None) as resp:
+            assert resp.headers["Content-Type"] == "application/octet-stream"
+            assert await resp.read() == b"\x1f\x8b\xff\x00"
+
+    @pytest.mark.asyncio
+    async def test_api_instance_timeouts_are_seconds(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ApiInstance(f"{engine.url}/services/intent_watcher", timeout=60, logger=logging.getLogger()) as api:
+                assert api.transport.session.timeout.total == 60
+                assert api.transport.session.timeout.sock_connect is None
+                assert (await api.get("")).results == []
+            async with ApiInstance(engine.url, connect_timeout=2, logger=logging.getLogger()) as api:
+                assert api.transport.session.timeout.total == 5000
+                assert api.transport.session.timeout.sock_connect == 2
+
+    @pytest.mark.asyncio
+    async def test_warm_up_opens_keep_alive_connections(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            transport = SessionTransport(connect_timeout=10, keepalive_timeout=60)
+            await register_kinds(
+                engine, "mock_warm_up", [SPEC_ONLY_KIND], PROVIDER_PORT, transport=transport, warm_connections=4
+            )
+            assert len(transport.session.connector._conns) == 1
+            assert sum(len(conns) for conns in transport.session.connector._conns.values()) == 4
+            async with EntityCRUD(
+                    engine.url, "mock_warm_up", PROVIDER_VERSION, "Object", engine.admin_key, transport=transport,
+                    warm_connections=2
+            ) as client:
+                await client.api_instance.renew_session()
+                await client.api_instance._warm_up_task
+                assert sum(len(conns) for conns in transport.session.connector._conns.values()) == 2
+                await client.create({"spec": {"name": "object"}})
+            await transport.close()
+        assert engine_root(f"{engine.url}/services/mock_warm_up/{PROVIDER_VERSION}/Object") == f"{engine.url}/"
+        assert engine_root("unix:///var/run/papiea.sock/services/a/1/Object") == "unix://%2Fvar%2Frun%2Fpapiea.sock/"
@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from papiea.client import EntityCRUD, IntentWatcherClient
+from papiea.core import EntityEventType, IntentfulStatus
+from papiea.mock_engine import MockEngine
+from papiea.python_sdk import ProviderSdk
+from papiea.watch import PollingChangeSource
+from tests.mock_provider import LOCATION_KIND, PROVIDER_VERSION, SPEC_ONLY_KIND, register_kinds
+
+MOCK_ENGINE_PORT = 3341
+PROVIDER_PORT = 9021
+
+
+class TestWatch:
+    @pytest.mark.asyncio
+    async def test_watch_polls_only_changed_entities(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            await register_kinds(engine, "mock_watch", [SPEC_ONLY_KIND], PROVIDER_PORT)
+            async with EntityCRUD(engine.url, "mock_watch", PROVIDER_VERSION, "Object", engine.admin_key) as client:
+                for i in range(30):
+                    await client.create({"spec": {"name": f"object_{i}"}})
+                await asyncio.sleep(0.1)
+                first = await client.create({"spec": {"name": "watched"}})
+                second = await client.create({"spec": {"name": "other"}})
+                polled = []
+                filter_entities = client.filter
+
+                async def counting_filter(filter_obj, deleted=False):
+                    res = await filter_entities(filter_obj, deleted)
+                    polled.append(len(res.results))
+                    return res
+
+                client.filter = counting_filter
+                filter_obj = {"spec": {"name": "watched"}}
+                events = client.watch(filter_obj, PollingChangeSource(client, filter_obj, interval=0.05, lookback_ms=50))
+                next_event = asyncio.ensure_future(events.__anext__())
+                await asyncio.sleep(0.2)
+                polled.clear()
+                await client.update(second.metadata, {"name": "watched"})
+                assert (await next_event).type == EntityEventType.Created
+                await client.update(first.metadata, {"name": "renamed"})
+                event = await asyncio.wait_for(events.__anext__(), 1)
+                assert event.type == EntityEventType.Left and event.entity.metadata.uuid == first.metadata.uuid
+                assert event.old_spec_version == 1 and event.new_spec_version == 2
+                entity = await client.get(second.metadata)
+                await client.update(entity.metadata, {"name": "watched"})
+                event = await asyncio.wait_for(events.__anext__(), 1)
+                assert event.type == EntityEventType.Updated and event.new_spec_version == 3
+                await client.delete(second.metadata)
+                event = await asyncio.wait_for(events.__anext__(), 1)
+                assert event.type == EntityEventType.Deleted and event.entity.metadata.uuid == second.metadata.uuid
+                # Polls only read the entities changed within the lookback, never the whole kind
+                assert max(polled) <= 2
+                await events.aclose()
+
+    @pytest.mark.asyncio
+    async def test_watch_transitions_scans_only_recent_changes(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_transitions")
+
+                async def move_x(ctx, entity, input):
+                    return {"delay_secs": 100}
+
+                location.on("x", move_x)
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_transitions", PROVIDER_VERSION, "Location", engine.admin_key
+                ) as client, IntentWatcherClient(engine.url, engine.admin_key) as watchers:
+                    entities = [(await client.create({"spec": {"x": 0, "y": 0}})).metadata for i in range(12)]
+                    updates = [await client.update(metadata, {"x": 1, "y": 0}) for metadata in entities]
+                    # Outdates the first watchers of two entities
+                    for update in updates[:2]:
+                        await client.update(update.metadata, {"x": 2, "y": 0})
+                    posted = []
+                    post = watchers.api_instance.post
+
+                    async def recording_post(prefix, data, headers={}):
+                        res = await post(prefix, data, headers)
+                        posted.append((prefix, data, len(res.results)))
+                        return res
+
+                    watchers.api_instance.post = recording_post
+                    transitions = watchers.watch_transitions(interval=0.05, batch_size=5)
+                    first = asyncio.ensure_future(transitions.__anext__())
+                    while len(posted) < 5:
+                        await asyncio.sleep(0.005)
+                    # The newest creation, 12 active watchers loaded in pages of 5, then the newest changes
+                    assert [results for _, _, results in posted] == [1, 5, 5, 2, 5]
+                    assert posted[1][1]["status"] == {"$in": [IntentfulStatus.Pending, IntentfulStatus.Active]}
+                    completed = [engine.watchers[update.intent_watcher.uuid] for update in updates[5:7]]
+                    for watcher in completed:
+                        engine._set_watcher_status(watcher, IntentfulStatus.Completed_Successfully)
+                    seen = [await first, await transitions.__anext__()]
+                    assert {watcher.uuid for watcher, _, _ in seen} == {watcher["uuid"] for watcher in completed}
+                    assert all(
+                        (old, new) == (IntentfulStatus.Active, IntentfulStatus.Completed_Successfully)
+                        for _, old, new in seen
+                    )
+                    # Scans stop at the first watcher created or changed before the previous scan, in its first page
+                    scans = posted[5:]
+                    assert [("created_at" in prefix, "last_status_changed" in prefix) for prefix, _, _ in scans] == \
+                        [(True, False), (False, True)] * (len(scans) // 2)
+                    # The new watcher of an update never changed status, it has no last_status_changed
+                    outdated = updates[9].intent_watcher
+                    fresh = (await client.update(updates[9].metadata, {"x": 3, "y": 0})).intent_watcher
+                    assert fresh.last_status_changed is None
+                    seen = [await asyncio.wait_for(transitions.__anext__(), 5) for i in range(2)]
+                    assert [(watcher.uuid, old, new) for watcher, old, new in seen] == [
+                        (fresh.uuid, None, IntentfulStatus.Active),
+                        (outdated.uuid, IntentfulStatus.Active, IntentfulStatus.Outdated),
+                    ]
+                    posted.clear()
+                    idle = asyncio.ensure_future(transitions.__anext__())
+                    await asyncio.sleep(0.2)
+                    idle.cancel()
+                    assert len(posted) >= 2 and all(results == 5 for _, _, results in posted)
+                await sdk.server.close()
+
+    @pytest.mark.asyncio
+    async def test_wait_for_completion_polls_awaited_watchers(self):
+        async with MockEngine(port=MOCK_ENGINE_PORT) as engine:
+            async with ProviderSdk.create_provider(
+                    engine.url, engine.admin_key, "localhost", PROVIDER_PORT
+            ) as sdk:
+                location = sdk.new_kind(LOCATION_KIND)
+                sdk.version(PROVIDER_VERSION)
+                sdk.prefix("mock_wait")
+
+                async def move_x(ctx, entity, input):
+                    await ctx.update_status(entity.metadata, {"x": entity.spec.x, "y": entity.status.y})
+                    return {"delay_secs": 1}
+
+                async def stuck_y(ctx, entity, input):
+                    return {"delay_secs": 1}
+
+                location.on("x", move_x)
+                location.on("y", stuck_y)
+                await sdk.register()
+                async with EntityCRUD(
+                        engine.url, "mock_wait", PROVIDER_VERSION, "Location", engine.admin_key
+                ) as client, IntentWatcherClient(engine.url, engine.admin_key) as watchers:
+                    watcher, entity = await client.create_and_wait({"spec": {"x": 1, "y": 1}})
+                    assert watcher is None and entity.status.x == 1
+                    polled = []
+                    filter_intent_watcher = watchers.filter_intent_watcher
+
+                    async def recording_filter(filter_obj, offset=None, limit=None, sort=None):
+                        polled.append(filter_obj["uuid"]["$in"])
+                        return await filter_intent_watcher(filter_obj, offset, limit, sort)
+
+                    watchers.filter_intent_watcher = recording_filter
+                    entities = [(await client.create({"spec": {"x": i, "y": 0}})).metadata for i in range(3)]
+                    updates = [await client.update(metadata, {"x": 10, "y": 0}) for metadata in entities]
+                    stuck = await client.update(entity.metadata, {"x": 1, "y": 2})
+                    awaited = {update.intent_watcher.uuid for update in updates}
+                    completed = await asyncio.gather(*[
+                        watchers.wait_for_completion(update.intent_watcher, 10) for update in updates
+                    ])
+                    assert all(watcher.status == IntentfulStatus.Completed_Successfully for watcher in completed)
+                    # Each poll asks for the awaited watchers only, in a single filter
+                    assert all(set(uuids) <= awaited for uuids in polled)
+                    with pytest.raises(asyncio.TimeoutError):
+                        await watchers.wait_for_completion(stuck.intent_watcher, 1.2)
+                    assert polled[-1] == [stuck.intent_watcher.uuid]
+                await sdk.server.close()